@@ -0,0 +1,333 @@
+#!/usr/bin/python
+"""
+Benchmark the stages of event generation for all input formats and channels.
+
+Writes small synthetic input files for each input format into a temporary
+directory, so no real simulation data (or network access) is needed. For each
+combination of format and interaction channel, it then times parsing the input
+(parse_input, prepare_evt_gen), calculating event rates, sampling energies and
+directions (get_eNu, get_direction, get_eE), the complete event generation
+(gen_evts) and writing the output file (write_output).
+
+Results are printed (or saved) as JSON, including calls and events per second
+for each stage and the peak memory use of the whole process. (The peak cannot be
+attributed to single stages, since it never decreases while the process runs.)
+Use `--baseline` to compare against the results of an earlier run, e.g. of the
+previous release.
+
+See `python benchmark.py -h` for usage information.
+"""
+
+import argparse
+from contextlib import contextmanager
+from importlib import import_module
+import json
+import numpy as np
+import os
+import platform
+import resource
+import scipy
+from scipy import interpolate
+import shutil
+import sys
+import tempfile
+import time
+
+import channel as channel_module
+from channel import Generator, time_bins
+import genevts
+
+formats = ["garching", "nakazato", "princeton", "totani"]
+channels = ["ibd", "es", "o16e", "o16eb"]
+window = (100, 300) # start & end time (ms) of all benchmarks
+
+
+"""Synthetic input files.
+
+The spectra are simple quasi-thermal spectra with a smoothly varying
+temperature and luminosity; they only need to have the right format and
+plausible sizes, not to be physically meaningful. All files cover at least
+0-1000 ms after core bounce.
+"""
+def write_garching(directory, rs):
+    # time (s), then mean energy, mean squared energy & luminosity for e, eb & x
+    lines = []
+    for t in np.linspace(0, 1, 401):
+        row = [t]
+        for (e, lum) in ((10., 4e52), (13., 5e52), (15., 4e52)):
+            mean_e = e * (1 + 0.2 * t) + 0.05 * rs.rand()
+            row += [mean_e, mean_e**2 * 1.3, lum * (1 + np.exp(-5 * t))]
+        lines.append(", ".join("%.6e" % v for v in row))
+    filename = os.path.join(directory, "garching.txt")
+    with open(filename, 'w') as f:
+        f.write("# synthetic input for benchmark.py\n" + "\n".join(lines) + "\n")
+    return filename
+
+def write_nakazato(directory, rs):
+    # per time bin: one line with the time (s), 20 lines with
+    # E_lo E_hi N_e N_eb N_x L_e L_eb L_x (1/s/MeV & erg/s/MeV), then an empty line
+    edges = np.logspace(np.log10(0.6), np.log10(300), 21)
+    lines = []
+    for t in np.linspace(-0.05, 1.2, 126):
+        lines.append("%.6e" % t)
+        T = np.array([4., 5., 6.]) * (1 + 0.3 * np.exp(-t))
+        for (lo, hi) in zip(edges[:-1], edges[1:]):
+            e_mean = np.sqrt(lo * hi) * (1 + 0.02 * rs.rand(3))
+            n = 1e53 * (hi - lo) * e_mean**2 * np.exp(-e_mean / T) / (1 + t) + 1e30
+            lines.append(" ".join("%.6e" % v for v in [lo, hi] + list(n) + list(n * e_mean / 624.151 / 1000)))
+        lines.append("")
+    filename = os.path.join(directory, "nakazato.data")
+    with open(filename, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return filename
+
+def write_princeton(directory, rs):
+    # time (s), then dL/dE (10^50 erg/s/MeV) in 20 energy bins for e, eb & x
+    lines = ["# synthetic input for benchmark.py"]
+    for t in np.linspace(0.0317, 1.2, 235):
+        row = [t]
+        for (e_max, T) in ((300, 4.), (100, 5.), (100, 6.)):
+            e = np.array([e_max**((i+0.5) * 0.05) for i in range(1, 21)])
+            row.extend(e**3 * np.exp(-e / T) * (1 + 0.5 * t + 0.01 * rs.rand()) * 1e-3)
+        lines.append(" ".join("%.6e" % v for v in row))
+    filename = os.path.join(directory, "princeton.dat")
+    with open(filename, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return filename
+
+def write_totani(directory, rs):
+    # see formats/totani.py for the (fixed) layout of the three files
+    energies = np.logspace(np.log10(1000.), np.log10(120000.), 20) # keV
+    def spectrum(T):
+        e = energies / 1000.
+        return np.array([e**2 * np.exp(-e / (T * k)) for k in (1.0, 1.3, 1.6)]).T * (1 + 0.05 * rs.rand(20, 3))
+
+    prefix = os.path.join(directory, "totani")
+    for (name, times, n_lines, line_N, first_egroup) in (("early", np.linspace(0.0, 0.54, 26), 42, 6, 19),
+                                                         ("late", np.linspace(0.6, 17.5, 36), 46, 8, 21)):
+        lines = []
+        for t in times:
+            chunk = ["filler"] * n_lines
+            chunk[0] = "%.6e time" % t
+            chunk[line_N] = "%.6e %.6e %.6e" % tuple(np.array([1e55, 0.8e55, 3e55]) * (t + 0.01)**0.7)
+            spec = spectrum(3 + 2 * t)
+            for (k, i) in enumerate(range(first_egroup, first_egroup + 20)):
+                chunk[i] = "%d %.6e 0.0 %.6e %.6e %.6e" % ((k, energies[k]) + tuple(spec[k] * 1e52))
+            lines.extend(chunk)
+        with open("%s-%s.txt" % (prefix, name), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+    lines = []
+    for i in range(99):
+        chunk = ["filler"] * 26
+        chunk[0] = "time = %.6e" % ((507.5 + 0.2 * (i - 6)) / 1000)
+        chunk[1] = "lum = %.6e" % (3e53 * (1 + 0.3 * np.sin(i)))
+        spec = spectrum(2.5)
+        for (k, j) in enumerate(range(3, 23)):
+            chunk[j] = "%d %.6e %.6e 0 0" % (k, energies[k], spec[k, 0] * 1e50)
+        lines.extend(chunk)
+    with open(prefix + "-nb.txt", 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return prefix
+
+
+"""Helper functions."""
+def measure(func, repeat=3, setup=None):
+    """Call func() (or func(setup()), if setup is given) `repeat` times.
+
+    Returns the shortest time (in s) and the result of the last call.
+    Time spent in setup() is not included.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.time()
+        result = func(*args)
+        best = min(best, time.time() - start)
+    return (best, result)
+
+def peak_memory():
+    """Peak memory use (resident set size, in MB) of this process so far.
+
+    This is the maximum over the whole lifetime of the process, so it is only
+    reported once, for the complete benchmark.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024. # ru_maxrss is in kB on Linux
+
+@contextmanager
+def quiet():
+    """Suppress output to stdout, e.g. from parsers and gen_evts()."""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def clear_tables():
+    """Forget cross section tables, so that each repetition has to compute them again."""
+    channel_module.direction_tables.clear()
+    channel_module.sigma_tables.clear()
+
+
+def run(input, format, channel, n_events=100000, repeat=3, integrator='fast', output_dir=None):
+    """Time all stages of event generation for one input format and channel.
+
+    Events are spread evenly over the time bins in `window`. Stages that
+    compute cross section tables when they are first needed (event_rates,
+    get_direction and gen_evts) include that time, like in a single run of
+    genevts.py.
+    Returns a list of results, one per stage.
+    """
+    flavor = import_module("interaction_channels." + channel).Channel.possible_flavors[0]
+    generator = Generator(channel, flavor, input, format, flavor, integrator=integrator)
+    FluxModel = import_module("formats." + format).FluxModel
+    (starttime, endtime) = window
+    binned_t = time_bins(starttime, endtime)
+    n = np.full(len(binned_t), n_events // len(binned_t))
+    np_rng = np.random.RandomState(0)
+
+    results = []
+    def add(stage, seconds, calls, events=None):
+        result = {'format': format, 'channel': channel, 'flavor': flavor, 'stage': stage,
+                  'seconds': seconds, 'calls': calls, 'calls_per_second': calls / seconds if seconds else None}
+        if events is not None:
+            result['events'] = events
+            result['events_per_second'] = events / seconds if seconds else None
+        results.append(result)
+
+    with quiet():
+        parse = lambda flux: flux.parse_input(input, flavor, starttime, endtime)
+        (seconds, (_, _, raw_times)) = measure(parse, repeat, setup=FluxModel)
+        add('parse_input', seconds, 1)
+
+        def setup():
+            flux = FluxModel()
+            parse(flux)
+            return flux
+        (seconds, _) = measure(lambda flux: flux.prepare_evt_gen(binned_t), repeat, setup=setup)
+        add('prepare_evt_gen', seconds, 1)
+        flux = setup()
+        flux.prepare_evt_gen(binned_t)
+        generator.flux = flux
+
+        (seconds, rates) = measure(lambda _: generator.event_rates(raw_times), repeat, setup=clear_tables)
+        add('event_rates', seconds, len(raw_times))
+
+        (seconds, eNu) = measure(lambda: generator.get_eNu_vec(binned_t, n, np_rng), repeat)
+        add('get_eNu', seconds, len(binned_t), len(eNu))
+
+        (seconds, (dirx, diry, dirz)) = measure(lambda _: generator.get_direction(eNu, 'table', np_rng=np_rng),
+                                                repeat, setup=clear_tables)
+        add('get_direction', seconds, 1, len(eNu))
+
+        (seconds, eE) = measure(lambda: generator.channel.get_eE_vec(eNu, dirz, np_rng), repeat)
+        add('get_eE', seconds, 1, len(eNu))
+
+        # choose the scale so that gen_evts() generates about n_events events
+        expected = sum(interpolate.pchip(raw_times, rates)(binned_t)) * generator.channel.targets_per_molecule
+        scale = n_events / expected if expected > 0 else 0
+        gen_evts = lambda _: generator.gen_evts(scale, starttime, endtime, seed=[0])
+        (seconds, events) = measure(gen_evts, repeat, setup=clear_tables)
+        add('gen_evts', seconds, 1, len(events))
+
+        args = argparse.Namespace(detector="HyperK", verbose=None)
+        outfile = os.path.join(output_dir or tempfile.gettempdir(), "benchmark-%s-%s.kin" % (format, channel))
+        (seconds, _) = measure(lambda: genevts.write_output(iter(events), outfile, args, seed=0), repeat)
+        add('write_output', seconds, 1, len(events))
+        os.remove(outfile)
+
+    return results
+
+
+def compare(results, baseline, threshold, min_seconds=0.001):
+    """Compare results with a baseline; returns a list of stages that are slower by more than `threshold`.
+
+    Stages that take less than `min_seconds` are too short to be timed reliably,
+    so they never count as slower.
+    """
+    key = lambda result: (result['format'], result['channel'], result['stage'])
+    old = dict((key(result), result) for result in baseline['results'])
+    regressions = []
+    print >> sys.stderr, "%-10s %-6s %-16s %10s %10s %7s" % ("format", "channel", "stage", "baseline", "now", "ratio")
+    for result in results:
+        if not old.has_key(key(result)):
+            continue
+        (before, now) = (old[key(result)]['seconds'], result['seconds'])
+        ratio = now / before if before else float('inf')
+        flag = ""
+        if ratio > 1 + threshold and now >= min_seconds:
+            regressions.append(key(result))
+            flag = "  <-- slower"
+        print >> sys.stderr, "%-10s %-6s %-16s %9.4fs %9.4fs %7.2f%s" % (key(result) + (before, now, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--format", metavar="FORMAT", choices=formats, nargs="+", default=formats,
+                        help="Input format(s) to benchmark. Choices: %s. Default: all formats." % formats)
+    parser.add_argument("-c", "--channel", metavar="CHANNEL", choices=channels, nargs="+", default=channels,
+                        help="Interaction channel(s) to benchmark. Choices: %s. Default: all channels." % channels)
+
+    default = 100000
+    parser.add_argument("-n", "--events", metavar="N", type=int, default=default,
+                        help="Number of events to generate for each format and channel. Default: %s" % default)
+
+    default = 3
+    parser.add_argument("-r", "--repeat", metavar="N", type=int, default=default,
+                        help="Run each stage N times and report the shortest time. Default: %s" % default)
+
+    choices = ["scipy", "fast"]
+    default = choices[1]
+    parser.add_argument("--integrator", metavar="INTEGRATOR", choices=choices, default=default,
+                        help="Method for calculating event rates, see genevts.py. Choices: %s. Default: %s" % (choices, default))
+
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="Save results as JSON to this file. Default: print them.")
+
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="Compare with results (JSON) of an earlier run; the exit status is 1 if any stage \
+                              is slower than the baseline by more than the threshold.")
+
+    default = 0.2
+    parser.add_argument("--threshold", metavar="X", type=float, default=default,
+                        help="Relative slow-down that counts as a regression when comparing with a baseline. \
+                              Default: %s" % default)
+    args = parser.parse_args()
+
+    input_dir = tempfile.mkdtemp()
+    try:
+        rs = np.random.RandomState(0)
+        inputs = dict((format, globals()["write_" + format](input_dir, rs)) for format in args.format)
+        results = []
+        for format in args.format:
+            for channel in args.channel:
+                print >> sys.stderr, "Benchmarking %s + %s ..." % (format, channel)
+                results.extend(run(inputs[format], format, channel, args.events, args.repeat, args.integrator, input_dir))
+    finally:
+        shutil.rmtree(input_dir)
+
+    report = {'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                              'scipy': scipy.__version__, 'platform': platform.platform()},
+              'options': {'events': args.events, 'repeat': args.repeat, 'integrator': args.integrator,
+                          'window': window},
+              'peak_memory_mb': peak_memory(),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    else:
+        print json.dumps(report, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print >> sys.stderr, "%d stage(s) slower than baseline." % len(regressions)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
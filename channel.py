@@ -1,155 +1,842 @@
 #!/usr/bin/python
 
+import bisect
+from collections import OrderedDict
+import hashlib
 from importlib import import_module
-from math import pi, sin, cos, acos
+import itertools
+from math import pi
+from multiprocessing import Pool
 import numpy as np
+import os
 import random
+import sys
 from scipy import integrate, interpolate
+import threading
 
+from flux_cube import FluxCube
+from profiling import Profile
+from xs_tables import XSTable, column_grid
 
-def setup(_channel, _format):
-    global channel, format, cached_flux
-    channel = import_module("interaction_channels." + _channel)
-    format = import_module("formats." + _format)
+shard_size = 100 # maximum number of time bins per shard, see Generator.iter_evts()
+bin_width = 1 # in ms
+max_bin_width = 1000 # in ms, for adaptive time bins, see adaptive_time_bins()
 
-    # dFlux_dE(eNu, time) is called hundreds of times for each generated event,
-    # often with repetitive arguments (when integrating ddEventRate over eE).
-    # To save time, we cache results in a dictionary.
-    cached_flux = {}
 
-    # Set options for numerical integration. Not needed for all channels, so
-    # default to returning an empty dictionary.
-    if not hasattr(channel, '_opts'):
-        channel._opts = lambda *args: {'points': []}
+class Generator(object):
+    """Generate events for one interaction channel and (detected) neutrino flavor.
 
-    return channel, format
-
-
-def gen_evts(_channel, input, _format, inflv, scale, starttime, endtime, verbose):
-    """Generate events.
-
-    * Get event rate by interpolating from time steps in the input data.
-    * For each 1ms bin, get number of events from a Poisson distribution.
-    * Generate these events from time-dependent energy & direction distribution.
+    A generator holds all of its state (interaction channel, flux model, flux
+    cache, ...), so several generators can be used in the same process, e.g.
+    by a library or by several threads at the same time.
 
     Arguments:
-    _channel -- abbreviation of interaction channel, e.g. 'ibd', 'es', ...
+    channel -- abbreviation of interaction channel, e.g. 'ibd', 'es', ...
+    flavor -- detected neutrino flavor, e.g. 'e', 'eb', 'x', 'xb'
     input -- name (or common prefix) of file(s) containing neutrino fluxes
-    _format -- which parser (in folder `formats/`) to use for input file(s)
+    format -- which parser (in folder `formats/`) to use for input file(s)
     inflv -- original neutrino flavor (at time of production in the SN)
-    scale -- constant factor, accounts for oscillation probability, distance of SN, size of detector
-    starttime -- start time set by user via command line option (or None)
-    endtime -- end time set by user via command line option (or None)
+    flux_cache_size -- maximum number of values in the cache for dFlux_dE
+    flux_quantum -- if set, round neutrino energies to multiples of this (in MeV) before looking up the flux
+    rate_cache -- directory for caching event rates at the time steps in the input data (or None)
+    integrator -- 'scipy' (adaptive quadrature) or 'fast' (fixed-order Gauss-Legendre, see fast_rates())
+    xs_tables -- directory containing cross section tables created by xs_tables.py (or None)
+    flux_store -- FluxStore to get the parsed input from; share one between generators
+                  to parse each input only once (default: a new FluxStore)
     """
-    setup(_channel, _format) # import appropriate modules
-    scale *= channel.targets_per_molecule
-    thr_e = 3.511 # detection threshold in HK: 3 MeV kinetic energy + rest mass
-
-    (starttime, endtime, raw_times) = format.parse_input(input, inflv, starttime, endtime)
-
-    # integrate over eE and then eNu to obtain the event rate at time t
-    raw_nevts = [scale * integrate.nquad(ddEventRate, [channel.bounds_eE, channel.bounds_eNu], args=[t], opts=[channel._opts,{}])[0]
-                 for t in raw_times]
-    event_rate = interpolate.pchip(raw_times, raw_nevts)
-
-    bin_width = 1 # in ms
-    n_bins = int((endtime - starttime)/bin_width) # number of full-width bins; int() implies floor()
-    if verbose: print "Now generating events in", bin_width, "ms bins from", starttime, "to", endtime, "ms"
-
-    # scipy is optimized for operating on large arrays, making it orders of
-    # magnitude faster to pre-compute all values of the interpolated functions.
-    binned_t = [starttime + (i+0.5)*bin_width for i in range(n_bins)]
-    binned_nevt_th = event_rate(binned_t)
-    # check for unphysical values of interpolated function event_rate(t)
-    for _i, _n in enumerate(binned_nevt_th):
-        if _n < 0:
-            binned_nevt_th[_i] = 0
-    binned_nevt = np.random.poisson(binned_nevt_th) # Get random number of events in each bin from Poisson distribution
-    format.prepare_evt_gen(binned_t) # give flux script a chance to pre-compute values
-
-    if verbose: # compute events above threshold energy `thr_e`
-        thr_bounds_eE = lambda _eNu, *args: [max(thr_e, channel.bounds_eE(_eNu)[0]), max(thr_e, channel.bounds_eE(_eNu)[1])]
-        thr_raw_nevts = [scale * integrate.nquad(ddEventRate, [thr_bounds_eE, channel.bounds_eNu], args=[t], opts=[channel._opts,{}])[0]
-                         for t in raw_times]
-        thr_event_rate = interpolate.pchip(raw_times, thr_raw_nevts)
-        thr_binned_nevt_th = thr_event_rate(binned_t)
-        thr_nevt = sum(binned_nevt)
-
-    events = []
-    for i in range(n_bins):
-        t0 = starttime + i * bin_width
-
-        if verbose and i%(10**(4-verbose)) == 0:
-            print "%s-%s ms: %d events (%.5f expected)" % (t0, t0+bin_width, binned_nevt[i], binned_nevt_th[i])
-
-        # generate events in this time bin
-        for _ in range(binned_nevt[i]):
-            t = t0 + random.random() * bin_width
-            eNu = get_eNu(binned_t[i])
-            (dirx, diry, dirz) = get_direction(eNu)
-            eE = channel.get_eE(eNu, dirz)
-            if verbose and eE < thr_e: thr_nevt -= 1
-            events.append((t, channel.pid, eE, dirx, diry, dirz, _channel, _flavor, eNu))
-
-    print "Generated %s particles (expected: %.2f particles)" % (sum(binned_nevt), sum(binned_nevt_th))
-    if verbose:
-        print "-> above threshold of %s MeV: %s particles (expected: %.2f)" % (thr_e, thr_nevt, sum(thr_binned_nevt_th))
-        print "**************************************"
-
-    return events
+    def __init__(self, channel, flavor, input, format, inflv, flux_cache_size=100000, flux_quantum=None,
+                 rate_cache=None, integrator='scipy', xs_tables=None, flux_store=None):
+        self.channel = import_module("interaction_channels." + channel).Channel(flavor)
+        self.input = input
+        self.format = format
+        self.inflv = inflv
+        self.flux_store = flux_store if flux_store is not None else FluxStore()
+
+        # dFlux_dE(eNu, time) is called hundreds of times for each generated event,
+        # often with repetitive arguments (when integrating ddEventRate over eE).
+        # To save time, we cache results.
+        self.flux_cache = FluxCache(flux_cache_size, flux_quantum)
+        self.rate_cache = rate_cache
+        self.integrator = integrator
+
+        # Use precomputed cross section tables (see xs_tables.py), if available.
+        # Otherwise, calculate cross sections directly in the channel.
+        self.xs = XSTable(xs_tables, channel, flavor) if xs_tables else self.channel
+
+        # wall & CPU time of each stage and counters, see profiling.py
+        self.profile = Profile()
+
+    def gen_evts(self, scale, starttime=None, endtime=None, verbose=False, sampler='table', seed=None, processes=1):
+        """Generate events.
+
+        * Get event rate by interpolating from time steps in the input data.
+          The event rate at each time step is the product of the total cross section
+          sigma(eNu), which is tabulated once, and the flux, integrated over eNu.
+        * For each time bin, get number of events from a Poisson distribution.
+          Time bins are 1ms wide or adaptive (see `bin_tolerance` in FluxStore).
+        * Generate these events from time-dependent energy & direction distribution.
+          Time bins are split into shards of up to `shard_size` bins each, which
+          can be generated in parallel and use independent random number streams.
+
+        Arguments:
+        scale -- constant factor, accounts for oscillation probability, distance of SN, size of detector
+        starttime -- start time set by user via command line option (or None)
+        endtime -- end time set by user via command line option (or None)
+        sampler -- 'table' (tabulated distributions) or 'rejection' (slow, but useful for validation)
+        seed -- list of integers; shard k uses the random seed `seed + [k]` (default: random seed)
+        processes -- number of worker processes for generating shards in parallel
+
+        Returns a list of events, sorted by time.
+        """
+        return list(self.iter_evts(scale, starttime, endtime, verbose, sampler, seed, processes, window=None))
+
+    def iter_evts(self, scale, starttime=None, endtime=None, verbose=False, sampler='table', seed=None, processes=1,
+                  window=1000):
+        """Generate events window by window and yield them in time order.
+
+        Like gen_evts() (see there for the other arguments), but events are
+        generated `window` ms at a time and each window is yielded before the
+        next one is generated, so only one window of events is held in memory.
+        Windows consist of whole shards (i.e. they may be longer than `window`),
+        so events are identical to those from gen_evts() with the same seed.
+        If window is None, all time bins form one window.
+        """
+        scale *= self.channel.targets_per_molecule
+        thr_e = 3.511 # detection threshold in HK: 3 MeV kinetic energy + rest mass
+
+        (binned_t, edges) = self.flux_store.time_bins(self.input, self.format, self.inflv, starttime, endtime)
+        (self.flux, starttime, endtime, raw_times) = self.flux_store.get(self.input, self.format, self.inflv, starttime, endtime)
+        n_bins = len(binned_t)
+        widths = np.diff(edges)
+
+        cache_stats = self.flux_cache.stats()
+        with self.profile.stage("rate integration"):
+            # integrate over eNu to obtain the event rate at time t. The integral over
+            # eE does not depend on time and is tabulated once, see sigma().
+            rates = lambda times: self.event_rates(times, None, verbose)
+            cache_file = self.rate_cache_file("all") if self.rate_cache else None
+            raw_nevts = [scale * n for n in cached_rates(raw_times, rates, cache_file)]
+            event_rate = interpolate.pchip(raw_times, raw_nevts)
+
+            # scipy is optimized for operating on large arrays, making it orders of
+            # magnitude faster to pre-compute all values of the interpolated functions.
+            binned_nevt_th = event_rate(binned_t) * widths
+            # check for unphysical values of interpolated function event_rate(t)
+            for _i, _n in enumerate(binned_nevt_th):
+                if _n < 0:
+                    binned_nevt_th[_i] = 0
+
+            if verbose: # compute events above threshold energy `thr_e`
+                thr_rates = lambda times: self.event_rates(times, thr_e, verbose)
+                cache_file = self.rate_cache_file("thr_%s" % thr_e) if self.rate_cache else None
+                thr_raw_nevts = [scale * n for n in cached_rates(raw_times, thr_rates, cache_file)]
+                thr_event_rate = interpolate.pchip(raw_times, thr_raw_nevts)
+                thr_binned_nevt_th = thr_event_rate(binned_t) * widths
+        self._count_flux_cache(self.profile, cache_stats)
+
+        if verbose and n_bins:
+            width = "%g" % widths.min() if widths.min() == widths.max() else "%g-%g" % (widths.min(), widths.max())
+            print "Now generating events in %d bins (%s ms wide) from %s to %s ms" % (n_bins, width, starttime, endtime)
+
+        # Split time bins into shards of `shard_size` bins, but no longer than
+        # `shard_size` 1ms bins (unless a single adaptive bin is longer). Shards
+        # are independent of the number of processes and of windows (see
+        # iter_evts()), so that results are reproducible for a given seed.
+        if seed is None:
+            seed = [random.randint(0, 2**32 - 1)]
+        firsts = []
+        for i in range(n_bins):
+            if not firsts or i - firsts[-1] == shard_size or edges[i] - edges[firsts[-1]] >= shard_size * bin_width:
+                firsts.append(i)
+        shards = [(id(self), seed + [k], i, binned_t[i:j], binned_nevt_th[i:j], edges[i:j+1], sampler, verbose)
+                  for (k, (i, j)) in enumerate(zip(firsts, firsts[1:] + [n_bins]))]
+
+        # Group the shards by the window that their first time bin starts in.
+        windows = itertools.groupby(shards, lambda shard: int((shard[5][0] - starttime) // window) if window else 0)
+
+        if sampler == 'table':
+            with self.profile.stage("sampling"):
+                self.direction_table() # compute once, before worker processes are started
+
+        (n_events, thr_nevt) = (0, 0)
+        _generators[id(self)] = self
+        try:
+            for (_, window_shards) in windows:
+                with self.profile.stage("sampling"):
+                    results = self._map_shards(list(window_shards), processes)
+                events = [evt for (evtlist, _) in results for evt in evtlist]
+                for (_, shard_profile) in results:
+                    self.profile.add(shard_profile)
+                self.profile.count("events", len(events))
+                n_events += len(events)
+                if verbose:
+                    thr_nevt += len([evt for evt in events if evt[2] >= thr_e])
+                for evt in events:
+                    yield evt
+        finally:
+            del _generators[id(self)]
+
+        print "Generated %s particles (expected: %.2f particles)" % (n_events, sum(binned_nevt_th))
+        if verbose:
+            print "-> above threshold of %s MeV: %s particles (expected: %.2f)" % (thr_e, thr_nevt, sum(thr_binned_nevt_th))
+            (hits, misses, evictions) = [self.profile.counters.get(name, 0) for name in
+                                         ('flux_cache_hits', 'flux_cache_misses', 'flux_cache_evictions')]
+            print "Flux cache: %d hits, %d misses (hit rate: %.1f%%), %d evictions" \
+                % (hits, misses, 100. * hits / max(hits + misses, 1), evictions)
+            print "**************************************"
+
+    def gen_shard(self, shard_seed, i_first, binned_t, binned_nevt_th, edges, sampler, verbose):
+        """Generate events in a contiguous range of time bins, with the given edges.
+
+        With the 'table' sampler, all events in the shard are generated at once
+        as arrays, see gen_events_vec(). The 'rejection' sampler generates one
+        event after another.
+        Returns a list of events and a Profile with the counters (e.g. hits,
+        misses and evictions of the flux cache) while generating them.
+        """
+        profile = Profile()
+        cache_stats = self.flux_cache.stats()
+        # Each shard has its own random number generator, so shards generated
+        # at the same time (e.g. in different threads) don't affect each other.
+        np_rng = np.random.RandomState(shard_seed)
+
+        binned_nevt = np_rng.poisson(binned_nevt_th) # Get random number of events in each bin from Poisson distribution
+
+        if verbose:
+            for (j, i) in enumerate(range(i_first, i_first + len(binned_t))):
+                if i%(10**(4-verbose)) == 0:
+                    print "%s-%s ms: %d events (%.5f expected)" % (edges[j], edges[j+1], binned_nevt[j], binned_nevt_th[j])
+
+        if sampler == 'rejection':
+            rng = random.Random(tuple(shard_seed))
+            events = []
+            for (j, t_bin) in enumerate(binned_t):
+                events.extend(self.gen_events(t_bin, binned_nevt[j], edges[j], edges[j+1] - edges[j], rng, np_rng, profile))
+        else:
+            events = self.gen_events_vec(binned_t, binned_nevt, edges, np_rng)
+
+        self._count_flux_cache(profile, cache_stats)
+        return (events, profile)
+
+    # add the hits, misses & evictions of the flux cache since `before` (an
+    # earlier value of self.flux_cache.stats()) to the counters in profile
+    def _count_flux_cache(self, profile, before):
+        for (name, a, b) in zip(('flux_cache_hits', 'flux_cache_misses', 'flux_cache_evictions'),
+                                before, self.flux_cache.stats()):
+            profile.count(name, b - a)
+
+    # generate n events in the time bin [t0, t0 + bin_width], one after another,
+    # using rejection sampling; returns a list of events, sorted by time
+    def gen_events(self, t_bin, n, t0, bin_width, rng=random, np_rng=np.random, profile=None):
+        channel = self.channel
+        events = []
+        eNus = self.get_eNu(t_bin, n, 'rejection', rng, np_rng, profile)
+        for (eNu, dirx, diry, dirz) in zip(eNus, *self.get_direction(eNus, 'rejection', rng, np_rng, profile)):
+            t = t0 + rng.random() * bin_width
+            eE = channel.get_eE(eNu, dirz, rng)
+            events.append((t, channel.pid, eE, dirx, diry, dirz, channel.name, channel.flavor, eNu))
+        return sorted(events)
+
+    # Generate binned_nevt[j] events in each time bin j, where time bin j is
+    # [edges[j], edges[j+1]] and centered on binned_t[j].
+    # Times, energies and directions of all events are drawn as arrays from a
+    # single random number generator, so there is no per-event Python overhead
+    # (except for building the list of events, sorted by time, at the end).
+    def gen_events_vec(self, binned_t, binned_nevt, edges, np_rng=np.random):
+        channel = self.channel
+        binned_nevt = np.asarray(binned_nevt)
+        if binned_nevt.sum() == 0:
+            return []
+
+        bins = np.repeat(np.arange(len(binned_nevt)), binned_nevt) # time bin of each event
+        edges = np.asarray(edges, dtype=float)
+        t = edges[bins] + np_rng.random_sample(len(bins)) * np.diff(edges)[bins]
+        eNu = self.get_eNu_vec(np.asarray(binned_t)[binned_nevt > 0], binned_nevt[binned_nevt > 0], np_rng)
+        (dirx, diry, dirz) = self.get_direction(eNu, 'table', np_rng=np_rng)
+        eE = channel.get_eE_vec(eNu, dirz, np_rng)
+
+        order = np.argsort(t, kind='mergesort')
+        return zip(t[order].tolist(), itertools.repeat(channel.pid), eE[order].tolist(),
+                   dirx[order].tolist(), diry[order].tolist(), dirz[order].tolist(),
+                   itertools.repeat(channel.name), itertools.repeat(channel.flavor), eNu[order].tolist())
+
+    # event rates (per target, before applying `scale`) at the given times, for
+    # events with a detected particle energy above eE_min
+    def event_rates(self, times, eE_min=None, verbose=False):
+        if self.integrator == 'fast':
+            (rates, errors) = self.fast_rates(times, eE_min)
+            if verbose:
+                rel_errors = [e / r for (e, r) in zip(errors, rates) if r > 0]
+                print "Estimated relative error of event rates (fast integrator): < %.1e" % max(rel_errors + [0])
+            return rates
+        # integrate over eNu to obtain the event rate at time t. The integral over
+        # eE does not depend on time and is tabulated once, see sigma().
+        rates = []
+        for t in times:
+            result = integrate.quad(lambda _eNu: self.sigma(_eNu, eE_min) * self.dFlux_dE(_eNu, t),
+                                    *self.channel.bounds_eNu, full_output=1)
+            self.profile.count("rate_integrand_evaluations", result[2]['neval'])
+            rates.append(result[0])
+        return rates
+
+    # Fixed-order alternative to scipy's adaptive quadrature: the integral over eNu
+    # uses `n_panels` equal panels with `order` Gauss-Legendre nodes each, so the
+    # flux is evaluated at the same nodes for all time steps in a single array
+    # operation. The error estimate is the difference to a rule of half the order,
+    # plus the error of the tabulated sigma(eNu) (see _fast_sigma()).
+    def fast_rates(self, times, eE_min=None, n_panels=50, order=8):
+        edges = np.linspace(self.channel.bounds_eNu[0], self.channel.bounds_eNu[1], n_panels + 1)
+        times = np.asarray(times, dtype=float)[:, None]
+        (grid_eNu, grid_sigma, grid_error) = self.sigma_table(eE_min)
+
+        integrals = []
+        for _order in (order, order // 2):
+            (nodes, weights) = gauss_legendre(edges[:-1], edges[1:], _order)
+            (nodes, weights) = (nodes.ravel(), weights.ravel())
+            flux = self.dFlux_dE_vec(nodes, times)
+            self.profile.count("rate_integrand_evaluations", flux.size)
+            integrals.append(flux.dot(np.interp(nodes, grid_eNu, grid_sigma) * weights))
+            if _order == order:
+                sigma_error = flux.dot(np.interp(nodes, grid_eNu, grid_error) * weights)
+
+        return (list(integrals[0]), list(abs(integrals[0] - integrals[1]) + sigma_error))
+
+    # Generate shards in `processes` worker processes. These are forked here, so they
+    # inherit all pre-computed values, and have exited before events are yielded
+    # by iter_evts(). That way, several generators whose events are merged (e.g.
+    # by heapq.merge()) never use more than `processes` processes in total.
+    def _map_shards(self, shards, processes):
+        if processes <= 1:
+            return map(gen_shard, shards)
+        pool = Pool(processes)
+        try:
+            return pool.map(gen_shard, shards)
+        finally:
+            pool.close()
+            pool.join()
+
+    # file name for caching event rates, unique for the input data and everything else that affects the rate
+    def rate_cache_file(self, name):
+        key = hashlib.sha1()
+        for filename in self.flux.input_files(self.input, self.inflv):
+            with open(filename, 'rb') as f:
+                key.update(f.read())
+        # code version: source of this file and of the modules defining channel &
+        # format, including those of their base classes (e.g. in formats/__init__.py)
+        # and of the parser (which is not part of the flux model if it is a FluxCube)
+        parser = import_module("formats." + self.format).FluxModel
+        modules = [__name__] + [cls.__module__ for cls in type(self.channel).__mro__ + type(self.flux).__mro__ + parser.__mro__]
+        for module in OrderedDict.fromkeys(modules):
+            filename = getattr(sys.modules[module], '__file__', None)
+            if filename is None:  # built-in module, e.g. for `object`
+                continue
+            with open(os.path.splitext(filename)[0] + ".py", 'rb') as f:
+                key.update(f.read())
+        # cross sections: contents of the tables, if any (see xs_tables.py)
+        xs = self.xs.content_hash() if isinstance(self.xs, XSTable) else self.xs.name
+        # flavors that the parser treats identically have identical rates
+        inflv = self.flux.equivalent_flavors.get(self.inflv, self.inflv)
+        key.update(repr((self.channel.name, self.flux.name, self.format, inflv, self.channel.flavor,
+                         self.flux_cache.quantum, self.integrator, xs, name)))
+
+        return os.path.join(self.rate_cache, "rates-%s-%s.npz" % (self.channel.name, key.hexdigest()))
+
+    def dFlux_dE(self, eNu, time):
+        return self.flux_cache.get(eNu, time, self._dFlux_dE)
+
+    def _dFlux_dE(self, eNu, time):
+        emission = self.flux.nu_emission(eNu, time)
+        return emission / (4 * pi * fiducial_distance**2)
+
+    # vectorized version of dFlux_dE; bypasses the cache, since it is only used
+    # for evaluating many different (eNu, time) pairs at once
+    def dFlux_dE_vec(self, eNu, time):
+        emission = self.flux.nu_emission_vec(eNu, time)
+        return emission / (4 * pi * fiducial_distance**2)
+
+    # get the energies of n interacting neutrinos
+    def get_eNu(self, time, n=1, sampler='table', rng=random, np_rng=np.random, profile=None):
+        if n == 0:
+            return []
+        if sampler == 'rejection':
+            # All events in this time bin share one envelope of the distribution.
+            dist = lambda _eNu: self.sigma(_eNu) * self.dFlux_dE(_eNu, time)
+            envelope = Envelope(dist, *self.channel.bounds_eNu, n_bins=40)
+            return [envelope.sample(rng, profile) for _ in range(n)]
+
+        # Tabulate the distribution once for all events in this time bin.
+        dist_vec = lambda eNus: self.sigma(eNus) * np.array([self.dFlux_dE(_eNu, time) for _eNu in eNus])
+        return inverse_cdf_sample(dist_vec, *self.channel.bounds_eNu, n=n, n_bins=200, np_rng=np_rng)
+
+    # get the energies of n[i] interacting neutrinos at each of the given times,
+    # ordered by time; like get_eNu(), but tabulates the distributions at all
+    # times in a single call of dFlux_dE_vec
+    def get_eNu_vec(self, times, n, np_rng=np.random, n_bins=200):
+        x = np.linspace(self.channel.bounds_eNu[0], self.channel.bounds_eNu[1], n_bins + 1)
+        (p, cdf) = tabulate_cdf(x, self.sigma(x) * self.dFlux_dE_vec(x[None, :], np.asarray(times)[:, None]))
+        rows = np.repeat(np.arange(len(times)), n)
+        return invert_cdf(x, p, cdf, rows, np_rng.random_sample(len(rows)))
+
+    # get directions (arrays of x, y and z components) of outgoing particles
+    # (incoming neutrino moves in z direction)
+    def get_direction(self, eNu, sampler='table', rng=random, np_rng=np.random, profile=None):
+        if sampler == 'rejection':
+            cosT = [rejection_sample(lambda _cosT: self.xs.dSigma_dCosT(_eNu, _cosT), -1, 1, 10, rng, profile)
+                    for _eNu in eNu]
+        else:
+            (grid_eNu, grid_cosT, p, cdf) = self.direction_table()
+            eNu = np.clip(eNu, grid_eNu[0], grid_eNu[-1])
+            j = np.clip(np.searchsorted(grid_eNu, eNu, side='right') - 1, 0, len(grid_eNu) - 2)
+            f = (eNu - grid_eNu[j]) / (grid_eNu[j+1] - grid_eNu[j])
+            # Use the same random number in both neighbouring rows of the table and
+            # interpolate between the resulting quantiles.
+            u = np_rng.random_sample(len(eNu))
+            cosT = (1-f) * invert_cdf(grid_cosT, p, cdf, j, u) + f * invert_cdf(grid_cosT, p, cdf, j+1, u)
+
+        cosT = np.asarray(cosT)
+        sinT = np.sqrt(1 - cosT**2)
+        phi = 2 * pi * np_rng.random_sample(len(cosT)) # randomly distributed in [0, 2 pi)
+        return (sinT*np.cos(phi), sinT*np.sin(phi), cosT)
+
+    def prepare_tables(self, sampler='table'):
+        """Compute the tables that event generation needs (see sigma_table() and
+        direction_table()) unless they exist already.
+
+        Call this before forking worker processes, so that they inherit the
+        tables instead of each computing them again.
+        """
+        with self.profile.stage("rate integration"):
+            self.sigma_table()
+        if sampler == 'table':
+            with self.profile.stage("sampling"):
+                self.direction_table()
+
+    # Table of the cosT distribution at different eNu, used by get_direction().
+    def direction_table(self, n_eNu=200, n_cosT=1000):
+        key = (self.xs.name, self.channel.flavor)
+        if not direction_tables.has_key(key):
+            grid_eNu = np.linspace(self.channel.bounds_eNu[0], self.channel.bounds_eNu[1], n_eNu + 1)
+            # The grid in cosT is finer close to +-1, where e.g. `es` has a narrow
+            # forward peak, and cross sections are evaluated slightly inside of
+            # these bounds, where they may (incorrectly) drop to zero.
+            grid_cosT = 2 * column_grid(n_cosT) - 1
+            inner_cosT = np.clip(grid_cosT, -1 + 1e-9, 1 - 1e-9)
+            (p, cdf) = tabulate_cdf(grid_cosT, self.xs.dSigma_dCosT_vec(grid_eNu[:, None], inner_cosT[None, :]))
+            direction_tables[key] = (grid_eNu, grid_cosT, p, cdf)
+        return direction_tables[key]
+
+    # total cross section, i.e. dSigma_dE integrated over all eE (or only eE > eE_min)
+    def sigma(self, eNu, eE_min=None):
+        (grid_eNu, grid_sigma, _) = self.sigma_table(eE_min)
+        return np.interp(eNu, grid_eNu, grid_sigma)
+
+    # Table of sigma(eNu), used by sigma().
+    def sigma_table(self, eE_min=None, n_eNu=2000):
+        key = (self.xs.name, self.channel.flavor, eE_min, self.integrator)
+        if not sigma_tables.has_key(key):
+            grid_eNu = np.linspace(self.channel.bounds_eNu[0], self.channel.bounds_eNu[1], n_eNu + 1)
+            if self.integrator == 'fast':
+                (grid_sigma, grid_error) = self._fast_sigma(grid_eNu, eE_min)
+            else:
+                grid_sigma = np.array([self._sigma(_eNu, eE_min) for _eNu in grid_eNu])
+                grid_error = np.zeros_like(grid_sigma) # quad() is accurate to ~1e-8
+            sigma_tables[key] = (grid_eNu, grid_sigma, grid_error)
+        return sigma_tables[key]
+
+    def _sigma(self, eNu, eE_min=None):
+        (lo, hi) = self.channel.bounds_eE(eNu)
+        if eE_min is not None:
+            (lo, hi) = (max(eE_min, lo), max(eE_min, hi))
+        if hi <= lo:
+            return 0.
+        points = [p for p in self.channel._opts(eNu)['points'] if lo < p < hi]
+        result = integrate.quad(lambda _eE: self.xs.dSigma_dE(eNu, _eE), lo, hi, points=points, full_output=1)
+        self.profile.count("sigma_integrand_evaluations", result[2]['neval'])
+        return result[0]
+
+    # Fixed-order version of _sigma() for many values of eNu at once. Like _sigma(),
+    # it splits the integral over eE at the points given by channel._opts(), then
+    # evaluates dSigma_dE at the Gauss-Legendre nodes of all intervals in a single
+    # call. Returns sigma and an error estimate for each value of eNu.
+    def _fast_sigma(self, grid_eNu, eE_min=None, order=16):
+        intervals = []
+        for (i, eNu) in enumerate(grid_eNu):
+            (lo, hi) = self.channel.bounds_eE(eNu)
+            if eE_min is not None:
+                (lo, hi) = (max(eE_min, lo), max(eE_min, hi))
+            if hi <= lo:
+                continue
+            edges = [lo] + sorted(p for p in self.channel._opts(eNu)['points'] if lo < p < hi) + [hi]
+            intervals.extend((i, a, b) for (a, b) in zip(edges[:-1], edges[1:]))
+        if not intervals:
+            return (np.zeros_like(grid_eNu), np.zeros_like(grid_eNu))
+        (idx, a, b) = (np.array(x) for x in zip(*intervals))
+
+        integrals = []
+        for _order in (order, order // 2):
+            (nodes, weights) = gauss_legendre(a, b, _order)
+            values = np.sum(self.xs.dSigma_dE_vec(grid_eNu[idx][:, None], nodes) * weights, axis=1)
+            self.profile.count("sigma_integrand_evaluations", nodes.size)
+            integrals.append(np.bincount(idx, weights=values, minlength=len(grid_eNu)))
+        return (integrals[0], abs(integrals[0] - integrals[1]))
+
+
+# Generators that are currently running gen_evts() or iter_evts(), by id(). Worker processes
+# are forked while a generator is in here, so gen_shard() can look it up;
+# this avoids pickling the generator (including all input data) for each shard.
+_generators = {}
+
+def gen_shard(shard):
+    """Generate events in a contiguous range of time bins, see Generator.gen_shard().
+
+    Runs in a worker process if `gen_evts` is called with processes > 1, so
+    it must be a module-level function.
+    """
+    return _generators[shard[0]].gen_shard(*shard[1:])
+
+
+class FluxStore(object):
+    """Parsed input data, shared by all generators that read the same input.
+
+    Parsing the input files and pre-computing values for event generation can
+    take a noticeable amount of time. The results only depend on the input
+    file(s), format, original flavor and time span, so each input is parsed
+    (and prepared for generating events in its time bins) only once. Since
+    parsers treat some flavors identically (see
+    `BaseFluxModel.equivalent_flavors`), these share one parsed input as well.
+    Can be used from several threads at the same time.
+
+    Argument:
+    cube_dir -- directory containing binary flux cubes (see flux_cube.py); if set,
+                inputs are read from their flux cube (which is created on first
+                use) instead of being parsed (default: None)
+    bin_tolerance -- if set, time bins are adaptive (see adaptive_time_bins()) and
+                     as wide as possible while the spectrum changes by less than
+                     this fraction within each bin; otherwise, all time bins are
+                     `bin_width` wide (see time_bins()) (default: None)
+    """
+    def __init__(self, cube_dir=None, bin_tolerance=None):
+        self.cube_dir = cube_dir
+        self.bin_tolerance = bin_tolerance
+        self._models = {}
+        self._lock = threading.Lock()
+        self.profiles = {} # time spent parsing & preparing each input, see profiling.py
+
+    def get(self, input, format, inflv, starttime=None, endtime=None):
+        """Return a parsed FluxModel and the start time, end time & time steps returned by its parse_input()."""
+        return self._get(input, format, inflv, starttime, endtime)[:4]
+
+    def time_bins(self, input, format, inflv, starttime=None, endtime=None):
+        """Return the centers and edges of the time bins that the FluxModel returned by get() is prepared for."""
+        return self._get(input, format, inflv, starttime, endtime)[4:]
+
+    def _get(self, input, format, inflv, starttime, endtime):
+        FluxModel = import_module("formats." + format).FluxModel
+        inflv = FluxModel.equivalent_flavors.get(inflv, inflv)
+        key = (input, format, inflv, starttime, endtime)
+        with self._lock:
+            if not self._models.has_key(key):
+                profile = self.profiles[key] = Profile()
+                with profile.stage("parsing"):
+                    flux = FluxCube(self.cube_dir, input, format) if self.cube_dir else FluxModel()
+                    (_starttime, _endtime, raw_times) = flux.parse_input(input, inflv, starttime, endtime)
+                with profile.stage("flux pre-computation"):
+                    if self.bin_tolerance:
+                        flux.prepare_evt_gen([]) # only the time steps in the input are needed here
+                        edges = adaptive_time_bins(flux, raw_times, _starttime, _endtime, self.bin_tolerance)
+                        binned_t = [(a + b) / 2 for (a, b) in zip(edges[:-1], edges[1:])]
+                    else:
+                        binned_t = time_bins(_starttime, _endtime)
+                        edges = [_starttime + i * bin_width for i in range(len(binned_t) + 1)]
+                    flux.prepare_evt_gen(binned_t) # give flux script a chance to pre-compute values
+                self._models[key] = (flux, _starttime, _endtime, raw_times, binned_t, edges)
+            return self._models[key]
 
 
 """Helper functions."""
-# double differential event rate
-def ddEventRate(eE, eNu, time):
-    return channel.dSigma_dE(eNu, eE) * dFlux_dE(eNu, time)
-
-def dFlux_dE(eNu, time):
-    if not cached_flux.has_key((eNu, time)):
-        fiducial_distance = 1.563738e+33 # 10 kpc/(hbar * c) in MeV**(-1)
-        emission = format.nu_emission(eNu, time)
-        cached_flux[(eNu, time)] = emission / (4 * pi * fiducial_distance**2)
-    return cached_flux[(eNu, time)]
-
-# get a value from an arbitrary distribution dist
-def rejection_sample(dist, min_val, max_val, n_bins=100):
-    p_max = 0
-    j_max = 0
-    bin_width = float(max_val - min_val) / n_bins
-
-    # Iterative approach to speed up finding the maximum of `dist`.
-    # Assumes that `dist` does not oscillate very quickly.
-    # First, use coarse binning to find the approximate maximum:
-    for j in range(0, n_bins, 10):
-        val = min_val + bin_width * (j + 0.5)
-        p = dist(val)
-        if p > p_max:
-            p_max = p
-            j_max = j
-    # Then, use finer binning around the approximate maximum.
-    for j in range(max(j_max-9, 0), min(j_max+10, n_bins)):
-        val = min_val + bin_width * (j + 0.5)
-        p = dist(val)
-        if p > p_max:
-            p_max = p
-
-    while True:
-        val = min_val + (max_val - min_val) * random.random()
-        if p_max * random.random() < dist(val):
-            break
-
-    return val
-
-# use rejection sampling to get the energy of an interacting neutrino
-def get_eNu(time):
-    dist = lambda _eNu: integrate.quad(ddEventRate, *channel.bounds_eE(_eNu), args=(_eNu, time), points=channel._opts(_eNu)['points'])[0]
-    eNu = rejection_sample(dist, *channel.bounds_eNu, n_bins=200)
-    return eNu
-
-# get direction of outgoing particle (incoming neutrino moves in z direction)
-def get_direction(eNu):
-    dist = lambda _cosT: channel.dSigma_dCosT(eNu, _cosT)
-    cosT = rejection_sample(dist, -1, 1, 200)
-    sinT = sin(acos(cosT))
-    phi = 2 * pi * random.random() # randomly distributed in [0, 2 pi)
-    return (sinT*cos(phi), sinT*sin(phi), cosT)
+# centers of all full-width time bins between starttime and endtime
+def time_bins(starttime, endtime):
+    n_bins = int((endtime - starttime)/bin_width) # int() implies floor()
+    return [starttime + (i+0.5)*bin_width for i in range(n_bins)]
+
+# Edges of time bins between starttime and endtime (at multiples of bin_width),
+# where each bin is as wide as possible (up to max_width), as long as the spectra
+# dN/dE at all times in the bin differ by less than `tolerance` times their
+# maximum. This gives narrow bins where the spectrum or event rate change
+# quickly (e.g. during the neutronization burst) and wide bins where they hardly
+# change (e.g. during the cooling phase). Spectra are linearly interpolated
+# between the time steps in raw_times, where flux must be able to evaluate them.
+def adaptive_time_bins(flux, raw_times, starttime, endtime, tolerance, max_width=max_bin_width):
+    n_steps = int((endtime - starttime)/bin_width) # int() implies floor()
+    if n_steps == 0:
+        return [starttime]
+    raw_times = np.asarray(raw_times, dtype=float)
+    grid_e = np.arange(1., 100., 2.)
+    with np.errstate(divide='ignore', over='ignore', under='ignore'):
+        spectra = flux.nu_emission_vec(grid_e[None, :], raw_times[:, None])
+
+    # minimum & maximum of the spectra in each step of bin_width: since spectra
+    # are linear in between, these are at the ends of the step or at time steps
+    # of the input inside it
+    t = starttime + np.arange(n_steps + 1) * bin_width
+    i = np.clip(np.searchsorted(raw_times, t), 1, len(raw_times) - 1)
+    w = ((t - raw_times[i-1]) / (raw_times[i] - raw_times[i-1]))[:, None]
+    at_t = spectra[i-1] + (spectra[i] - spectra[i-1]) * w
+    (step_lo, step_hi) = (np.minimum(at_t[:-1], at_t[1:]), np.maximum(at_t[:-1], at_t[1:]))
+    inside = (raw_times > t[0]) & (raw_times < t[-1])
+    steps = np.searchsorted(t, raw_times[inside]) - 1
+    np.minimum.at(step_lo, steps, spectra[inside])
+    np.maximum.at(step_hi, steps, spectra[inside])
+
+    # does the bin made of steps j to k-1 fulfill the tolerance?
+    def fits(j, k):
+        (lo, hi) = (step_lo[j:k].min(axis=0), step_hi[j:k].max(axis=0))
+        return (hi - lo).max() <= tolerance * hi.max()
+
+    # Make each bin as wide as possible: double its width as long as it fits,
+    # then find the exact width by bisection.
+    edges = [0]
+    max_steps = max(int(max_width / bin_width), 1)
+    while edges[-1] < n_steps:
+        j = edges[-1]
+        limit = min(max_steps, n_steps - j)
+        n = 1
+        while 2 * n <= limit and fits(j, j + 2 * n):
+            n *= 2
+        (good, bad) = (n, min(2 * n, limit + 1))
+        while bad - good > 1:
+            mid = (good + bad) // 2
+            (good, bad) = (mid, bad) if fits(j, j + mid) else (good, mid)
+        edges.append(j + good)
+    return [starttime + j * bin_width for j in edges]
+
+# get rates(times), reusing values saved in cache_file (if not None)
+def cached_rates(times, rates, cache_file):
+    values = {}
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            values = dict(zip(cached['times'], cached['rates']))
+
+    missing = [t for t in times if not values.has_key(t)]
+    if missing:
+        values.update(zip(missing, rates(missing)))
+
+    if cache_file and missing:
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a temporary file and rename it, so that jobs running in
+        # parallel never see an incomplete file.
+        tmp_file = "%s.%d.tmp.npz" % (cache_file[:-4], os.getpid())
+        _times = sorted(values)
+        np.savez(tmp_file, times=_times, rates=[values[t] for t in _times])
+        os.rename(tmp_file, cache_file)
+
+    return [values[t] for t in times]
+
+# Gauss-Legendre nodes & weights of the given order for each of the intervals
+# [a, b]; returns two arrays of shape (number of intervals, order)
+def gauss_legendre(a, b, order):
+    (x, w) = np.polynomial.legendre.leggauss(order)
+    (a, b) = (np.asarray(a, dtype=float)[:, None], np.asarray(b, dtype=float)[:, None])
+    return (a + (b - a) * (x + 1) / 2, (b - a) * w / 2)
+
+fiducial_distance = 1.563738e+33 # 10 kpc/(hbar * c) in MeV**(-1)
+
+class FluxCache(object):
+    """Cache for dFlux_dE with a maximum size and least-recently-used eviction.
+
+    Arguments:
+    max_size -- maximum number of cached values (0 disables caching)
+    quantum -- if set, round neutrino energies to multiples of this (in MeV),
+               so that lookups at nearby energies share one cached value
+    """
+    def __init__(self, max_size=100000, quantum=None):
+        self.max_size = max_size
+        self.quantum = quantum
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self._values = OrderedDict()
+
+    def get(self, eNu, time, func):
+        """Return func(eNu, time), using the cached value if possible."""
+        if self.quantum:
+            eNu = round(eNu / self.quantum) * self.quantum
+        key = (eNu, time)
+
+        if self._values.has_key(key):
+            self.hits += 1
+            value = self._values.pop(key) # re-inserted below as most recently used
+        else:
+            self.misses += 1
+            value = func(eNu, time)
+            if self.max_size <= 0:
+                return value
+            if len(self._values) >= self.max_size:
+                self._values.popitem(last=False) # remove least recently used value
+                self.evictions += 1
+
+        self._values[key] = value
+        return value
+
+    def stats(self):
+        return (self.hits, self.misses, self.evictions)
+
+class Envelope(object):
+    """Piecewise-constant upper bound of an arbitrary distribution, for rejection sampling.
+
+    `dist` is evaluated at 3 evenly spaced points inside each of `n_bins` equal
+    bins between `min_val` and `max_val` (never at the bin edges, where some
+    cross sections are not defined). Bins where these values differ by more
+    than a factor `steepness` (e.g. around a narrow peak or a threshold) are
+    split in half, down to a width of 1/2**max_depth of the original bins. In
+    each bin, the envelope is `safety` times the largest value, but at least
+    `floor` times the overall maximum, so peaks between the evaluated points can
+    still be found: if a candidate exceeds the envelope, its bin is split and
+    raised above that value.
+
+    Candidates are drawn from the envelope, so few of them are rejected even for
+    strongly peaked distributions. Since building the envelope takes at least
+    3 * n_bins evaluations of `dist`, it should be reused for all values drawn
+    from the same distribution (e.g. all neutrino energies in one time bin).
+    `candidates`, `accepted` and `refinements` count the draws from the envelope.
+    """
+    def __init__(self, dist, min_val, max_val, n_bins=10, safety=1.2, floor=1e-3, steepness=2., max_depth=10):
+        self.dist = dist
+        (self.safety, self.steepness) = (safety, steepness)
+        self.min_width = float(max_val - min_val) / n_bins / 2**max_depth
+
+        edges = [min_val + (max_val - min_val) * float(j) / n_bins for j in range(n_bins + 1)]
+        values = [self._evaluate(a, b) for (a, b) in zip(edges[:-1], edges[1:])]
+        p_max = max(max(v) for v in values)
+        if p_max <= 0:
+            raise ValueError("Distribution is zero everywhere between %s and %s." % (min_val, max_val))
+        self.p_min = floor * p_max
+
+        (self.lower, self.upper, self.heights) = ([], [], [])
+        for (a, b, v) in zip(edges[:-1], edges[1:], values):
+            self._add_bins(a, b, v)
+        self._update()
+        (self.candidates, self.accepted, self.refinements) = (0, 0, 0)
+
+    def _evaluate(self, a, b):
+        return [self.dist(a + (b - a) * (k + 0.5) / 3) for k in range(3)]
+
+    # add the bin [a, b] (with values of dist inside it), split in half as necessary
+    def _add_bins(self, a, b, values):
+        if max(values) > max(self.steepness * min(values), self.p_min) and b - a >= 2 * self.min_width:
+            mid = (a + b) / 2
+            self._add_bins(a, mid, self._evaluate(a, mid))
+            self._add_bins(mid, b, self._evaluate(mid, b))
+        else:
+            self.lower.append(a)
+            self.upper.append(b)
+            self.heights.append(max(self.safety * max(values), self.p_min))
+
+    # cumulative areas of all bins
+    def _update(self):
+        self.cdf = []
+        area = 0
+        for (a, b, h) in zip(self.lower, self.upper, self.heights):
+            area += h * (b - a)
+            self.cdf.append(area)
+
+    # replace bin j by its two halves, with heights above the value p of dist at val
+    def _refine(self, j, val, p):
+        (a, b) = (self.lower[j], self.upper[j])
+        if b - a < 2 * self.min_width:
+            self.heights[j] = self.safety * p
+        else:
+            mid = (a + b) / 2
+            heights = []
+            for (_a, _b) in ((a, mid), (mid, b)):
+                values = self._evaluate(_a, _b) + ([p] if _a <= val <= _b else [])
+                heights.append(max(self.safety * max(values), self.p_min))
+            self.lower[j:j+1] = [a, mid]
+            self.upper[j:j+1] = [mid, b]
+            self.heights[j:j+1] = heights
+        self._update()
+
+    @property
+    def acceptance_rate(self):
+        return float(self.accepted) / max(self.candidates, 1)
+
+    def sample(self, rng=random, profile=None):
+        """Get a value from the distribution, using the random number generator rng.
+
+        Adds the number of candidates, accepted values and refinements of the
+        envelope to the counters in profile.
+        """
+        (candidates, refinements) = (0, 0)
+        while True:
+            candidates += 1
+            j = min(bisect.bisect_right(self.cdf, self.cdf[-1] * rng.random()), len(self.heights) - 1)
+            val = self.lower[j] + (self.upper[j] - self.lower[j]) * rng.random()
+            p = self.dist(val)
+            if p > self.heights[j]:
+                # The envelope was too low; refine it and draw a new candidate.
+                self._refine(j, val, p)
+                refinements += 1
+            elif self.heights[j] * rng.random() < p:
+                break
+
+        self.candidates += candidates
+        self.accepted += 1
+        self.refinements += refinements
+        if profile is not None:
+            profile.count("rejection_candidates", candidates)
+            profile.count("rejection_accepted")
+            profile.count("rejection_refinements", refinements)
+        return val
+
+# get a value from an arbitrary distribution dist, using the random number generator rng;
+# to draw several values from the same distribution, reuse an Envelope instead
+def rejection_sample(dist, min_val, max_val, n_bins=10, rng=random, profile=None):
+    return Envelope(dist, min_val, max_val, n_bins).sample(rng, profile)
+
+
+def inverse_cdf_sample(dist, min_val, max_val, n, n_bins=200, np_rng=np.random):
+    # Tabulate `dist` once and treat it as piecewise linear between grid points.
+    x = np.linspace(min_val, max_val, n_bins + 1)
+    (p, cdf) = tabulate_cdf(x, dist(x))
+    return invert_cdf(x, p, cdf, np.zeros(n, dtype=int), np_rng.random_sample(n))
+
+# normalised distributions & cumulative distributions (one per row of p), tabulated on grid x
+def tabulate_cdf(x, p):
+    p = np.maximum(np.atleast_2d(p), 0)
+    h = np.diff(x)
+    cdf = np.zeros(p.shape)
+    cdf[:, 1:] = np.cumsum(h * (p[:, 1:] + p[:, :-1]) / 2, axis=1)
+
+    # treat rows without any probability (e.g. below threshold) as uniform
+    empty = cdf[:, -1] == 0
+    p[empty] = 1
+    cdf[empty] = x - x[0]
+
+    total = cdf[:, -1:]
+    return (p / total, cdf / total)
+
+# for each u (uniform random number) get a value from the distribution in the corresponding row
+def invert_cdf(x, p, cdf, rows, u):
+    (n_rows, n_points) = cdf.shape
+
+    # Find the bin that each u falls into. Adding the row number to each row of
+    # the normalised CDF makes the whole table monotonic, so one searchsorted()
+    # call handles all rows at once.
+    offset = rows * n_points
+    flat_cdf = (cdf + np.arange(n_rows)[:, None]).ravel()
+    j = np.searchsorted(flat_cdf, u + rows, side='right') - 1 - offset
+    j = np.clip(j, 0, n_points - 2)
+    h = x[j+1] - x[j]
+
+    # Inside that bin, the distribution is linear, so the CDF is quadratic.
+    r = u - cdf[rows, j]
+    (p0, p1) = (p[rows, j], p[rows, j+1])
+    denominator = p0 + np.sqrt(np.maximum(p0**2 + 2 * (p1 - p0) * r / h, 0))
+    s = np.where(denominator > 0, 2 * r / h / np.where(denominator > 0, denominator, 1), 0)
+    return x[j] + h * np.clip(s, 0, 1)
+
+# Tables of the cosT distribution and of sigma(eNu), see Generator.direction_table()
+# and Generator.sigma_table(). They only depend on the cross section, so we
+# compute each table once per process and share it between all generators.
+direction_tables = {}
+sigma_tables = {}
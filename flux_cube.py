@@ -0,0 +1,204 @@
+#!/usr/bin/python
+"""
+Convert input files of any format into a binary flux cube.
+
+Parsing the (text) input files and building interpolators takes much longer
+than the actual event generation for short time windows. This script parses an
+input once, for all flavors, and tabulates the number luminosity dN/dE (in
+MeV^-1 ms^-1) on a grid of times x energies x flavors. The cube is saved as a
+'.npy' file, which `FluxCube` memory-maps read-only, so loading it takes only
+milliseconds and all processes on a machine share one copy. A second file
+('.npz') contains the grids and other metadata.
+
+Cubes are named after a hash of the input files and of the parser, so they are
+rebuilt automatically when either changes. Use the `--flux-cube-dir` option
+of `genevts.py` to convert inputs automatically on first use, or this script to
+convert them ahead of time, e.g. for a model library that is shared by many jobs.
+
+Spectra are interpolated linearly in time and energy, like in `nakazato.py` or
+`princeton.py`, while some parsers interpolate differently (e.g. `garching.py`
+interpolates mean energies and luminosity). Where the time steps in the input
+are too coarse for that, build() adds intermediate times to the cube.
+
+See `python flux_cube.py -h` for usage information.
+"""
+
+import argparse
+import hashlib
+from importlib import import_module
+from math import ceil, floor
+import numpy as np
+import os
+import sys
+
+from formats import TabulatedFluxModel
+
+flavors = ["e", "eb", "x"] # anti-nu_x is the same as nu_x in all input formats
+
+
+def cube_name(input, format):
+    """Name of the cube for the given input, unique for its contents and the code of the parser."""
+    FluxModel = import_module("formats." + format).FluxModel
+    key = hashlib.sha1()
+    for filename in sorted(set(f for flv in flavors for f in FluxModel().input_files(input, flv))):
+        with open(filename, 'rb') as f:
+            key.update(f.read())
+    for filename in (sys.modules[FluxModel.__module__].__file__, __file__):
+        with open(os.path.splitext(filename)[0] + ".py", 'rb') as f:
+            key.update(f.read())
+    key.update(format)
+    return "flux-%s-%s" % (format, key.hexdigest())
+
+
+def build(directory, input, format, tolerance=1e-3, min_step=0.1, max_iterations=10):
+    """Tabulate the fluxes of all flavors in the given input and save them in `directory`.
+
+    Starts with all time steps from the input files. Wherever linear
+    interpolation between two neighbouring times deviates from the parser by
+    more than `tolerance` (relative to the maximum of the spectrum) at their
+    midpoint, the midpoint is added to the cube; this is repeated up to
+    `max_iterations` times, but steps are never made smaller than `min_step` ms.
+    Returns the name of the cube and the largest remaining deviation.
+    """
+    models = {}
+    times = set()
+    for flv in flavors:
+        models[flv] = import_module("formats." + format).FluxModel()
+        (_, _, raw_times) = models[flv].parse_input(input, flv, None, None)
+        times.update(raw_times)
+    times = np.array(sorted(times))
+    grid_e = TabulatedFluxModel()._energy_grid()
+
+    for iteration in range(max_iterations + 1):
+        mids = (times[:-1] + times[1:]) / 2
+        refine = np.diff(times) >= 2 * min_step
+        all_times = np.union1d(times, mids[refine])
+        spectra = _spectra(models, all_times, grid_e)
+        is_step = np.in1d(all_times, times)
+        (cube, mid_cube) = (spectra[is_step], spectra[~is_step])
+
+        # deviation of linear interpolation at midpoints, relative to the maximum
+        # of the spectrum (separately for each flavor)
+        deviation = np.zeros(len(mids))
+        linear = (cube[:-1][refine] + cube[1:][refine]) / 2
+        scale = np.maximum(mid_cube.max(axis=1), 1e-300)[:, None, :]
+        deviation[refine] = (abs(mid_cube - linear) / scale).max(axis=(1, 2))
+        if iteration == max_iterations or not (deviation > tolerance).any():
+            break
+        times = np.union1d(times, mids[deviation > tolerance])
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = cube_name(input, format)
+    # Write to temporary files and rename them, so that jobs running in parallel
+    # never see an incomplete cube. The metadata is renamed last, since
+    # FluxCube only looks for that file.
+    tmp = os.path.join(directory, "%s.%d.tmp" % (name, os.getpid()))
+    np.save(tmp + ".npy", cube)
+    np.savez(tmp + ".npz", times=times, energies=grid_e, flavors=flavors, format=format,
+             input=os.path.abspath(input), deviation=deviation.max() if len(deviation) else 0.)
+    os.rename(tmp + ".npy", os.path.join(directory, name + ".npy"))
+    os.rename(tmp + ".npz", os.path.join(directory, name + ".npz"))
+    return (name, deviation.max() if len(deviation) else 0.)
+
+# spectra of all flavors at the given times, with shape (times, energies, flavors)
+def _spectra(models, times, grid_e):
+    # Some parsers interpolate in log(eNu), so we evaluate them slightly above 0 MeV.
+    e = np.maximum(grid_e, 1e-6)
+    cube = np.zeros((len(times), len(grid_e), len(flavors)))
+    for (k, flv) in enumerate(flavors):
+        models[flv].prepare_evt_gen(list(times))
+        with np.errstate(divide='ignore', over='ignore', under='ignore'):
+            cube[:, :, k] = models[flv].nu_emission_vec(e[None, :], times[:, None])
+    return cube
+
+
+class FluxCube(TabulatedFluxModel):
+    """Flux model that reads the spectra of an input from its flux cube.
+
+    Can be used in place of the `FluxModel` of the input format (see
+    `FluxStore` in `channel.py`). If there is no up-to-date cube for the input
+    in `directory`, it is built first.
+    """
+    def __init__(self, directory, input, format):
+        self.format = format
+        self._model = import_module("formats." + format).FluxModel()
+
+        name = cube_name(input, format)
+        if not os.path.exists(os.path.join(directory, name + ".npz")):
+            print "Converting '%s' (format: %s) into a flux cube in '%s' ..." % (input, format, directory)
+            build(directory, input, format)
+        with np.load(os.path.join(directory, name + ".npz")) as meta:
+            (self.cube_times, self.grid_e) = (meta['times'], meta['energies'])
+            self.flavors = list(meta['flavors'])
+        self.e_step = self.grid_e[1] - self.grid_e[0]
+        self.cube = np.load(os.path.join(directory, name + ".npy"), mmap_mode='r')
+
+    @property
+    def name(self):
+        return "%s (cube)" % self.format
+
+    def parse_input(self, input, inflv, starttime, endtime):
+        """Select the spectra for the given flavor and time span from the cube.
+
+        Arguments:
+        input -- prefix of file containing neutrino fluxes
+        inflv -- neutrino flavor to consider
+        starttime -- start time set by user via command line option (or None)
+        endtime -- end time set by user via command line option (or None)
+        """
+        times = self.cube_times.tolist()
+
+        # Compare start/end time entered by user with first/last time in the cube
+        if not starttime:
+            starttime = ceil(times[0])
+        elif starttime < times[0]:
+            print("Error: Start time must be greater than earliest time in input files. Aborting ...")
+            exit()
+
+        if not endtime:
+            endtime = floor(times[-1])
+        elif endtime > times[-1]:
+            print("Error: End time must be less than latest time in input files. Aborting ...")
+            exit()
+
+        # Select only relevant time bins. The spectra are a view of the
+        # memory-mapped cube, so they are only read from disk when needed.
+        i_min, i_max = 0, len(times) - 1
+        for (i, time) in enumerate(times):
+            if time < starttime:
+                i_min = i
+            elif time > endtime:
+                i_max = i
+                break
+        k = self.flavors.index(self.equivalent_flavors.get(inflv, inflv))
+        self._set_spectra(times[i_min:i_max+1], self.grid_e, self.cube[i_min:i_max+1, :, k])
+
+        return (starttime, endtime, times[i_min:i_max+1])
+
+    def input_files(self, input, inflv):
+        """Names of all input files that are read for the given input and flavor."""
+        return self._model.input_files(input, inflv)
+
+    def prepare_evt_gen(self, binned_t):
+        return None # unnecessary here; spectra are already tabulated in the cube
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file", help="Name or common prefix of the input file(s). Required.")
+    parser.add_argument("directory", help="Directory to save the flux cube in. Required.")
+
+    choices = ["garching", "nakazato", "princeton", "totani"]
+    default = "totani"
+    parser.add_argument("-f", "--format", metavar="FORMAT", choices=choices, default=default,
+                        help="Format of input files. Choices: %s. Default: %s" % (choices, default))
+    args = parser.parse_args()
+
+    (name, deviation) = build(args.directory, args.input_file, args.format)
+    print "%s: saved as '%s' (max. deviation of time interpolation: %.1e)" \
+        % (args.input_file, os.path.join(args.directory, name + ".npy"), deviation)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,95 @@
+"""Input formats.
 
+Each module in this folder implements a parser for one input format as a
+subclass of `BaseFluxModel` (or of `TabulatedFluxModel`), named `FluxModel`.
+An instance holds the fluxes read from one input file (or set of files) for
+one flavor, so any number of flux models can be used in the same process at
+the same time.
+"""
+
+from bisect import bisect_right
+from math import ceil
+import numpy as np
+
+
+class BaseFluxModel(object):
+    """Base class for flux models.
+
+    Subclasses need to provide parse_input(), input_files(), prepare_evt_gen()
+    and nu_emission(); see `garching.py` for an example.
+    """
+    @property
+    def name(self):
+        """Name of the input format, e.g. 'garching', 'totani', ... (i.e. the module name)."""
+        return self.__module__.split(".")[-1]
+
+    # Input files only contain one set of values for nu_x and anti-nu_x, so
+    # parsers treat both flavors identically.
+    equivalent_flavors = {"xb": "x"}
+
+    # Vectorized version of nu_emission; optional.
+    def nu_emission_vec(self, eNu, time):
+        return np.vectorize(self.nu_emission, otypes=[float])(eNu, time)
+
+
+class TabulatedFluxModel(BaseFluxModel):
+    """Base class for flux models with spectra tabulated at discrete times.
+
+    Subclasses call _set_spectra() in parse_input(). Spectra are stored as one
+    2D array (time x energy) on a regular energy grid, so that nu_emission()
+    only needs to look up the neighbouring times (by bisection) and energies
+    (by division) and interpolate linearly between them.
+    """
+    e_step = 0.05 # spacing of the energy grid (MeV)
+    e_max = 100 # minimum upper end of the energy grid (MeV)
+
+    def _energy_grid(self, e_max=0):
+        """Regular energy grid from 0 MeV up to e_max (but at least up to self.e_max)."""
+        n = int(ceil(max(e_max, self.e_max) / self.e_step))
+        return self.e_step * np.arange(n + 1)
+
+    def _set_spectra(self, times, grid_e, dNLdE):
+        """Save spectra dNLdE (one row per time bin, one column per value in grid_e)."""
+        self.spectrum_times = np.asarray(times, dtype=float)
+        self.grid_e = grid_e
+        self.spectra = np.asarray(dNLdE, dtype=float)
+        self._times = self.spectrum_times.tolist() # for looking up single values with bisect
+
+    def nu_emission(self, eNu, time):
+        """Number of neutrinos emitted, as a function of energy.
+
+        This is not yet the flux! The geometry factor 1/(4 pi r**2) is added later.
+        Arguments:
+        eNu -- neutrino energy
+        time -- time ;)
+        """
+        # find previous/next time bin and energy bin
+        i = min(max(bisect_right(self._times, time), 1), len(self._times) - 1)
+        (t_prev, t_next) = (self._times[i-1], self._times[i])
+        x = min(eNu / self.e_step, len(self.grid_e) - 1)
+        j = min(int(x), len(self.grid_e) - 2)
+        f = x - j
+
+        # perform linear interpolation in energy, then in time
+        (a, b) = self.spectra[i-1, j:j+2].tolist()
+        dNLdE_prev = a + (b - a) * f
+        (a, b) = self.spectra[i, j:j+2].tolist()
+        dNLdE_next = a + (b - a) * f
+        return dNLdE_prev + (dNLdE_next - dNLdE_prev) * (time - t_prev) / (t_next - t_prev)
+
+    def nu_emission_vec(self, eNu, time):
+        """Vectorized version of nu_emission(eNu, time).
+
+        eNu and time can be scalars or arrays that numpy can broadcast against
+        each other.
+        """
+        (eNu, time) = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(time, dtype=float))
+        i = np.clip(np.searchsorted(self.spectrum_times, time, side='right'), 1, len(self.spectrum_times) - 1)
+        (t_prev, t_next) = (self.spectrum_times[i-1], self.spectrum_times[i])
+        x = np.minimum(eNu / self.e_step, len(self.grid_e) - 1)
+        j = np.minimum(x.astype(int), len(self.grid_e) - 2)
+        f = x - j
+
+        dNLdE_prev = self.spectra[i-1, j] + (self.spectra[i-1, j+1] - self.spectra[i-1, j]) * f
+        dNLdE_next = self.spectra[i, j] + (self.spectra[i, j+1] - self.spectra[i, j]) * f
+        return dNLdE_prev + (dNLdE_next - dNLdE_prev) * (time - t_prev) / (t_next - t_prev)
@@ -7,105 +7,143 @@ with one entry per line. We assume that the data follows a gamma distribution
 See the file 'sample-in.txt' for details.
 """
 
-from math import ceil, floor, gamma, exp
-from scipy import interpolate
-
-
-def parse_input(input, inflv, starttime, endtime):
-    """Read simulations data from input file.
-
-    Arguments:
-    input -- prefix of file containing neutrino fluxes
-    inflv -- neutrino flavor to consider
-    starttime -- start time set by user via command line option (or None)
-    endtime -- end time set by user via command line option (or None)
-    """
-    # read data from input file, ignoring lines with comments and empty lines
-    with open(input) as infile:
-        raw_indata = [map(float, line.split(",")) for line in infile if not (line.startswith("#") or line.isspace())]
-    for entry in raw_indata:
-        entry[0] *= 1000 # convert time to ms
-
-    # Compare start/end time entered by user with first/last line of input file
-    _starttime = raw_indata[0][0]
-    _endtime = raw_indata[-1][0]
-
-    if not starttime:
-        starttime = ceil(_starttime)
-    elif starttime < _starttime:
-        print("Error: Start time must be greater than time in first line of input file. Aborting ...")
-        exit()
-
-    if not endtime:
-        endtime = floor(_endtime)
-    elif endtime > _endtime:
-        print("Error: End time must be less than time in last line of input file. Aborting ...")
-        exit()
-
-    # Ignore data outside of the requested time span.
-    indata = []
-    for (i, entry) in enumerate(raw_indata):
-        if i == 0: continue
-        if entry[0] > starttime:
-            indata.append(raw_indata[i-1])
-            if entry[0] > endtime:
-                indata.append(entry)
-                break
-
-    # save mean energy, mean squared energy, luminosity to dictionary to look up in nu_emission() below
-    global flux
-    flux = {}
-    for timebin in indata:
-        # input files contain information for nu_e in columns 1-3, for
-        # anti-nu_e in cols 4-6 and for nu_x in columns 7-9
-        offset = {"e": 1, "eb": 4, "x": 7, "xb": 7}[inflv]
-        (mean_e, mean_e_sq, lum) = timebin[offset:offset+3]
-        t = timebin[0]
-        flux[t] = (mean_e, mean_e_sq, lum * 624.151) # convert lum from erg/s to MeV/ms
-
-    return (starttime, endtime, sorted(flux.keys()))
-
-
-def prepare_evt_gen(binned_t):
-    """Pre-compute values necessary for event generation.
-
-    Scipy/numpy are optimized for parallel operation on large arrays, making
-    it orders of magnitude faster to pre-compute all values at one time
-    instead of computing them lazily when needed.
-
-    Argument:
-    binned_t -- list of time bins for generating events
-    """
-    _flux = sorted([(k,)+v for (k,v) in flux.items()]) # list of tuples: (t, e, e_sq, lum)
-    (raw_t, raw_e, raw_e_sq, raw_lum) = [[entry[i] for entry in _flux] for i in range(4)]
-
-    # interpolate mean energy, mean squared energy and luminosity ...
-    interpolated_e = interpolate.pchip(raw_t, raw_e)
-    interpolated_e_sq = interpolate.pchip(raw_t, raw_e_sq)
-    interpolated_lum = interpolate.pchip(raw_t, raw_lum)
-    # ... and evaluate them at all relevant times
-    binned_e = interpolated_e(binned_t)
-    binned_e_sq = interpolated_e_sq(binned_t)
-    binned_lum = interpolated_lum(binned_t)
-
-    for (t, mean_e, mean_e_sq, mean_lum) in zip(binned_t, binned_e, binned_e_sq, binned_lum):
-        flux[t] = (mean_e, mean_e_sq, mean_lum)
-
-    return None
-
-
-def nu_emission(eNu, time):
-    """Number of neutrinos emitted, as a function of energy.
-
-    This is not yet the flux! The geometry factor 1/(4 pi r**2) is added later.
-    Arguments:
-    eNu -- neutrino energy
-    time -- time ;)
-    """
-    (e, e_sq, luminosity) = flux[time]
-    alpha = (2 * e**2 - e_sq) / (e_sq - e**2)
-
-    # energy of neutrinos follows a gamma distribution
-    gamma_dist = eNu**alpha / gamma(alpha + 1) * ((alpha + 1)/e)**(alpha + 1) * exp(-(alpha + 1) * eNu/e)
-    # total number = luminosity / mean energy
-    return luminosity / e * gamma_dist
+from math import ceil, floor, exp, log
+import numpy as np
+from scipy import interpolate, special
+
+from formats import BaseFluxModel
+
+
+class FluxModel(BaseFluxModel):
+    def parse_input(self, input, inflv, starttime, endtime):
+        """Read simulations data from input file.
+
+        Arguments:
+        input -- prefix of file containing neutrino fluxes
+        inflv -- neutrino flavor to consider
+        starttime -- start time set by user via command line option (or None)
+        endtime -- end time set by user via command line option (or None)
+        """
+        # read data from input file, ignoring lines with comments and empty lines
+        with open(input) as infile:
+            raw_indata = [map(float, line.split(",")) for line in infile if not (line.startswith("#") or line.isspace())]
+        for entry in raw_indata:
+            entry[0] *= 1000 # convert time to ms
+
+        # Compare start/end time entered by user with first/last line of input file
+        _starttime = raw_indata[0][0]
+        _endtime = raw_indata[-1][0]
+
+        if not starttime:
+            starttime = ceil(_starttime)
+        elif starttime < _starttime:
+            print("Error: Start time must be greater than time in first line of input file. Aborting ...")
+            exit()
+
+        if not endtime:
+            endtime = floor(_endtime)
+        elif endtime > _endtime:
+            print("Error: End time must be less than time in last line of input file. Aborting ...")
+            exit()
+
+        # Ignore data outside of the requested time span.
+        indata = []
+        for (i, entry) in enumerate(raw_indata):
+            if i == 0: continue
+            if entry[0] > starttime:
+                indata.append(raw_indata[i-1])
+                if entry[0] > endtime:
+                    indata.append(entry)
+                    break
+
+        # save mean energy, mean squared energy, luminosity to dictionary; see prepare_evt_gen() below
+        self.flux = {}
+        for timebin in indata:
+            # input files contain information for nu_e in columns 1-3, for
+            # anti-nu_e in cols 4-6 and for nu_x in columns 7-9
+            offset = {"e": 1, "eb": 4, "x": 7, "xb": 7}[inflv]
+            (mean_e, mean_e_sq, lum) = timebin[offset:offset+3]
+            t = timebin[0]
+            self.flux[t] = (mean_e, mean_e_sq, lum * 624.151) # convert lum from erg/s to MeV/ms
+
+        return (starttime, endtime, sorted(self.flux.keys()))
+
+
+    def input_files(self, input, inflv):
+        """Names of all input files that are read for the given input and flavor."""
+        return [input]
+
+
+    def prepare_evt_gen(self, binned_t):
+        """Pre-compute values necessary for event generation.
+
+        Scipy/numpy are optimized for parallel operation on large arrays, making
+        it orders of magnitude faster to pre-compute all values at one time
+        instead of computing them lazily when needed.
+
+        The input data (in self.flux) is left unchanged. Derived values are
+        saved in arrays, with one entry for each time in the input data and
+        each time bin, to look up in nu_emission() below.
+
+        Argument:
+        binned_t -- list of time bins for generating events
+        """
+        raw_t = sorted(self.flux.keys())
+        (raw_e, raw_e_sq, raw_lum) = np.array([self.flux[t] for t in raw_t]).T
+
+        # interpolate mean energy, mean squared energy and luminosity ...
+        interpolated_e = interpolate.pchip(raw_t, raw_e)
+        interpolated_e_sq = interpolate.pchip(raw_t, raw_e_sq)
+        interpolated_lum = interpolate.pchip(raw_t, raw_lum)
+
+        # ... and evaluate them at all relevant times (using the input data
+        # directly at times that are not also time bins)
+        binned = set(binned_t)
+        raw = [i for (i, t) in enumerate(raw_t) if t not in binned]
+        times = np.concatenate((np.take(raw_t, raw), binned_t))
+        order = np.argsort(times, kind='mergesort')
+        e = np.concatenate((raw_e[raw], interpolated_e(binned_t)))[order]
+        e_sq = np.concatenate((raw_e_sq[raw], interpolated_e_sq(binned_t)))[order]
+        lum = np.concatenate((raw_lum[raw], interpolated_lum(binned_t)))[order]
+
+        # shape parameter alpha, decay rate and normalization (in log space) of
+        # the gamma distribution, see nu_emission() below
+        self.times = times[order]
+        self.alpha = (2 * e**2 - e_sq) / (e_sq - e**2)
+        self.rate = (self.alpha + 1) / e
+        # total number = luminosity / mean energy
+        self.log_norm = np.log(lum / e) + (self.alpha + 1) * np.log(self.rate) - special.gammaln(self.alpha + 1)
+        self._index = dict((t, i) for (i, t) in enumerate(self.times.tolist()))
+
+        return None
+
+
+    def nu_emission(self, eNu, time):
+        """Number of neutrinos emitted, as a function of energy.
+
+        This is not yet the flux! The geometry factor 1/(4 pi r**2) is added later.
+        Arguments:
+        eNu -- neutrino energy
+        time -- time ;) (must be a time in the input data or a time bin)
+        """
+        i = self._index[time]
+        if eNu <= 0:
+            return 0.
+        # energy of neutrinos follows a gamma distribution
+        return exp(self.log_norm[i] + self.alpha[i] * log(eNu) - self.rate[i] * eNu)
+
+
+    def nu_emission_vec(self, eNu, time):
+        """Vectorized version of nu_emission(eNu, time).
+
+        eNu and time can be scalars or arrays that numpy can broadcast against
+        each other.
+        """
+        (eNu, time) = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(time, dtype=float))
+        i = np.minimum(np.searchsorted(self.times, time), len(self.times) - 1)
+        if np.any(self.times[i] != time):
+            raise KeyError(time[self.times[i] != time].flat[0])
+
+        with np.errstate(divide='ignore'): # log(0) = -inf gives 0 below
+            log_eNu = np.log(np.maximum(eNu, 0))
+        return np.exp(self.log_norm[i] + self.alpha[i] * log_eNu - self.rate[i] * eNu)
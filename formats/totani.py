@@ -6,253 +6,288 @@ All times are post-bounce, which differs slightly from the simulation time given
 in the raw input files. We fix this when reading from the files in _parse().
 """
 
-from math import ceil, floor, gamma, exp, log10
-from scipy.interpolate import InterpolatedUnivariateSpline
+from bisect import bisect_right
+from math import ceil, floor, log10
+import numpy as np
+from scipy.interpolate import CubicSpline
 
 zero = 1E-99 # not exactly zero to ensure log interpolation is still possible
 
-
-def parse_input(input, inflv, starttime, endtime):
-    """Read simulations data from input file.
-
-    Arguments:
-    input -- prefix of file containing neutrino fluxes
-    inflv -- neutrino flavor to consider
-    starttime -- start time set by user via command line option (or None)
-    endtime -- end time set by user via command line option (or None)
-    """
-    global times, times_el, times_nb, e_bins
-    global N_dict, egroup_dict, dNLde_dict, log_spectrum
-    times_el, times_nb = [], []
-    e_bins = [zero] # energy bins are the same for all times; first bin = 0 MeV
-    N_dict, egroup_dict, dNLde_dict, log_spectrum = {}, {}, {}, {}
-
-    # The file format is complicated, so we define helper functions below
-    _parse(input + "-early.txt", "early", inflv)
-    _parse(input + "-late.txt", "late", inflv)
-    _calculate_dNLde() # calculate number luminosity for early and late files
-    # nu_e fluxes during the neutronization burst are in a separate file,
-    # with more precise time bins and a different format:
-    if inflv == "e": _parse_nb(input + "-nb.txt")
-    times = sorted(times_el + times_nb)
-
-    # Compare start/end time entered by user with first/last line of input file
-    _starttime = times[0]
-    _endtime = times[-1]
-
-    if not starttime:
-        starttime = ceil(_starttime)
-    elif starttime < _starttime:
-        print("Error: Start time must be greater than earliest time in input files. Aborting ...")
-        exit()
-
-    if not endtime:
-        endtime = floor(_endtime)
-    elif endtime > _endtime:
-        print("Error: End time must be less than latest time in input files. Aborting ...")
-        exit()
-
-    # If user entered a custom start/end time, select only relevant time bins
-    i_min, i_max = 0, len(times) - 1
-    for (i, time) in enumerate(times):
-        if time < starttime:
-            i_min = i
-        elif time > endtime:
-            i_max = i
-            break
-    times = times[i_min:i_max+1]
-
-    # Get spectra for relevant time bins by log cubic spline interpolation
-    log_group_e = [log10(e_bin) for e_bin in e_bins]
-    for time in times:
-        log_dNLde = [log10(d) for d in dNLde_dict[time]]
-        log_spectrum[time] = InterpolatedUnivariateSpline(log_group_e, log_dNLde)
-
-    return (starttime, endtime, times)
-
-
-def prepare_evt_gen(binned_t):
-    """Pre-compute values necessary for event generation.
-
-    Scipy/numpy are optimized for parallel operation on large arrays, making
-    it orders of magnitude faster to pre-compute all values at one time
-    instead of computing them lazily when needed.
-
-    Argument:
-    binned_t -- list of time bins for generating events
-    """
-    for time in binned_t:
-        if log_spectrum.has_key(time):
-            # we have already computed the interpolated spectrum at this time
-            continue
-
-        if 40 <= time <= 49.99 and times_nb != []:
-            # take fluxes from nb file into account
-            _times = filter(lambda x: x in times, times_nb)
-        else: # use fluxes from early/late file
-            _times = filter(lambda x: x in times, times_el)
-
-        # find closest time bins -> t0, t1
-        for t_bin in _times:
-            if time <= t_bin:
-                t1 = t_bin
+from formats import BaseFluxModel
+
+
+class FluxModel(BaseFluxModel):
+    def parse_input(self, input, inflv, starttime, endtime):
+        """Read simulations data from input file.
+
+        Arguments:
+        input -- prefix of file containing neutrino fluxes
+        inflv -- neutrino flavor to consider
+        starttime -- start time set by user via command line option (or None)
+        endtime -- end time set by user via command line option (or None)
+        """
+        # The file format is complicated, so we define helper functions below
+        (times_early, N_early, egroup_early) = self._parse(input + "-early.txt", "early", inflv)
+        (times_late, N_late, egroup_late) = self._parse(input + "-late.txt", "late", inflv)
+        self.times_el = np.concatenate((times_early, times_late))
+        # calculate number luminosity for early and late files
+        self.dNLde_el = self._calculate_dNLde(self.times_el, np.concatenate((N_early, N_late)),
+                                              np.concatenate((egroup_early, egroup_late)))
+        # nu_e fluxes during the neutronization burst are in a separate file,
+        # with more precise time bins and a different format:
+        if inflv == "e":
+            (self.times_nb, self.dNLde_nb) = self._parse_nb(input + "-nb.txt")
+        else:
+            (self.times_nb, self.dNLde_nb) = (np.zeros(0), np.zeros((0, len(self.e_bins))))
+        self.times = sorted(np.concatenate((self.times_el, self.times_nb)))
+
+        # Compare start/end time entered by user with first/last line of input file
+        _starttime = self.times[0]
+        _endtime = self.times[-1]
+
+        if not starttime:
+            starttime = ceil(_starttime)
+        elif starttime < _starttime:
+            print("Error: Start time must be greater than earliest time in input files. Aborting ...")
+            exit()
+
+        if not endtime:
+            endtime = floor(_endtime)
+        elif endtime > _endtime:
+            print("Error: End time must be less than latest time in input files. Aborting ...")
+            exit()
+
+        # If user entered a custom start/end time, select only relevant time bins
+        i_min, i_max = 0, len(self.times) - 1
+        for (i, time) in enumerate(self.times):
+            if time < starttime:
+                i_min = i
+            elif time > endtime:
+                i_max = i
                 break
-            else:
-                t0 = t_bin
-
-        # get dNLde at the intermediate time
-        dNLde = []
-        prev_dNLde = dNLde_dict[t0]
-        next_dNLde = dNLde_dict[t1]
-        for (i, _) in enumerate(e_bins):
-            # linear interpolation over time each energy bin
-            tmp = prev_dNLde[i] + (next_dNLde[i] - prev_dNLde[i]) * (time-t0)/(t1-t0)
-            dNLde.append(tmp)
-
-        # Get emission spectrum by log cubic spline interpolation
-        log_group_e = [log10(e_bin) for e_bin in e_bins]
-        log_dNLde = [log10(d) for d in dNLde]
-        log_spectrum[time] = InterpolatedUnivariateSpline(log_group_e, log_dNLde)
-
-    return None
-
-def nu_emission(eNu, time):
-    """Number of neutrinos emitted, as a function of energy.
-
-    This is not yet the flux! The geometry factor 1/(4 pi r**2) is added later.
-    Arguments:
-    eNu -- neutrino energy
-    time -- time ;)
-    """
-    f = log_spectrum[time]
-    return 10 ** f(log10(eNu)) # transform log back to actual value
-
-
-"""Helper functions."""
-def _parse(input, format, flv):
-    """Read data from files into dictionaries to look up by time."""
-    with open(input) as infile:
-        raw_indata = [line for line in infile]
-
-    chunks = []
-
-    if format == "early":
-        # 42 lines per time bin, 26 bins in wilson-early.txt
-        for i in range(26):
-            chunks.append(raw_indata[42*i:42*(i+1)])
-        line_N = 6
-        range_egroup = range(19, 39)
-    elif format == "late":
-        # 46 lines per time bin, 36 bins in wilson-late.txt
-        for i in range(36):
-            chunks.append(raw_indata[46*i:46*(i+1)])
-        line_N = 8
-        range_egroup = range(21, 41)
-
-    # input files contain information for e, eb & x right next to each other,
-    # so depending on the flavor, we might need an offset
-    offset = {"e": 0, "eb": 1, "x": 2, "xb": 2}[flv]
-
-    # for each time bin, save data to dictionaries to look up later
-    for chunk in chunks:
-        # first line contains time
-        time = float(chunk[0].split()[0]) * 1000 # convert to ms
-        time -= 2 # change from simulation time into time after core bounce
-        times_el.append(time)
-
-        # N = total number of neutrinos emitted up to this time
-        N = float(chunk[line_N].split()[offset])
+        self.times = self.times[i_min:i_max+1]
+
+        # Spectra are interpolated by log cubic splines in energy. All spectra
+        # share the same energy bins, so the polynomial coefficients of each
+        # spline are a fixed linear combination of its values at the energy
+        # bins; we get that linear combination from splines through the unit
+        # vectors. (A not-a-knot cubic spline is the same as scipy's
+        # InterpolatedUnivariateSpline, which this parser used previously.)
+        self.log_e_bins = np.log10(self.e_bins)
+        self._unit_coefs = CubicSpline(self.log_e_bins, np.eye(len(self.e_bins))).c
+        # The polynomial in each interval is relative to the left end of that
+        # interval. The first interval starts at log10(zero), far away from all
+        # other bins, so it would be imprecise; instead, we write it relative to
+        # its right end, where the spline has the same value and first & second
+        # derivative as the polynomial in the second interval.
+        self._unit_coefs[1:, 0] = self._unit_coefs[1:, 1]
+        self._origins = np.concatenate(([self.log_e_bins[1]], self.log_e_bins[1:-1]))
+        self._breaks = self.log_e_bins.tolist() # for looking up single values with bisect
+
+        # Table of log10(dNLde) at the relevant time bins (one row per time),
+        # which prepare_evt_gen() extends to the time bins for event generation
+        self.spectrum_times = np.zeros(0)
+        self.log_spectrum = np.zeros((0, len(self.e_bins)))
+        dNLde = dict(zip(self.times_el, self.dNLde_el))
+        dNLde.update(zip(self.times_nb, self.dNLde_nb))
+        self._add_spectra(self.times, np.array([dNLde[t] for t in self.times]))
+
+        return (starttime, endtime, self.times)
+
+
+    def input_files(self, input, inflv):
+        """Names of all input files that are read for the given input and flavor."""
+        files = [input + "-early.txt", input + "-late.txt"]
+        if inflv == "e": files.append(input + "-nb.txt")
+        return files
+
+
+    def prepare_evt_gen(self, binned_t):
+        """Pre-compute values necessary for event generation.
+
+        Scipy/numpy are optimized for parallel operation on large arrays, making
+        it orders of magnitude faster to pre-compute all values at one time
+        instead of computing them lazily when needed.
+
+        Argument:
+        binned_t -- list of time bins for generating events
+        """
+        # skip times where we have already computed the spectrum
+        binned_t = np.setdiff1d(binned_t, self.spectrum_times)
+
+        # take fluxes from nb file into account, otherwise use early/late file
+        use_nb = (binned_t >= 40) & (binned_t <= 49.99) & (len(self.times_nb) > 0)
+        dNLde = np.zeros((len(binned_t), len(self.e_bins)))
+        for (mask, times, table) in ((use_nb, self.times_nb, self.dNLde_nb),
+                                     (~use_nb, self.times_el, self.dNLde_el)):
+            if not mask.any(): continue
+            # find closest time bins -> t0 = times[i-1], t1 = times[i]
+            t = binned_t[mask]
+            i = np.clip(np.searchsorted(times, t, side='left'), 1, len(times) - 1)
+            (t0, t1) = (times[i-1], times[i])
+            # linear interpolation over time in each energy bin
+            w = ((t - t0) / (t1 - t0))[:, None]
+            dNLde[mask] = table[i-1] + (table[i] - table[i-1]) * w
+
+        self._add_spectra(binned_t, dNLde)
+        return None
+
+    def nu_emission(self, eNu, time):
+        """Number of neutrinos emitted, as a function of energy.
+
+        This is not yet the flux! The geometry factor 1/(4 pi r**2) is added later.
+        Arguments:
+        eNu -- neutrino energy
+        time -- time ;)
+        """
+        row = self._rows[time]
+        x = log10(eNu)
+        i = min(max(bisect_right(self._breaks, x) - 1, 0), len(self._breaks) - 2)
+        dx = x - self._origins[i]
+        (c3, c2, c1, c0) = self._coefs[row, :, i].tolist()
+        return 10 ** (((c3 * dx + c2) * dx + c1) * dx + c0) # transform log back to actual value
+
+    def nu_emission_vec(self, eNu, time):
+        """Vectorized version of nu_emission(eNu, time).
+
+        eNu and time can be scalars or arrays that numpy can broadcast against
+        each other. All values of time must be time bins from parse_input() or
+        prepare_evt_gen().
+        """
+        (eNu, time) = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(time, dtype=float))
+        rows = np.searchsorted(self.spectrum_times, time)
+        rows = np.minimum(rows, len(self.spectrum_times) - 1)
+        if np.any(self.spectrum_times[rows] != time):
+            raise KeyError("No spectrum at time %s" % time[self.spectrum_times[rows] != time][0])
+
+        x = np.log10(eNu)
+        i = np.clip(np.searchsorted(self.log_e_bins, x, side='right') - 1, 0, len(self.log_e_bins) - 2)
+        dx = x - self._origins[i]
+        (c3, c2, c1, c0) = np.rollaxis(self._coefs[rows, :, i], -1)
+        return 10 ** (((c3 * dx + c2) * dx + c1) * dx + c0) # transform log back to actual value
+
+
+    """Helper functions."""
+    def _add_spectra(self, times, dNLde):
+        """Add log10(dNLde) at the given times to the table of spectra, keeping it sorted by time."""
+        times = np.concatenate((self.spectrum_times, times))
+        order = np.argsort(times, kind='mergesort')
+        self.spectrum_times = times[order]
+        self.log_spectrum = np.concatenate((self.log_spectrum, np.log10(dNLde)))[order]
+
+        # polynomial coefficients of the spline in each energy interval, with
+        # shape (number of times, 4, number of intervals); see parse_input()
+        self._coefs = np.einsum('kie,te->tki', self._unit_coefs, self.log_spectrum)
+        self._rows = dict(zip(self.spectrum_times.tolist(), range(len(self.spectrum_times))))
+
+    def _parse(self, input, format, flv):
+        """Read data from files.
+
+        Returns arrays of time bins, of the total number of neutrinos emitted up
+        to each time and of the number of neutrinos emitted in each energy bin.
+        """
+        with open(input) as infile:
+            raw_indata = [line for line in infile]
+
+        chunks = []
+
+        if format == "early":
+            # 42 lines per time bin, 26 bins in wilson-early.txt
+            for i in range(26):
+                chunks.append(raw_indata[42*i:42*(i+1)])
+            line_N = 6
+            range_egroup = range(19, 39)
+        elif format == "late":
+            # 46 lines per time bin, 36 bins in wilson-late.txt
+            for i in range(36):
+                chunks.append(raw_indata[46*i:46*(i+1)])
+            line_N = 8
+            range_egroup = range(21, 41)
+
+        # input files contain information for e, eb & x right next to each other,
+        # so depending on the flavor, we might need an offset
+        offset = {"e": 0, "eb": 1, "x": 2, "xb": 2}[flv]
+
+        times, N, egroups = [], [], []
+        for chunk in chunks:
+            # first line contains time
+            time = float(chunk[0].split()[0]) * 1000 # convert to ms
+            time -= 2 # change from simulation time into time after core bounce
+            times.append(time)
+
+            # N = total number of neutrinos emitted up to this time
+            N.append(float(chunk[line_N].split()[offset]))
+
+            # number of neutrinos emitted in this time bin, separated into energy bins
+            lines = [map(float, chunk[i].split()) for i in range_egroup]
+            egroups.append([zero] + [line[-3+offset] for line in lines]) # start with 0 neutrinos at 0 MeV bin
+
+        # energy bins are the same for all times; first bin = 0 MeV
+        self.e_bins = np.array([zero] + [line[1] / 1000 for line in lines]) # energy of each bin (in MeV)
+
+        N = np.array(N)
         if offset == 2: N /= 4 # file contains sum of nu_mu, nu_tau and anti-particles
-        N_dict[time] = N
-
-        # number of neutrinos emitted in this time bin, separated into energy bins
-        egroup = [zero] # start with 0 neutrinos at 0 MeV bin
-        for i in range_egroup:
-            line = map(float, chunk[i].split())
-            egroup.append(line[-3+offset])
-
-            # Once, for the very first time bin, save the energy bins:
-            if egroup_dict == {}:
-                e_bins.append(line[1] / 1000) # energy of this bin (in MeV)
-
-        egroup_dict[time] = egroup
-
-    return None
+        return (np.array(times), N, np.array(egroups))
 
 
-def _parse_nb(input):
-    """More granular nu_e data for the neutronization burst ("nb", 40-50ms).
+    def _parse_nb(self, input):
+        """More granular nu_e data for the neutronization burst ("nb", 40-50ms).
 
-    Note: the nb file comes from a slightly different simulation, therefore we
-    have to deal with a time offset and a scaling factor.
-    """
-    with open(input) as infile:
-        raw_indata = [line for line in infile]
+        Note: the nb file comes from a slightly different simulation, therefore we
+        have to deal with a time offset and a scaling factor.
+        Returns arrays of time bins and of the differential number luminosity.
+        """
+        with open(input) as infile:
+            raw_indata = [line for line in infile]
 
-    # 26 lines per time bin, 99 bins in wilson-nb.txt. Bin 6 is equivalent to
-    # 40ms post-bounce & bin 56 is 50ms, so we only select that range:
-    chunks = [raw_indata[26*i:26*(i+1)] for i in range(6,57)]
+        # 26 lines per time bin, 99 bins in wilson-nb.txt. Bin 6 is equivalent to
+        # 40ms post-bounce & bin 56 is 50ms, so we only select that range:
+        chunks = [raw_indata[26*i:26*(i+1)] for i in range(6,57)]
 
-    # for each time bin, save data to dictionaries to look up later
-    for chunk in chunks:
-        time = float(chunk[0].split()[2]) * 1000 # convert to ms
-        time -= 467.5 # 40-50ms post-bounce equals 507.5-517.5ms in this file
-        times_nb.append(time)
+        times, luminosity, egroups = [], [], []
+        for chunk in chunks:
+            time = float(chunk[0].split()[2]) * 1000 # convert to ms
+            times.append(time - 467.5) # 40-50ms post-bounce equals 507.5-517.5ms in this file
+            luminosity.append(float(chunk[1].split()[2]) * 624.151) # convert erg/s to MeV/ms
 
-        luminosity = float(chunk[1].split()[2]) * 624.151 # convert erg/s to MeV/ms
+            # number of neutrinos emitted in this time bin, separated into energy bins
+            egroups.append([zero] + [float(chunk[i].split()[-3]) for i in range(3,23)]) # start with 0 neutrinos at 0 MeV bin
+        (times, luminosity) = (np.array(times), np.array(luminosity))
 
-        # number of neutrinos emitted in this time bin, separated into energy bins
-        egroup = [zero] # start with 0 neutrinos at 0 MeV bin
-        for i in range(3,23):
-            line = map(float, chunk[i].split())
-            egroup.append(line[-3])
-
-        # Get energy spectrum per MeV^-1 instead of in (varying-size) energy bins
-        E_integ = 0
-        spec = []
-        for (j, n) in enumerate(egroup):
-            if j == 0 or j == len(egroup)-1:
-                spec.append(zero)
-            else:
-                spec.append(n / (e_bins[j+1] - e_bins[j-1]))
-                E_integ += (spec[j-1] * e_bins[j-1] + spec[j] * e_bins[j]) \
-                            * (e_bins[j] - e_bins[j-1]) / 2
-
-        spec = [x / E_integ * luminosity for x in spec]
+        # Get energy spectrum per MeV^-1 instead of in (varying-size) energy bins,
+        # normalised to the luminosity
+        spec = self._spectrum(np.array(egroups))
+        e = self.e_bins[:-1] # the last energy bin is always empty
+        E_integ = np.sum((spec[:, :-2] * e[:-1] + spec[:, 1:-1] * e[1:]) * np.diff(e) / 2, axis=1)
+        spec *= (luminosity / E_integ)[:, None]
 
         # nb and early/late data come from slightly different simulations and
         # have a discontinuity, so we scale with a time-dependent factor
-        nb_scale = 1 - 5.23/13.82 * (time - 40) / 10 # 1 at 40ms, 8.59/13.82 at 50ms
-        dNLde_dict[time] = [x * nb_scale for x in spec]
-    return None
+        nb_scale = 1 - 5.23/13.82 * (times - 40) / 10 # 1 at 40ms, 8.59/13.82 at 50ms
+        return (times, spec * nb_scale[:, None])
 
 
-def _calculate_dNLde():
-    """Calculate number luminosity spectrum for each time bin."""
-    for (i, time) in enumerate(times_el):
+    def _calculate_dNLde(self, times, N, egroups):
+        """Calculate number luminosity spectrum for each time bin."""
         # Get energy spectrum per MeV^-1 instead of in (varying-size) energy bins
-        E_integ = 0
-        spec = []
-        egroup = egroup_dict[time] # list: number of neutrinos in different e_bins
-
-        for (j, n) in enumerate(egroup):
-            if j == 0 or j == len(egroup)-1:
-                spec.append(zero)
-            else:
-                spec.append(n / (e_bins[j+1] - e_bins[j-1]))
-                E_integ += (spec[j-1] + spec[j]) * (e_bins[j] - e_bins[j-1]) / 2
-
-        spec = [x / E_integ for x in spec] # normalise to 1
+        spec = self._spectrum(egroups)
+        e = self.e_bins[:-1] # the last energy bin is always empty
+        E_integ = np.sum((spec[:, :-2] + spec[:, 1:-1]) * np.diff(e) / 2, axis=1)
+        spec /= E_integ[:, None] # normalise to 1
 
         # Calculate number luminosity
-        if i == 0:
-            num_lum = zero
-        else:
-            prev_time = times_el[i-1]
-            num_lum = (N_dict[time] - N_dict[prev_time]) / (time - prev_time)
+        num_lum = np.empty(len(times))
+        num_lum[0] = zero
+        num_lum[1:] = np.diff(N) / np.diff(times)
 
         # Calculate differential number luminosity
-        dNLde = [num_lum * spectrum for spectrum in spec]
-        dNLde_dict[time] = dNLde
+        return num_lum[:, None] * spec
+
+    def _spectrum(self, egroups):
+        """Number of neutrinos per MeV, from the number in each energy bin (one row per time bin).
 
-    return None
+        The first and last energy bin are set to (almost) zero.
+        """
+        spec = np.full(egroups.shape, zero)
+        spec[:, 1:-1] = egroups[:, 1:-1] / (self.e_bins[2:] - self.e_bins[:-2])
+        return spec
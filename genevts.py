@@ -1,16 +1,31 @@
 #!/usr/bin/python
 
-import __builtin__
 import argparse
 from datetime import datetime
+import heapq
 from importlib import import_module
+import io
+import itertools
+import json
+from math import pi
+from multiprocessing import Pool, current_process
+import numpy as np
+import os
 import random
+import shutil
+import tempfile
+import time
+import zipfile
 
-from channel import gen_evts
+from channel import FluxStore, Generator
+from profiling import Profile, cpu_time
 
 
 channels = ['ibd', 'es', 'o16e', 'o16eb']
 
+# parsed input data, shared by all jobs in this run
+flux_store = FluxStore()
+
 # radius (cm), height (cm) and mass (kt) of inner detector
 detectors = {"SuperK": (3368.15/2., 3620., 32.5),
              "HyperK": (7080./2., 5480., 220)}
@@ -47,6 +62,7 @@ mixings = {"noosc":    (('e', 1, 'e'),
 
 
 def main():
+    start = (time.time(), cpu_time())
     args = parse_command_line_options()
 
     hierarchy = args.hierarchy
@@ -60,6 +76,11 @@ def main():
     starttime = args.starttime if args.starttime else None
     endtime = args.endtime if args.endtime else None
     verbose = args.verbose
+    sampler = args.sampler
+    jobs = args.jobs
+    # Without a user-supplied seed, pick one at random (and print it in verbose
+    # mode), so the run can be reproduced later if necessary.
+    seed = args.seed if args.seed is not None else random.SystemRandom().randint(0, 2**32 - 1)
 
     if verbose:
         print "channel(s)   =", channels
@@ -70,33 +91,136 @@ def main():
         print "distance     =", distance
         print "starttime    =", starttime
         print "endtime      =", endtime
+        print "sampler      =", sampler
+        print "integrator   =", args.integrator
+        print "flux cubes   =", args.flux_cube_dir
+        print "window       =", args.window
+        print "bin tolerance=", args.bin_tolerance
+        print "jobs         =", jobs
+        print "seed         =", seed
         print "**************************************"
 
-    # Take into account hierarchy-dependent flavor mixing and let channel.py
-    # generate the actual events for each channel.
-    events_by_channel = {}
+    # Take into account hierarchy-dependent flavor mixing and collect one job
+    # for each combination of channel, original flavor and detected flavor.
+    job_list = []
     for channel in channels:
-        mod_channel = import_module("interaction_channels." + channel)
+        possible_flavors = import_module("interaction_channels." + channel).Channel.possible_flavors
         for (original_flv, scale, detected_flv) in mixings[hierarchy]:
-            if detected_flv in mod_channel.possible_flavors:
-
-                # TODO: Replace this with a more sensible design, e.g. see https://stackoverflow.com/a/15959638
-                __builtin__._flavor = detected_flv
-
+            if detected_flv in possible_flavors:
                 scale *= (10.0/distance)**2 # flux is proportional to 1/distance**2
                 scale *= detector[2] * 3.343e+31 # number of water molecules (assuming 18 g/mol)
 
-                cmd = "gen_evts(_channel='%s', input='%s', _format='%s', inflv='%s', scale=%s, starttime=%s, endtime=%s, verbose=%s)" \
-                    % (channel, input, format, original_flv, scale, starttime, endtime, verbose)
-                if verbose: print "Now executing:", cmd
-                events_by_channel[(channel, original_flv, detected_flv)] = eval(cmd)
-
-    # Collect events generated in all interaction channels.
-    events = [evt for evtlist in events_by_channel.values() for evt in evtlist]
-    events.sort() # sort by time (i.e. the first element of the list)
-
-    # Write events to a nuance-formatted output file
-    write_output(events, output, args)
+                # Each job gets its own random number streams, derived from the
+                # seed and its position in the list, so results are independent
+                # of the number of processes running in parallel.
+                options = {'channel': channel, 'flavor': detected_flv, 'input': input, 'format': format,
+                           'inflv': original_flv, 'flux_cache_size': args.flux_cache_size,
+                           'flux_quantum': args.flux_quantum, 'rate_cache': args.rate_cache or None,
+                           'integrator': args.integrator, 'xs_tables': args.xs_tables}
+                kwargs = {'scale': scale, 'starttime': starttime, 'endtime': endtime, 'verbose': verbose,
+                          'sampler': sampler, 'seed': [seed, len(job_list)]}
+                job_list.append((options, kwargs))
+
+    global flux_store
+    flux_store = FluxStore(args.flux_cube_dir or None, args.bin_tolerance)
+
+    # Parse each input only once, before any worker processes are forked, so
+    # that all jobs share the parsed data.
+    for inflv in set(options['inflv'] for (options, _) in job_list):
+        flux_store.get(input, format, inflv, starttime, endtime)
+
+    output_profile = Profile()
+    if args.window:
+        # Each Generator (see channel.py) yields its events window by window, and
+        # these are merged lazily, so events from the first windows are written
+        # to the output file while later windows are still being generated. Each
+        # window is generated in up to `jobs` processes, which exit before its
+        # events are yielded, so there are never more than `jobs` processes.
+        # (Time spent generating events is therefore included in the 'output'
+        # stage of the profile.)
+        generators = []
+        for (options, kwargs) in job_list:
+            if verbose:
+                print "Now executing: %s" % describe_job((options, kwargs))
+            generators.append(Generator(flux_store=flux_store, **options))
+        events = heapq.merge(*[generator.iter_evts(processes=jobs, window=args.window, **kwargs)
+                               for (generator, (_, kwargs)) in zip(generators, job_list)])
+        write_output(events, output, args, seed, output_profile)
+        profiles = [generator.profile for generator in generators]
+
+    else:
+        # Let a Generator (see channel.py) generate the actual events for each job.
+        # If there are enough jobs to keep all processes busy, run jobs in parallel;
+        # otherwise, run jobs one after another and parallelize event generation
+        # within each.
+        if jobs > 1 and len(job_list) >= jobs:
+            # Jobs with the same channel & detected flavor use the same tables, so
+            # compute these once, before worker processes are forked. (The time
+            # this takes is added to the profile of the first of these jobs.)
+            table_profiles = {}
+            for (options, kwargs) in job_list:
+                if not table_profiles.has_key((options['channel'], options['flavor'])):
+                    generator = Generator(flux_store=flux_store, **options)
+                    generator.prepare_tables(kwargs['sampler'])
+                    table_profiles[(options['channel'], options['flavor'])] = generator.profile
+            pool = Pool(jobs)
+            results = pool.map(run_job, job_list)
+            pool.close()
+            pool.join()
+            for ((options, _), (_, profile)) in zip(job_list, results):
+                profile.add(table_profiles.pop((options['channel'], options['flavor']), Profile()))
+        else:
+            for (_, kwargs) in job_list:
+                kwargs['processes'] = jobs
+            results = map(run_job, job_list)
+
+        events_by_channel = {}
+        for ((options, _), (evtlist, _)) in zip(job_list, results):
+            events_by_channel[(options['channel'], options['inflv'], options['flavor'])] = evtlist
+
+        # Events from each job are already sorted by time (i.e. the first element of
+        # each tuple), so we can merge them lazily instead of building and sorting a
+        # separate list containing all events.
+        events = heapq.merge(*events_by_channel.values())
+
+        # Write events to the output file
+        write_output(events, output, args, seed, output_profile)
+        profiles = [profile for (_, profile) in results]
+
+    if args.profile:
+        filename = os.path.splitext(output)[0] + ".profile.json"
+        total = (time.time() - start[0], cpu_time() - start[1])
+        write_profile(filename, job_list, profiles, output_profile, total, args)
+        print "Saved profile in '%s'." % filename
+
+
+def run_job(job):
+    """Generate events for one (channel, original flavor, detected flavor) combination.
+
+    Returns the events and the profile of the generator (see profiling.py).
+    Runs in a worker process if `--jobs` is greater than 1, so it must be a
+    module-level function. Worker processes inherit `flux_store` from main().
+    """
+    (options, kwargs) = job
+
+    if kwargs['verbose']:
+        print "Now executing: %s" % describe_job(job)
+    try:
+        generator = Generator(flux_store=flux_store, **options)
+        return (generator.gen_evts(**kwargs), generator.profile)
+    except SystemExit:
+        # Parsers call exit() on invalid input. In a worker process, that would
+        # kill the worker and leave the pool waiting forever, so we turn it into
+        # an exception that is passed back to the main process instead.
+        if current_process().name == 'MainProcess':
+            raise
+        raise RuntimeError("Event generation failed for %s (%s -> %s)." % (options['channel'], options['inflv'], options['flavor']))
+
+
+def describe_job(job):
+    """Describe a job as the corresponding call of Generator.gen_evts(), for verbose output."""
+    (options, kwargs) = [", ".join("%s=%r" % item for item in sorted(d.items())) for d in job]
+    return "Generator(%s).gen_evts(%s)" % (options, kwargs)
 
 
 def parse_command_line_options():
@@ -113,7 +237,9 @@ def parse_command_line_options():
 
     default = "outfile.kin"
     parser.add_argument("-o", "--output", metavar="FILE", default=default,
-                        help="Name of the output file. Default: '%s'." % default)
+                        help="Name of the output file. If it ends in '.npy' or '.npz', events are written as \
+                              a numpy structured array instead of in the NUANCE format; use npy2nuance.py to \
+                              convert it later. Default: '%s'." % default)
 
     choices = ["noosc", "normal", "inverted"]
     default = choices[0]
@@ -140,48 +266,278 @@ def parse_command_line_options():
     parser.add_argument("--endtime", metavar="T", type=float,
                       help="Stop generating events at T milliseconds. Default: Last time bin in input file.")
 
+    choices = ["table", "rejection"]
+    default = choices[0]
+    parser.add_argument("--sampler", metavar="SAMPLER", choices=choices, default=default,
+                      help="Method for sampling neutrino energy and direction of generated particles. \
+                            'table' tabulates the distributions once per time bin (energy) or per process \
+                            (direction), 'rejection' uses per-event rejection sampling (slow, but useful for \
+                            validation). Choices: %s. Default: %s" % (choices, default))
+
+    default = 1
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=default,
+                      help="Number of worker processes. Each combination of channel, original and detected \
+                            flavor is an independent job; if there are fewer jobs than processes, time bins \
+                            within each job are generated in parallel instead. Default: %s" % default)
+
+    parser.add_argument("--seed", metavar="SEED", type=int,
+                      help="Seed for the random number generators. Runs with the same seed and options give \
+                            identical results, independent of the number of processes. Default: random seed.")
+
+    default = 100000
+    parser.add_argument("--flux-cache-size", metavar="N", type=int, default=default,
+                      help="Maximum number of flux values to keep in the in-memory cache of each job (which \
+                            avoids re-evaluating the flux at the same energy & time; unrelated to --flux-cube-dir). \
+                            Least recently used values are evicted first; 0 disables the cache. Default: %s" % default)
+
+    parser.add_argument("--flux-quantization", dest="flux_quantum", metavar="DE", type=float,
+                      help="Round neutrino energies to multiples of DE (in MeV) before looking up the flux, \
+                            which increases hits of the in-memory flux cache (see --flux-cache-size) at the cost \
+                            of accuracy. Default: no rounding.")
+
+    default = os.path.join(os.path.expanduser("~"), ".cache", "sntools")
+    parser.add_argument("--rate-cache", metavar="DIR", default=default,
+                      help="Directory for caching event rates calculated from the input files. Since these \
+                            don't depend on distance or detector, they are reused automatically if the input \
+                            files, channel, flavor and code are unchanged. Use '' to disable. Default: '%s'." % default)
+
+    parser.add_argument("--flux-cube-dir", metavar="DIR",
+                      help="Directory for binary flux cubes on disk (see flux_cube.py; unrelated to the in-memory \
+                            cache set by --flux-cache-size). The input files are converted into a flux cube on \
+                            first use; later runs memory-map the cube instead of parsing the input files again. \
+                            Default: parse the input files directly.")
+
+    parser.add_argument("--bin-tolerance", metavar="TOL", type=float,
+                      help="Use adaptive time bins instead of 1 ms bins: each bin is as wide as possible (up to \
+                            1 s) while the neutrino spectrum changes by less than TOL (relative to its maximum) \
+                            within the bin, e.g. 0.01. Event times are still drawn uniformly within each bin. \
+                            This is much faster for long time spans. Default: 1 ms bins.")
+
+    choices = ["scipy", "fast"]
+    default = choices[0]
+    parser.add_argument("--integrator", metavar="INTEGRATOR", choices=choices, default=default,
+                      help="Method for calculating event rates from the input fluxes. 'scipy' uses adaptive \
+                            quadrature; 'fast' uses fixed-order Gauss-Legendre quadrature for all time steps at \
+                            once, which is much faster and typically accurate to 1e-3 or better (the estimated \
+                            error is shown in verbose mode). Choices: %s. Default: %s" % (choices, default))
+
+    parser.add_argument("--xs-tables", metavar="DIR",
+                      help="Directory containing cross section tables created by xs_tables.py. Interpolating \
+                            in these tables is faster than calculating cross sections directly for some channels \
+                            (see the output of xs_tables.py); tables that are not accurate enough are ignored. \
+                            Default: calculate cross sections directly.")
+
+    parser.add_argument("--window", metavar="T", type=float,
+                      help="Generate events in windows of (at least) T milliseconds and write each window to the \
+                            output file before generating the next one, so only one window of events is held in \
+                            memory at a time. Events are identical to those generated without this option. \
+                            Default: generate all events before writing the output file.")
+
+    parser.add_argument("--profile", action="store_true",
+                      help="Measure wall & CPU time of each stage (parsing, rate integration, flux pre-computation, \
+                            sampling, vertex generation, output) and count evaluations in hot paths, for each \
+                            channel and flavor. The results are saved in JSON format next to the output file, \
+                            e.g. in 'outfile.profile.json'. Off by default.")
+
     parser.add_argument("-v", "--verbose", action="count",
                       help="Verbose output, e.g. for debugging. Off by default.")
 
     return parser.parse_args()
 
 
-def write_output(events, outfile, args):
+def write_output(events, outfile, args, seed=None, profile=None):
+    """Write events to the output file.
+
+    Adds a random vertex position inside the detector to each event, using the
+    random seed `seed`. If the
+    file name ends in '.npy' or '.npz', events are written as a numpy
+    structured array (see `event_dtype`), otherwise in the NUANCE format.
+    If a Profile is given, the time spent is recorded in its stages 'vertex
+    generation' and 'output' (excluding vertex generation).
+    """
+    profile = profile or Profile()
+    records = add_vertices(events, detectors[args.detector], np.random.RandomState(seed), profile=profile)
+
+    with profile.stage("output", exclude=["vertex generation"]):
+        if outfile.endswith(".npy") or outfile.endswith(".npz"):
+            write_binary(records, outfile, args)
+        else:
+            comment = None
+            if args.verbose: # write parameters to file as a comment
+                comment = "Generated on %s with the options:\n%s" % (datetime.now(), args)
+            write_nuance(records, outfile, comment)
+
+
+def add_vertices(events, detector, np_rng=np.random, chunk_size=100000, profile=None):
+    """Add a random vertex position inside the detector volume to each event.
+
+    Vertices are drawn as arrays for blocks of `chunk_size` events, so `events`
+    can be any iterable (e.g. a generator) and is never held in memory all at once.
+    """
+    profile = profile or Profile()
+    radius = detector[0] - 20
+    height = detector[1] - 20
+
+    events = iter(events)
+    while True:
+        chunk = list(itertools.islice(events, chunk_size))
+        if not chunk: break
+
+        with profile.stage("vertex generation"):
+            # uniformly distributed in the cylinder
+            r = radius * np.sqrt(np_rng.random_sample(len(chunk)))
+            phi = 2 * pi * np_rng.random_sample(len(chunk))
+            z = np_rng.uniform(-height/2, height/2, len(chunk))
+            records = [(t, x, y, z, pid, ene, dirx, diry, dirz, channel, flavor, eNu)
+                       for ((t, pid, ene, dirx, diry, dirz, channel, flavor, eNu), x, y, z) in
+                       zip(chunk, (r * np.cos(phi)).tolist(), (r * np.sin(phi)).tolist(), z.tolist())]
+
+        for record in records:
+            yield record
+
+
+def write_profile(filename, job_list, profiles, output_profile, total, args):
+    """Save the profiles of all jobs (see run_job()) and of writing the output as JSON.
+
+    The report contains the time spent parsing and preparing each input, the
+    profile of each job and their sum for each combination of channel and
+    detected flavor, the profile of writing the output and the total wall & CPU
+    time of the run (`total`). CPU times include worker processes.
+    """
+    inputs = []
+    for ((input, format, inflv, starttime, endtime), profile) in sorted(flux_store.profiles.items()):
+        report = profile.as_dict()
+        report.update(input=input, format=format, inflv=inflv, starttime=starttime, endtime=endtime)
+        inputs.append(report)
+
+    jobs = []
+    by_channel = {}
+    for ((options, _), profile) in zip(job_list, profiles):
+        report = profile.as_dict()
+        report.update(channel=options['channel'], inflv=options['inflv'], flavor=options['flavor'])
+        jobs.append(report)
+        by_channel.setdefault((options['channel'], options['flavor']), Profile()).add(profile)
+
+    channels = []
+    for ((channel, flavor), profile) in sorted(by_channel.items()):
+        report = profile.as_dict()
+        report.update(channel=channel, flavor=flavor)
+        channels.append(report)
+
+    report = {'options': vars(args), 'inputs': inputs, 'jobs': jobs, 'channels': channels,
+              'output': output_profile.as_dict(), 'total': {'wall_time': total[0], 'cpu_time': total[1]}}
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+
+flavor_codes = {'e':12, 'eb':-12, 'x':14, 'xb':-14}
+channel_codes = {'ibd':1, 'es':2, 'o16e':3, 'o16eb':4}
+# PDG code and mass (MeV) of the target in each channel
+targets = {'es':(11, 0.511),
+           'ibd':(2212, 938.3),
+           'o16e':(8016, 14900),
+           'o16eb':(8016, 14900)}
+
+nuance_event = ("$ begin\n"
+                "$ nuance 0\n"
+                "$ vertex %.5f %.5f %.5f %.5f\n"
+                "$ track %i %.5f 0.0 0.0 1.0 -1\n" # incoming neutrino
+                "$ track %i %.3f 0.0 0.0 1.0 -1\n" # target
+                "$ info 0 0 %i\n"
+                "$ track %i %.5f %.5f %.5f %.5f 0\n" # Outgoing particle track
+                "$ end\n")
+
+def write_nuance(records, outfile, comment=None, buffer_size=10000):
+    """Write events (including vertex positions) to a NUANCE-formatted file.
+
+    `records` can be any iterable that yields events in time order (e.g. a
+    generator). They are written in blocks of `buffer_size` events, so the
+    output never needs to be held in memory all at once.
+    """
     with open(outfile, 'w') as outfile:
-        if args.verbose: # write parameters to file as a comment
-            outfile.write("# Generated on %s with the options:\n" % datetime.now())
-            outfile.write("# " + str(args) + "\n")
-
-        for (i, event) in enumerate(events):
-            (t, pid, ene, dirx, diry, dirz, channel, flavor, eNu) = event
-
-            # create random vertex position inside the detector volume
-            radius = detectors[args.detector][0] - 20
-            height = detectors[args.detector][1] - 20
-            while True:
-                x = random.uniform(-radius, radius)
-                y = random.uniform(-radius, radius)
-                if x**2 + y**2 < radius**2: break
-            z = random.uniform(-height/2, height/2)
-
-            flv_code = {'e':12, 'eb':-12, 'x':14, 'xb':-14}[flavor]
-            tgt_code, tgt_mass = {'es':(11, 0.511),
-                                  'ibd':(2212, 938.3),
-                                  'o16e':(8016, 14900),
-                                  'o16eb':(8016, 14900),
-                                  }[channel]
-
-            outfile.write("$ begin\n")
-            outfile.write("$ nuance 0\n")
-            outfile.write("$ vertex %.5f %.5f %.5f %.5f\n" % (x, y, z, t))
-            outfile.write("$ track %i %.5f 0.0 0.0 1.0 -1\n" % (flv_code, eNu)) # incoming neutrino
-            outfile.write("$ track %i %.3f 0.0 0.0 1.0 -1\n" % (tgt_code, tgt_mass)) # target
-            outfile.write("$ info 0 0 %i\n" % i)
-            outfile.write("$ track %i %.5f %.5f %.5f %.5f 0\n" % (pid, ene, dirx, diry, dirz)) # Outgoing particle track
-            outfile.write("$ end\n")
+        if comment:
+            outfile.write("".join("# " + line + "\n" for line in comment.split("\n")))
+
+        buffer = []
+        for (i, record) in enumerate(records):
+            (t, x, y, z, pid, ene, dirx, diry, dirz, channel, flavor, eNu) = record
+            flv_code = flavor_codes[flavor]
+            (tgt_code, tgt_mass) = targets[channel]
 
+            buffer.append(nuance_event % (x, y, z, t, flv_code, eNu, tgt_code, tgt_mass, i, pid, ene, dirx, diry, dirz))
+            if len(buffer) == buffer_size:
+                outfile.write("".join(buffer))
+                buffer = []
+
+        outfile.write("".join(buffer))
         outfile.write("$ stop\n")
 
 
+event_dtype = np.dtype([('t', 'f8'), # time (ms)
+                        ('x', 'f8'), ('y', 'f8'), ('z', 'f8'), # vertex position (cm)
+                        ('pid', 'i4'), # PDG code of outgoing particle
+                        ('energy', 'f8'), # total energy of outgoing particle (MeV)
+                        ('dirx', 'f8'), ('diry', 'f8'), ('dirz', 'f8'), # direction of outgoing particle
+                        ('channel', 'i1'), # see `channel_codes`
+                        ('flavor', 'i1'), # PDG code of incoming neutrino, see `flavor_codes`
+                        ('eNu', 'f8')]) # neutrino energy (MeV)
+
+def write_binary(records, outfile, args, chunk_size=100000):
+    """Write events (including vertex positions) as a numpy structured array.
+
+    '.npy' files can be memory-mapped with `numpy.load(outfile, mmap_mode='r')`.
+    '.npz' files are compressed and additionally contain the command line
+    options as a string in `options`.
+    Events are converted and written in chunks of `chunk_size`, so `records` can
+    be any iterable (e.g. a generator) and is never held in memory all at once.
+    """
+    directory = os.path.dirname(os.path.abspath(outfile))
+
+    # The number of events is part of the header of a '.npy' file, so events
+    # are first written to a temporary file and copied after the header later.
+    n_events = 0
+    with tempfile.TemporaryFile(dir=directory) as data:
+        while True:
+            chunk = [record[:9] + (channel_codes[record[9]], flavor_codes[record[10]], record[11])
+                     for record in itertools.islice(records, chunk_size)]
+            if not chunk: break
+            data.write(np.array(chunk, dtype=event_dtype).tostring())
+            n_events += len(chunk)
+        data.seek(0)
+
+        def write_npy(f):
+            header = {'descr': np.lib.format.dtype_to_descr(event_dtype), 'fortran_order': False, 'shape': (n_events,)}
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(data, f)
+
+        if outfile.endswith(".npz"):
+            # same contents as numpy.savez_compressed(outfile, events=..., options=str(args))
+            with tempfile.NamedTemporaryFile(dir=directory) as npy:
+                write_npy(npy)
+                npy.flush()
+                options = io.BytesIO()
+                np.save(options, str(args))
+                with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as npz:
+                    npz.write(npy.name, "events.npy")
+                    npz.writestr("options.npy", options.getvalue())
+        else:
+            with open(outfile, 'wb') as npy:
+                write_npy(npy)
+
+
+def read_binary(infile):
+    """Read events written by write_binary() and yield them in the format used by write_nuance()."""
+    if infile.endswith(".npz"):
+        events = np.load(infile)['events']
+    else:
+        events = np.load(infile, mmap_mode='r')
+
+    channel_names = dict((code, name) for (name, code) in channel_codes.items())
+    flavor_names = dict((code, name) for (name, code) in flavor_codes.items())
+    for event in events:
+        record = event.tolist()
+        yield record[:9] + (channel_names[record[9]], flavor_names[record[10]], record[11])
+
+
 if __name__ == "__main__":
     main()
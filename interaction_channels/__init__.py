@@ -1 +1,44 @@
+"""Interaction channels.
 
+Each module in this folder implements one interaction channel as a subclass of
+`BaseChannel`, named `Channel`. See `_example.py` for a description of the
+attributes and methods that need to be provided.
+"""
+
+import numpy as np
+
+
+class BaseChannel(object):
+    """Base class for interaction channels.
+
+    An instance describes interactions of one (detected) neutrino flavor in
+    this channel and holds no other state, so it can be used by any number of
+    generators at the same time.
+    """
+    def __init__(self, flavor):
+        if flavor not in self.possible_flavors:
+            raise ValueError("Flavor '%s' does not interact in channel %s. Possible flavors: %s"
+                             % (flavor, self.name, self.possible_flavors))
+        self.flavor = flavor
+
+    @property
+    def name(self):
+        """Abbreviation of the channel, e.g. 'ibd', 'es', ... (i.e. the module name)."""
+        return self.__module__.split(".")[-1]
+
+    # Vectorized cross sections are optional; fall back to the scalar versions.
+    def dSigma_dE_vec(self, eNu, eE):
+        return np.vectorize(self.dSigma_dE, otypes=[float])(eNu, eE)
+
+    def dSigma_dCosT_vec(self, eNu, cosT):
+        return np.vectorize(self.dSigma_dCosT, otypes=[float])(eNu, cosT)
+
+    # Channels where eE is not fully determined by eNu and cosT need to provide
+    # a vectorized get_eE that uses np_rng; otherwise, fall back to get_eE.
+    def get_eE_vec(self, eNu, cosT, np_rng=None):
+        return np.vectorize(self.get_eE, otypes=[float])(eNu, cosT)
+
+    # Set options for numerical integration. Not needed for all channels, so
+    # default to returning an empty dictionary.
+    def _opts(self, eNu, *args):
+        return {'points': []}
@@ -1,121 +1,169 @@
 '''
 Sample implementation of an interaction channel.
 
-Most of the actual work is done in `channel.py`. Here, you need to provide
-8 constants/functions that characterize this interaction channel.
+Most of the actual work is done in `channel.py`. Here, you need to provide a
+class named `Channel`, derived from `BaseChannel`, with 8 attributes/methods
+that characterize this interaction channel.
 See the docstrings below for detailed descriptions.
+Vectorized versions of the cross sections are optional but highly recommended,
+since they are much faster when evaluating many values at once.
+
+Instances are created for one (detected) neutrino flavor, e.g. `Channel("eb")`,
+which is available as `self.flavor` if the cross section depends on it.
+Instances must not store any other state, since they may be shared by several
+event generators at the same time.
 
 If you need to define helper functions or constants, you can do so at the bottom
 of this file, where some commonly used constants are already provided.
 '''
 
-'''
-targets_per_molecule:
-number of interaction targets per water molecule
-(i.e. 2 free protons, 1 oxygen nucleus or 10 electrons)
-'''
-targets_per_molecule = None
-
-
-'''
-pid:
-ID of the outgoing (detected) particle, using Particle Data Group conventions
-(e.g. electron = 11, positron = -11)
-'''
-pid = None
-
-
-'''
-possible_flavors:
-which neutrino flavors ("e", "eb", "x", "xb") interact in this channel
-'''
-possible_flavors = ["e"]
+from interaction_channels import BaseChannel
+
+
+class Channel(BaseChannel):
+    '''
+    targets_per_molecule:
+    number of interaction targets per water molecule
+    (i.e. 2 free protons, 1 oxygen nucleus or 10 electrons)
+    '''
+    targets_per_molecule = None
+
+
+    '''
+    pid:
+    ID of the outgoing (detected) particle, using Particle Data Group conventions
+    (e.g. electron = 11, positron = -11)
+    '''
+    pid = None
+
+
+    '''
+    possible_flavors:
+    which neutrino flavors ("e", "eb", "x", "xb") interact in this channel
+    '''
+    possible_flavors = ["e"]
+
+
+    '''
+    dSigma_dE(eNu, eE):
+    Differential cross section.
+    Input:
+        eNu: neutrino energy
+        eE:  energy of outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def dSigma_dE(self, eNu, eE):
+        return None
+
+
+    '''
+    dSigma_dCosT(eNu, cosT):
+    Distribution of the angle at which the outgoing (detected) particle is emitted.
+    Input:
+        eNu:  neutrino energy (MeV)
+        cosT: cosine of the angle between neutrino and outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def dSigma_dCosT(self, eNu, cosT):
+        return None
+    #     eE = self.get_eE(eNu, cosT)
+    #     dE_dCosT = None
+    #     return dE_dCosT * self.dSigma_dE(eNu, eE)
+
+
+    '''
+    dSigma_dE_vec(eNu, eE), dSigma_dCosT_vec(eNu, cosT):
+    Vectorized versions of dSigma_dE and dSigma_dCosT. Optional.
+    Input:
+        arrays (or scalars) that numpy can broadcast against each other
+    Output:
+        array with the broadcast shape of the input
+    If these are not provided, `BaseChannel` falls back to numpy.vectorize(), which
+    gives the same results but is no faster than calling the scalar functions.
+    '''
+    # def dSigma_dE_vec(self, eNu, eE):
+    #     return None
+    #
+    # def dSigma_dCosT_vec(self, eNu, cosT):
+    #     return None
+
+
+    '''
+    get_eE(eNu, cosT, rng):
+    Energy of outgoing (detected particle).
+    Input:
+        eNu:  neutrino energy (MeV)
+        cosT: cosine of the angle between neutrino and outgoing (detected) particle
+        rng:  random number generator (a random.Random instance), only needed if
+              eE is not fully determined by eNu and cosT (see e.g. `o16e.py`)
+    Output:
+        one floating point number
+    '''
+    def get_eE(self, eNu, cosT, rng=None):
+        return None
+
+
+    '''
+    get_eE_vec(eNu, cosT, np_rng):
+    Vectorized version of get_eE. Optional, unless eE is not fully determined by
+    eNu and cosT (see e.g. `o16e.py`).
+    Input:
+        eNu:    neutrino energies (array)
+        cosT:   cosines of the scattering angle (array, broadcastable with eNu)
+        np_rng: numpy random number generator (a numpy.random.RandomState instance)
+    Output:
+        array with the broadcast shape of the input
+    If this is not provided, `BaseChannel` falls back to numpy.vectorize().
+    '''
+    # def get_eE_vec(self, eNu, cosT, np_rng=None):
+    #     return None
+
+
+    '''
+    bounds_eE(eNu, *args):
+    Kinematical bounds for integration over eE.
+    Input:
+        eNu:  neutrino energy (MeV)
+        args: [implementation detail; ignore this]
+    Output:
+        list with minimum & maximum allowed energy of outgoing (detected) particle
+    '''
+    def bounds_eE(self, eNu, *args):
+        return [None, None]
+    #     return [eE_min(eNu), eE_max(eNu)]
+
+
+    '''
+    bounds_eNu
+    List with minimum & maximum energy of incoming neutrino. The minimum energy is
+    typically given by the threshold energy for the interaction, while the maximum
+    energy is given by the supernova neutrino flux.
+    '''
+    bounds_eNu = [None, 100]
+    # bounds_eNu = [e_threshold, 100]
+
+    # minimum/maximum neutrino energy that can produce a given positron energy
+    # Optional. Can reduce numerical inaccuracy when integrating over eNu.
+    def _bounds_eNu(self, eE):
+        return self.bounds_eNu
 
 
 '''
-dSigma_dE(eNu, eE):
-Differential cross section.
-Input:
-    eNu: neutrino energy
-    eE:  energy of outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def dSigma_dE(eNu, eE):
-    return None
-
-
-'''
-dSigma_dCosT(eNu, cosT):
-Distribution of the angle at which the outgoing (detected) particle is emitted.
-Input:
-    eNu:  neutrino energy (MeV)
-    cosT: cosine of the angle between neutrino and outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def dSigma_dCosT(eNu, cosT):
-    return None
-#     eE = get_eE(eNu, cosT)
-#     dE_dCosT = None
-#     return dE_dCosT * dSigma_dE(eNu, eE)
-
-
-'''
-get_eE(eNu, cosT):
-Energy of outgoing (detected particle).
-Input:
-    eNu:  neutrino energy (MeV)
-    cosT: cosine of the angle between neutrino and outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def get_eE(eNu, cosT):
-    return None
-
+End of required values.
 
+If you need to define helper functions or constants, you can do so below.
+Some commonly needed constants are already provided.
 '''
-bounds_eE(eNu, *args):
-Kinematical bounds for integration over eE.
-Input:
-    eNu:  neutrino energy (MeV)
-    args: [implementation detail; ignore this]
-Output:
-    list with minimum & maximum allowed energy of outgoing (detected) particle
-'''
-def bounds_eE(eNu, *args):
-    return [None, None]
-#     return [eE_min(eNu), eE_max(eNu)]
+# e_threshold = 0 # threshold energy for current channel
 #
 # def eE_min(eNu):
 #     return None
 #
 # def eE_max(eNu):
 #     return None
-
-
-'''
-bounds_eNu
-List with minimum & maximum energy of incoming neutrino. The minimum energy is
-typically given by the threshold energy for the interaction, while the maximum
-energy is given by the supernova neutrino flux.
-'''
-bounds_eNu = [None, 100]
-# bounds_eNu = [e_threshold, 100]
-# e_threshold = 0 # threshold energy for current channel
-
-# minimum/maximum neutrino energy that can produce a given positron energy
-# Optional. Can reduce numerical inaccuracy when integrating over eNu.
-def _bounds_eNu(eE):
-    return bounds_eNu
-
-
-'''
-End of required values.
-
-If you need to define helper functions or constants, you can do so below.
-Some commonly needed constants are already provided.
-'''
+#
 # mN = 939.5654 # neutron mass (MeV)
 # mP = 938.2721 # proton mass (MeV)
 # mE = 0.5109989 # electron mass (MeV)
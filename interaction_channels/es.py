@@ -1,11 +1,8 @@
 from math import pi, sqrt, log
-from scipy import integrate
+import numpy as np
+from scipy import special
 
-# Note: `es.py` uses `__builtin__._flavor` (which is set in `genevts.py`)
-
-targets_per_molecule = 10 # number of electrons per water molecule
-pid = 11
-possible_flavors = ["e", "eb", "x", "xb"]
+from interaction_channels import BaseChannel
 
 
 '''
@@ -26,111 +23,201 @@ mE = 0.5109989 # electron mass (MeV)
 gF = 1.16637e-11 # Fermi coupling constant
 rho_NC = 1.0126 # numerical factor from Bahcall et al.
 
-_cache = {} # save time by avoiding repeat calculations
+# integral of log(abs(1-t))/t from 0 to n, i.e. minus the dilogarithm Li2(n).
+# scipy.special.spence(x) is Li2(1-x), so this works for n <= 1 (and arrays).
 def spence(n):
-    if not _cache.has_key(n):
-        _cache[n] = integrate.quad(lambda t: log(abs(1-t))/t, 0, n) [0]
-    return _cache[n]
-
-
-def dSigma_dE(eNu, eE):
-    if eE < bounds_eE(eNu)[0] or eE > bounds_eE(eNu)[1]:
-        return 0
-
-    # Appendix A: Radiative Corrections
-    L = sqrt(eE**2 - mE**2)
-    beta = L / eE
-    T = eE - mE # kinetic energy of recoil electron
-    z = T / eNu
-    x = sqrt(1 + 2*mE/T)
-    I = 1./6 * (1./3 + (3 - x**2) * (x/2. * log((x+1)/(x-1)) - 1))
-
-    if _flavor in ("e", "eb"):
-        k = 0.9791 + 0.0097 * I
-    elif _flavor in ("x", "xb"):
-        k = 0.9970 - 0.00037 * I
-
-    g1 = rho_NC * (0.5 - k * sin2theta_w)
-    g2 = -rho_NC * k * sin2theta_w
-
-    if _flavor == "e":
-        gL = g1 - 1
-        gR = g2
-    elif _flavor == "eb":
-        gL = g2
-        gR = g1 - 1
-    elif _flavor == "x":
-        gL = g1
-        gR = g2
-    elif _flavor == "xb":
-        gL = g2
-        gR = g1
-
-    # Appendix B: QED Effects
-    f0 = eE/L * log((eE+L)/mE) - 1 # common factor of all three f_*
-    log_zmE = log(1-z-mE/(eE+L)) # Warning: imprecise at low E, throws ValueError in extreme cases
-
-    # fMinus(z)
-    f1 = f0 * (2 * log_zmE - log(1-z) - log(z)/2. - 5./12) \
-           + 0.5 * (spence(z) - spence(beta)) \
-           - 0.5 * log(1-z)**2 - (11./12 + z/2.) * log(1-z) \
-           + z * (log(z) + 0.5 * log(2*eNu / mE)) \
-           - (31./18 + 1./12 * log(z)) * beta \
-           - 11./12 * z + z**2 / 24.
-
-    # (1-z)**2 * fPlus(z)
-    f2 = f0 * ((1-z)**2 * (2*log_zmE - log(1-z) - log(z)/2. - 2./3) - (z**2 * log(z) + 1 - z)/2.) \
-           - (1-z)**2 / 2. * (log(1-z)**2 + beta * (spence(1-z) - log(z)*log(1-z))) \
-           + log(1-z) * (z**2 / 2. * log(z) + (1-z)/3. * (2*z - 0.5)) \
-           - z**2 / 2. * spence(1-z) - z * (1-2*z)/3 * log(z) - z * (1-z)/6 \
-           - beta/12. * (log(z) + (1-z) * (115 - 109 * z)/6.)
-
-    # fPlusMinus(z)
-    f3 = f0 * 2 * log_zmE
-
-    result = 2*mE*gF**2 / pi * (gL**2 * (1 + alpha/pi * f1)
-                              + gR**2 * ((1-z)**2 + alpha/pi * f2)
-                              - gR * gL * mE/eNu * z * (1 + alpha/pi * f3)
-                              )
-    if result < 0:
-        if eNu < 0.8:
-            # Approximations in f_* may be imprecise at very low energies.
-            # This is below threshold in HK anyway, so we suppress it.
-            result = 0
-        else:
-            raise ValueError("Calculated negative cross section for E_nu=%f, E_e=%f. Aborting..." % (eNu, eE))
-
-    return result
-
-
-# energy of electron scattered into direction cosT by a neutrino with energy eNu
-def get_eE(eNu, cosT):
-    return mE + (2 * mE * eNu**2 * cosT**2) / ((mE + eNu)**2 - eNu**2 * cosT**2)
-
-# distribution of scattering angles
-def dSigma_dCosT(eNu, cosT):
-    if cosT < 0: # backward scattering is kinematically impossible
-        return 0
-
-    dE_dCosT = 4 * mE * eNu**2 * (mE+eNu)**2 * cosT / ((mE+eNu)**2 - eNu**2 * cosT**2)**2
-    eE = get_eE(eNu, cosT)
-    return dE_dCosT * dSigma_dE(eNu, eE)
-
+    return -special.spence(1 - n)
 
 # Bounds for integration over eE
 eE_min = 0.77 # Cherenkov threshold in water (refraction index n=1.34)
-def bounds_eE(eNu, *args): # ignore additional arguments handed over by integrate.nquad()
-    eE_max = mE + 2*eNu**2 / (2*eNu + mE) # this is get_eE(eNu, cosT=1)
-    return [eE_min, eE_max]
-
 
 # Bounds for integration over eNu
 def eNu_min(eE):
     T = eE - mE
     return T/2. * (1 + sqrt(1 + 2*mE/T)) # inversion of eE_max(eNu)
 eNu_max = 100
-bounds_eNu = [eNu_min(eE_min), eNu_max]
 
-# minimum/maximum neutrino energy that can produce a given positron energy
-def _bounds_eNu(eE):
-    return [eNu_min(eE), eNu_max]
+
+# Unlike the other channels, the cross section depends on the neutrino flavor,
+# which is given when creating an instance, e.g. `Channel("eb")`.
+class Channel(BaseChannel):
+    targets_per_molecule = 10 # number of electrons per water molecule
+    pid = 11
+    possible_flavors = ["e", "eb", "x", "xb"]
+    bounds_eNu = [eNu_min(eE_min), eNu_max]
+
+    def dSigma_dE(self, eNu, eE):
+        if eE < self.bounds_eE(eNu)[0] or eE > self.bounds_eE(eNu)[1]:
+            return 0
+
+        # Appendix A: Radiative Corrections
+        L = sqrt(eE**2 - mE**2)
+        beta = L / eE
+        T = eE - mE # kinetic energy of recoil electron
+        z = T / eNu
+        x = sqrt(1 + 2*mE/T)
+        I = 1./6 * (1./3 + (3 - x**2) * (x/2. * log((x+1)/(x-1)) - 1))
+
+        (gL, gR) = self._couplings(I)
+
+        # Appendix B: QED Effects
+        f0 = eE/L * log((eE+L)/mE) - 1 # common factor of all three f_*
+        log_zmE = log(1-z-mE/(eE+L)) # Warning: imprecise at low E, throws ValueError in extreme cases
+
+        # fMinus(z)
+        f1 = f0 * (2 * log_zmE - log(1-z) - log(z)/2. - 5./12) \
+               + 0.5 * (spence(z) - spence(beta)) \
+               - 0.5 * log(1-z)**2 - (11./12 + z/2.) * log(1-z) \
+               + z * (log(z) + 0.5 * log(2*eNu / mE)) \
+               - (31./18 + 1./12 * log(z)) * beta \
+               - 11./12 * z + z**2 / 24.
+
+        # (1-z)**2 * fPlus(z)
+        f2 = f0 * ((1-z)**2 * (2*log_zmE - log(1-z) - log(z)/2. - 2./3) - (z**2 * log(z) + 1 - z)/2.) \
+               - (1-z)**2 / 2. * (log(1-z)**2 + beta * (spence(1-z) - log(z)*log(1-z))) \
+               + log(1-z) * (z**2 / 2. * log(z) + (1-z)/3. * (2*z - 0.5)) \
+               - z**2 / 2. * spence(1-z) - z * (1-2*z)/3 * log(z) - z * (1-z)/6 \
+               - beta/12. * (log(z) + (1-z) * (115 - 109 * z)/6.)
+
+        # fPlusMinus(z)
+        f3 = f0 * 2 * log_zmE
+
+        result = 2*mE*gF**2 / pi * (gL**2 * (1 + alpha/pi * f1)
+                                  + gR**2 * ((1-z)**2 + alpha/pi * f2)
+                                  - gR * gL * mE/eNu * z * (1 + alpha/pi * f3)
+                                  )
+        if result < 0:
+            if eNu < 0.8:
+                # Approximations in f_* may be imprecise at very low energies.
+                # This is below threshold in HK anyway, so we suppress it.
+                result = 0
+            else:
+                raise ValueError("Calculated negative cross section for E_nu=%f, E_e=%f. Aborting..." % (eNu, eE))
+
+        return result
+
+
+    def dSigma_dE_vec(self, eNu, eE):
+        """Vectorized version of dSigma_dE(eNu, eE).
+
+        eNu and eE can be scalars or arrays that numpy can broadcast against each
+        other. Returns an array of that shape, which is zero outside the kinematic
+        bounds.
+        """
+        eNu, eE = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(eE, dtype=float))
+        result = np.zeros(eNu.shape)
+
+        valid = (eE >= eE_min) & (eE <= mE + 2*eNu**2 / (2*eNu + mE))
+        eNu, eE = eNu[valid], eE[valid]
+
+        # Appendix A: Radiative Corrections
+        L = np.sqrt(eE**2 - mE**2)
+        beta = L / eE
+        T = eE - mE # kinetic energy of recoil electron
+        z = T / eNu
+        x = np.sqrt(1 + 2*mE/T)
+        I = 1./6 * (1./3 + (3 - x**2) * (x/2. * np.log((x+1)/(x-1)) - 1))
+
+        (gL, gR) = self._couplings(I)
+
+        # Appendix B: QED Effects
+        f0 = eE/L * np.log((eE+L)/mE) - 1 # common factor of all three f_*
+        # Where dSigma_dE throws a ValueError (i.e. at the kinematic endpoint,
+        # which is numerically unstable), we return 0 instead.
+        zmE = 1-z-mE/(eE+L)
+        log_zmE = np.log(np.where(zmE > 0, zmE, 1))
+        log_z = np.log(z)
+        log_1mz = np.log(1-z)
+
+        # fMinus(z)
+        f1 = f0 * (2 * log_zmE - log_1mz - log_z/2. - 5./12) \
+               + 0.5 * (spence(z) - spence(beta)) \
+               - 0.5 * log_1mz**2 - (11./12 + z/2.) * log_1mz \
+               + z * (log_z + 0.5 * np.log(2*eNu / mE)) \
+               - (31./18 + 1./12 * log_z) * beta \
+               - 11./12 * z + z**2 / 24.
+
+        # (1-z)**2 * fPlus(z)
+        spence_1mz = spence(1-z)
+        f2 = f0 * ((1-z)**2 * (2*log_zmE - log_1mz - log_z/2. - 2./3) - (z**2 * log_z + 1 - z)/2.) \
+               - (1-z)**2 / 2. * (log_1mz**2 + beta * (spence_1mz - log_z*log_1mz)) \
+               + log_1mz * (z**2 / 2. * log_z + (1-z)/3. * (2*z - 0.5)) \
+               - z**2 / 2. * spence_1mz - z * (1-2*z)/3 * log_z - z * (1-z)/6 \
+               - beta/12. * (log_z + (1-z) * (115 - 109 * z)/6.)
+
+        # fPlusMinus(z)
+        f3 = f0 * 2 * log_zmE
+
+        sigma = 2*mE*gF**2 / pi * (gL**2 * (1 + alpha/pi * f1)
+                                 + gR**2 * ((1-z)**2 + alpha/pi * f2)
+                                 - gR * gL * mE/eNu * z * (1 + alpha/pi * f3)
+                                 )
+        # see dSigma_dE above for how negative values are treated
+        negative = sigma < 0
+        if np.any(negative & (eNu >= 0.8)):
+            i = np.argmax(negative & (eNu >= 0.8))
+            raise ValueError("Calculated negative cross section for E_nu=%f, E_e=%f. Aborting..." % (eNu[i], eE[i]))
+        sigma[negative | (zmE <= 0)] = 0
+
+        result[valid] = sigma
+        return result
+
+
+    def _couplings(self, I):
+        """Effective couplings gL, gR for the flavor of this instance. I may be an array."""
+        if self.flavor in ("e", "eb"):
+            k = 0.9791 + 0.0097 * I
+        elif self.flavor in ("x", "xb"):
+            k = 0.9970 - 0.00037 * I
+
+        g1 = rho_NC * (0.5 - k * sin2theta_w)
+        g2 = -rho_NC * k * sin2theta_w
+
+        if self.flavor == "e":
+            gL = g1 - 1
+            gR = g2
+        elif self.flavor == "eb":
+            gL = g2
+            gR = g1 - 1
+        elif self.flavor == "x":
+            gL = g1
+            gR = g2
+        elif self.flavor == "xb":
+            gL = g2
+            gR = g1
+
+        return (gL, gR)
+
+
+    # energy of electron scattered into direction cosT by a neutrino with energy eNu
+    def get_eE(self, eNu, cosT, rng=None):
+        return mE + (2 * mE * eNu**2 * cosT**2) / ((mE + eNu)**2 - eNu**2 * cosT**2)
+
+    def get_eE_vec(self, eNu, cosT, np_rng=None):
+        """Vectorized version of get_eE(eNu, cosT)."""
+        return self.get_eE(np.asarray(eNu, dtype=float), np.asarray(cosT, dtype=float))
+
+    # distribution of scattering angles
+    def dSigma_dCosT(self, eNu, cosT):
+        if cosT < 0: # backward scattering is kinematically impossible
+            return 0
+
+        dE_dCosT = 4 * mE * eNu**2 * (mE+eNu)**2 * cosT / ((mE+eNu)**2 - eNu**2 * cosT**2)**2
+        eE = self.get_eE(eNu, cosT)
+        return dE_dCosT * self.dSigma_dE(eNu, eE)
+
+    def dSigma_dCosT_vec(self, eNu, cosT):
+        """Vectorized version of dSigma_dCosT(eNu, cosT)."""
+        eNu, cosT = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(cosT, dtype=float))
+        dE_dCosT = 4 * mE * eNu**2 * (mE+eNu)**2 * cosT / ((mE+eNu)**2 - eNu**2 * cosT**2)**2
+        eE = self.get_eE(eNu, cosT)
+        return np.where(cosT < 0, 0., dE_dCosT * self.dSigma_dE_vec(eNu, eE))
+
+
+    def bounds_eE(self, eNu, *args): # ignore additional arguments handed over by integrate.nquad()
+        eE_max = mE + 2*eNu**2 / (2*eNu + mE) # this is get_eE(eNu, cosT=1)
+        return [eE_min, eE_max]
+
+    # minimum/maximum neutrino energy that can produce a given positron energy
+    def _bounds_eNu(self, eE):
+        return [eNu_min(eE), eNu_max]
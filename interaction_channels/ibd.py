@@ -1,9 +1,7 @@
 from math import pi, sqrt, log
+import numpy as np
 
-
-targets_per_molecule = 2 # number of free protons per water molecule
-pid = -11
-possible_flavors = ["eb"]
+from interaction_channels import BaseChannel
 
 
 '''
@@ -23,9 +21,123 @@ alpha = 1 / 137.035989 # fine structure constant
 gF = 1.16639e-11 # Fermi coupling constant
 sigma0 = 2 * mP * gF**2 * 0.9746**2 / (8 * pi * mP**2) # from eqs. (3), (11)
 
-def dSigma_dE(eNu, eE): # eqs. (11), (3)
-    if eNu < eThr or eE < bounds_eE(eNu)[0] or eE > bounds_eE(eNu)[1]:
-        return 0
+delta_cm = (mN**2 - mP**2 - mE**2) / (2*mP)
+eThr = ((mN+mE)**2 - mP**2) / (2*mP) # threshold energy for IBD: ca. 1.8 MeV
+
+
+class Channel(BaseChannel):
+    targets_per_molecule = 2 # number of free protons per water molecule
+    pid = -11
+    possible_flavors = ["eb"]
+
+    # Bounds for integration over eNu
+    bounds_eNu = [eThr, 100]
+
+    def dSigma_dE(self, eNu, eE): # eqs. (11), (3)
+        if eNu < eThr or eE < self.bounds_eE(eNu)[0] or eE > self.bounds_eE(eNu)[1]:
+            return 0
+
+        abs_M_squared = _abs_M_squared(eNu, eE)
+        rad_correction = alpha/pi * (6.00352 + 3./2 * log(mP/(2*eE)) + 1.2 * (mE/eE)**1.5) # eq. (14)
+
+        result = sigma0 / eNu**2 * abs_M_squared * (1 + rad_correction)
+
+        if result < 0:
+            raise ValueError("Calculated negative cross section for E_nu=%f, E_e=%f. Aborting..." % (eNu, eE))
+
+        return result
+
+
+    def dSigma_dE_vec(self, eNu, eE):
+        """Vectorized version of dSigma_dE(eNu, eE).
+
+        eNu and eE can be scalars or arrays that numpy can broadcast against each
+        other. Returns an array of that shape, which is zero outside the kinematic
+        bounds.
+        """
+        eNu, eE = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(eE, dtype=float))
+        result = np.zeros(eNu.shape)
+
+        above_thr = eNu >= eThr
+        eE_min, eE_max = np.zeros(eNu.shape), np.zeros(eNu.shape)
+        eE_min[above_thr], eE_max[above_thr] = self.bounds_eE_vec(eNu[above_thr])
+        valid = above_thr & (eE >= eE_min) & (eE <= eE_max)
+        eNu, eE = eNu[valid], eE[valid]
+
+        rad_correction = alpha/pi * (6.00352 + 3./2 * np.log(mP/(2*eE)) + 1.2 * (mE/eE)**1.5) # eq. (14)
+        sigma = sigma0 / eNu**2 * _abs_M_squared(eNu, eE) * (1 + rad_correction)
+
+        if np.any(sigma < 0):
+            i = np.argmin(sigma)
+            raise ValueError("Calculated negative cross section for E_nu=%f, E_e=%f. Aborting..." % (eNu[i], eE[i]))
+
+        result[valid] = sigma
+        return result
+
+
+    # probability distribution for the angle at which the positron is emitted
+    def dSigma_dCosT(self, eNu, cosT): # eq. (20)
+        epsilon = eNu / mP
+        eE = self.get_eE(eNu, cosT)
+        pE = sqrt(eE**2 - mE**2)
+        dE_dCosT = pE * epsilon / (1 + epsilon * (1 - cosT * eE / pE))
+        return dE_dCosT * self.dSigma_dE(eNu, eE)
+
+    def dSigma_dCosT_vec(self, eNu, cosT):
+        """Vectorized version of dSigma_dCosT(eNu, cosT)."""
+        eNu, cosT = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(cosT, dtype=float))
+        with np.errstate(invalid='ignore'): # get_eE is undefined below threshold
+            epsilon = eNu / mP
+            eE = self.get_eE_vec(eNu, cosT)
+            pE = np.sqrt(eE**2 - mE**2)
+            dE_dCosT = pE * epsilon / (1 + epsilon * (1 - cosT * eE / pE))
+            sigma = self.dSigma_dE_vec(eNu, eE)
+        return np.where(sigma > 0, dE_dCosT * sigma, 0.)
+
+
+    def get_eE(self, eNu, cosT, rng=None): # eq. (21)
+        epsilon = eNu / mP
+        kappa = (1 + epsilon)**2 - (epsilon * cosT)**2
+        return ((eNu - delta_cm) * (1 + epsilon) + epsilon * cosT * sqrt((eNu - delta_cm)**2 - mE**2 * kappa)) / kappa
+
+    def get_eE_vec(self, eNu, cosT, np_rng=None):
+        """Vectorized version of get_eE(eNu, cosT)."""
+        epsilon = eNu / mP
+        kappa = (1 + epsilon)**2 - (epsilon * cosT)**2
+        return ((eNu - delta_cm) * (1 + epsilon) + epsilon * cosT * np.sqrt((eNu - delta_cm)**2 - mE**2 * kappa)) / kappa
+
+
+    # Bounds for integration over eE
+    def bounds_eE(self, eNu, *args): # ignore additional arguments handed over by scipy.integrate.nquad()
+        s = 2*mP*eNu + mP**2
+        pE_cm = sqrt((s-(mN-mE)**2) * (s-(mN+mE)**2)) / (2*sqrt(s))
+        eE_cm = (s-mN**2+mE**2) / (2*sqrt(s))
+
+        eE_min = eNu - delta_cm - eNu/sqrt(s) * (eE_cm + pE_cm)
+        eE_max = eNu - delta_cm - eNu/sqrt(s) * (eE_cm - pE_cm)
+        return [eE_min, eE_max]
+
+    def bounds_eE_vec(self, eNu):
+        """Vectorized version of bounds_eE(eNu). Requires eNu >= eThr."""
+        s = 2*mP*eNu + mP**2
+        pE_cm = np.sqrt((s-(mN-mE)**2) * (s-(mN+mE)**2)) / (2*np.sqrt(s))
+        eE_cm = (s-mN**2+mE**2) / (2*np.sqrt(s))
+
+        eE_min = eNu - delta_cm - eNu/np.sqrt(s) * (eE_cm + pE_cm)
+        eE_max = eNu - delta_cm - eNu/np.sqrt(s) * (eE_cm - pE_cm)
+        return [eE_min, eE_max]
+
+
+    # minimum/maximum neutrino energy that can produce a given positron energy, eq. (19)
+    # Note: This is only an approximation to simplify numerical integration; the precise range has to be enforced separately.
+    def _bounds_eNu(self, eE):
+        eNu_min = eE + delta_cm
+        eNu_max = eNu_min / (1 - 2 * eNu_min/mP)
+        return (eNu_min, eNu_max)
+
+
+def _abs_M_squared(eNu, eE):
+    """Matrix element |M|^2 from eq. (5). Works for scalars and numpy arrays."""
     # above eq. (11)
     s_minus_u = 2*mP*(eNu+eE) - mE**2
     t = mN**2 - mP**2 - 2*mP*(eNu-eE)
@@ -60,51 +172,4 @@ def dSigma_dE(eNu, eE): # eqs. (11), (3)
 
     C = 1./16 * (4*(f1**2 + g1**2) - t * f2**2 / mAvg**2)
 
-    abs_M_squared = A - B * s_minus_u + C * s_minus_u**2 # eq. (5)
-    rad_correction = alpha/pi * (6.00352 + 3./2 * log(mP/(2*eE)) + 1.2 * (mE/eE)**1.5) # eq. (14)
-
-    result = sigma0 / eNu**2 * abs_M_squared * (1 + rad_correction)
-
-    if result < 0:
-        raise ValueError("Calculated negative cross section for E_nu=%f, E_e=%f. Aborting..." % (eNu, eE))
-
-    return result
-
-
-# probability distribution for the angle at which the positron is emitted
-def dSigma_dCosT(eNu, cosT): # eq. (20)
-    epsilon = eNu / mP
-    eE = get_eE(eNu, cosT)
-    pE = sqrt(eE**2 - mE**2)
-    dE_dCosT = pE * epsilon / (1 + epsilon * (1 - cosT * eE / pE))
-    return dE_dCosT * dSigma_dE(eNu, eE)
-
-
-def get_eE(eNu, cosT): # eq. (21)
-    epsilon = eNu / mP
-    kappa = (1 + epsilon)**2 - (epsilon * cosT)**2
-    return ((eNu - delta_cm) * (1 + epsilon) + epsilon * cosT * sqrt((eNu - delta_cm)**2 - mE**2 * kappa)) / kappa
-
-
-# Bounds for integration over eE
-delta_cm = (mN**2 - mP**2 - mE**2) / (2*mP)
-def bounds_eE(eNu, *args): # ignore additional arguments handed over by scipy.integrate.nquad()
-    s = 2*mP*eNu + mP**2
-    pE_cm = sqrt((s-(mN-mE)**2) * (s-(mN+mE)**2)) / (2*sqrt(s))
-    eE_cm = (s-mN**2+mE**2) / (2*sqrt(s))
-
-    eE_min = eNu - delta_cm - eNu/sqrt(s) * (eE_cm + pE_cm)
-    eE_max = eNu - delta_cm - eNu/sqrt(s) * (eE_cm - pE_cm)
-    return [eE_min, eE_max]
-
-# Bounds for integration over eNu
-eThr = ((mN+mE)**2 - mP**2) / (2*mP) # threshold energy for IBD: ca. 1.8 MeV
-bounds_eNu = [eThr, 100]
-
-
-# minimum/maximum neutrino energy that can produce a given positron energy, eq. (19)
-# Note: This is only an approximation to simplify numerical integration; the precise range has to be enforced separately.
-def _bounds_eNu(eE):
-    eNu_min = eE + delta_cm
-    eNu_max = eNu_min / (1 - 2 * eNu_min/mP)
-    return (eNu_min, eNu_max)
+    return A - B * s_minus_u + C * s_minus_u**2 # eq. (5)
@@ -14,8 +14,11 @@ Instead, below we implement an approximation to DiracDelta: a function that's
 '''
 
 from math import log10
+import numpy as np
 import random
 
+from interaction_channels import BaseChannel
+
 epsilon = 0.001 # for approximating DiracDelta distribution below
 
 # Excitation energy and parameters a, b and c (Table 4 of arXiv:1809.08398)
@@ -25,102 +28,203 @@ fit_parameters = {1: [11.23, -40.656, 4.528, 0.887],
                   4: [25.38, -39.862, 3.636, 0.846]}
 
 
-'''
-targets_per_molecule:
-number of interaction targets per water molecule
-(i.e. 2 free protons, 1 oxygen nucleus or 10 electrons)
-'''
-targets_per_molecule = 1
-
-
-'''
-pid:
-ID of the outgoing (detected) particle, using Particle Data Group conventions
-(e.g. electron = 11, positron = -11)
-'''
-pid = -11
-
-
-'''
-possible_flavors:
-which neutrino flavors ("e", "eb", "x", "xb") interact in this channel
-'''
-possible_flavors = ["eb"]
-
-
-'''
-bounds_eNu
-List with minimum & maximum energy of incoming neutrino. The minimum energy is
-typically given by the threshold energy for the interaction, while the maximum
-energy is given by the supernova neutrino flux.
-'''
-bounds_eNu = [fit_parameters[1][0] + 0.8, 100] # 0.8 MeV = Cherenkov threshold of electron
-
-
-'''
-bounds_eE(eNu, *args):
-Kinematical bounds for integration over eE.
-Input:
-    eNu:  neutrino energy (MeV)
-    args: [ignore this]
-Output:
-    list with minimum & maximum allowed energy of outgoing (detected) particle
-'''
-def bounds_eE(eNu, *args):
-    # smallest eE is at largest (allowed) excitation energy
-    for g in range(1,5):
-        if eNu > fit_parameters[g][0] + epsilon:
-            eMin = eNu - fit_parameters[g][0] - epsilon
-
-    # largest eE is at smallest excitation energy
-    eMax = eNu - fit_parameters[1][0] + epsilon
-
-    return [eMin, eMax]
-
-
-'''
-get_eE(eNu, cosT):
-Energy of outgoing (detected particle).
-Input:
-    eNu:  neutrino energy (MeV)
-    cosT: cosine of the angle between neutrino and outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def get_eE(eNu, cosT=0):
-    # find allowed excitation energies
-    allowed = []
-    for g in range(1,5):
-        if eNu > fit_parameters[g][0] + epsilon:
-            eE = eNu - fit_parameters[g][0]
-            sigma = partial_dSigma_dE(eNu, eE, g)
-            allowed.append([eE, sigma])
-
-    # choose from allowed eE with probability proportional to partial cross-section
-    sigma_max = max([sigma for _, sigma in allowed])
-    while True:
-        eE, sigma = random.choice(allowed)
-        if sigma > sigma_max * random.random():
-            break
-    return eE
-
-
-'''
-dSigma_dE(eNu, eE):
-Differential cross section.
-Input:
-    eNu: neutrino energy
-    eE:  energy of outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def dSigma_dE(eNu, eE): # sum of partial cross-sections, see arXiv:1809.08398
-    sigma = 0
-    for g in range(1,5):
-        sigma += partial_dSigma_dE(eNu, eE, g)
-
-    sigma *= (5.067731E10)**2 # convert cm^2 to MeV^-2, see http://www.wolframalpha.com/input/?i=cm%2F(hbar+*+c)+in+MeV%5E(-1)
-    return sigma / (2*epsilon) # Ensure that integration over eE yields sigma
+class Channel(BaseChannel):
+    '''
+    targets_per_molecule:
+    number of interaction targets per water molecule
+    (i.e. 2 free protons, 1 oxygen nucleus or 10 electrons)
+    '''
+    targets_per_molecule = 1
+
+
+    '''
+    pid:
+    ID of the outgoing (detected) particle, using Particle Data Group conventions
+    (e.g. electron = 11, positron = -11)
+    '''
+    pid = -11
+
+
+    '''
+    possible_flavors:
+    which neutrino flavors ("e", "eb", "x", "xb") interact in this channel
+    '''
+    possible_flavors = ["eb"]
+
+
+    '''
+    bounds_eNu
+    List with minimum & maximum energy of incoming neutrino. The minimum energy is
+    typically given by the threshold energy for the interaction, while the maximum
+    energy is given by the supernova neutrino flux.
+    '''
+    bounds_eNu = [fit_parameters[1][0] + 0.8, 100] # 0.8 MeV = Cherenkov threshold of electron
+
+
+    '''
+    bounds_eE(eNu, *args):
+    Kinematical bounds for integration over eE.
+    Input:
+        eNu:  neutrino energy (MeV)
+        args: [ignore this]
+    Output:
+        list with minimum & maximum allowed energy of outgoing (detected) particle
+    '''
+    def bounds_eE(self, eNu, *args):
+        # smallest eE is at largest (allowed) excitation energy
+        for g in range(1,5):
+            if eNu > fit_parameters[g][0] + epsilon:
+                eMin = eNu - fit_parameters[g][0] - epsilon
+
+        # largest eE is at smallest excitation energy
+        eMax = eNu - fit_parameters[1][0] + epsilon
+
+        return [eMin, eMax]
+
+
+    '''
+    get_eE(eNu, cosT, rng):
+    Energy of outgoing (detected particle).
+    Input:
+        eNu:  neutrino energy (MeV)
+        cosT: cosine of the angle between neutrino and outgoing (detected) particle
+        rng:  random number generator (e.g. a random.Random instance) for choosing
+              the excitation energy of the final state
+    Output:
+        one floating point number
+    '''
+    def get_eE(self, eNu, cosT=0, rng=random):
+        # find allowed excitation energies
+        allowed = []
+        for g in range(1,5):
+            if eNu > fit_parameters[g][0] + epsilon:
+                eE = eNu - fit_parameters[g][0]
+                sigma = partial_dSigma_dE(eNu, eE, g)
+                allowed.append([eE, sigma])
+
+        # choose from allowed eE with probability proportional to partial cross-section
+        sigma_max = max([sigma for _, sigma in allowed])
+        while True:
+            eE, sigma = rng.choice(allowed)
+            if sigma > sigma_max * rng.random():
+                break
+        return eE
+
+
+    '''
+    get_eE_vec(eNu, cosT, np_rng):
+    Vectorized version of get_eE.
+    Input:
+        eNu:    neutrino energies (array)
+        cosT:   cosines of the scattering angle (array, broadcastable with eNu)
+        np_rng: numpy random number generator (e.g. a numpy.random.RandomState
+                instance) for choosing the excitation energy of the final state
+    Output:
+        array of floating point numbers
+    '''
+    def get_eE_vec(self, eNu, cosT=0, np_rng=np.random):
+        eNu = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(cosT, dtype=float))[0]
+
+        # partial cross-sections for all excitation energies (zero if not allowed)
+        sigma = np.zeros(eNu.shape + (4,))
+        for g in range(1,5):
+            eG, a, b, c = fit_parameters[g]
+            allowed = eNu > eG + epsilon
+            d = np.log10(eNu[allowed]**0.25 - eG**0.25)
+            sigma[allowed, g-1] = 10**(a + b * d + c * d**2)
+
+        # choose from allowed eE with probability proportional to partial cross-section
+        cumulative = np.cumsum(sigma, axis=-1)
+        u = np_rng.random_sample(eNu.shape) * cumulative[..., -1]
+        g = np.minimum(np.sum(cumulative <= u[..., None], axis=-1), 3)
+        eG = np.array([fit_parameters[_g][0] for _g in range(1,5)])
+        return eNu - eG[g]
+
+
+    '''
+    dSigma_dE(eNu, eE):
+    Differential cross section.
+    Input:
+        eNu: neutrino energy
+        eE:  energy of outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def dSigma_dE(self, eNu, eE): # sum of partial cross-sections, see arXiv:1809.08398
+        sigma = 0
+        for g in range(1,5):
+            sigma += partial_dSigma_dE(eNu, eE, g)
+
+        sigma *= (5.067731E10)**2 # convert cm^2 to MeV^-2, see http://www.wolframalpha.com/input/?i=cm%2F(hbar+*+c)+in+MeV%5E(-1)
+        return sigma / (2*epsilon) # Ensure that integration over eE yields sigma
+
+
+    '''
+    dSigma_dE_vec(eNu, eE):
+    Vectorized version of dSigma_dE.
+    Input:
+        eNu: neutrino energies (array)
+        eE:  energies of outgoing (detected) particle (array, broadcastable with eNu)
+    Output:
+        array of floating point numbers
+    '''
+    def dSigma_dE_vec(self, eNu, eE):
+        eNu, eE = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(eE, dtype=float))
+        sigma = np.zeros(eNu.shape)
+        for g in range(1,5):
+            eG, a, b, c = fit_parameters[g]
+            inside = abs(eNu - eE - eG) <= epsilon
+            d = np.log10(eNu[inside]**0.25 - eG**0.25)
+            sigma[inside] += 10**(a + b * d + c * d**2)
+
+        sigma *= (5.067731E10)**2 # convert cm^2 to MeV^-2
+        return sigma / (2*epsilon)
+
+
+    '''
+    dSigma_dCosT(eNu, cosT):
+    Distribution of the angle at which the outgoing (detected) particle is emitted.
+    Input:
+        eNu:  neutrino energy (MeV)
+        cosT: cosine of the angle between neutrino and outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def dSigma_dCosT(self, eNu, cosT):
+        # Plots in PRD 36,2283 show this behaves roughly similar to the analogous
+        # nu_e reaction, so we use the same approximation. (hep-ph/0307050, eq. B7)
+        x = ((eNu-11.23) / 25)**4
+        return 1 - cosT * (1+x)/(3+x)
+
+
+    '''
+    dSigma_dCosT_vec(eNu, cosT):
+    Vectorized version of dSigma_dCosT.
+    Input:
+        eNu:  neutrino energies (array)
+        cosT: cosines of the scattering angle (array, broadcastable with eNu)
+    Output:
+        array of floating point numbers
+    '''
+    def dSigma_dCosT_vec(self, eNu, cosT):
+        eNu, cosT = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(cosT, dtype=float))
+        return self.dSigma_dCosT(eNu, cosT)
+
+
+    # minimum/maximum neutrino energy that can produce a given positron energy
+    def _bounds_eNu(self, eE):
+        return (eE + fit_parameters[1][0] - epsilon, eE + fit_parameters[4][0] + epsilon)
+
+    # set options for numerical integration with scipy.nquad
+    def _opts(self, eNu, *args):
+        # values of eE where dSigma_dE(eNu, eE) has a discontinuity, to increase accuracy
+        p = []
+        for g in range(1,5):
+            if eNu > fit_parameters[g][0] + epsilon:
+                p.append(eNu - fit_parameters[g][0] - epsilon)
+                p.append(eNu - fit_parameters[g][0] + epsilon)
+
+        return {'points': p}
 
 
 def partial_dSigma_dE(eNu, eE, g): # eq. (4) of arXiv:1809.08398
@@ -132,35 +236,3 @@ def partial_dSigma_dE(eNu, eE, g): # eq. (4) of arXiv:1809.08398
     d = log10(eNu**0.25 - eG**0.25)
     log_sigma = a + b * d + c * d**2
     return 10**log_sigma
-
-
-'''
-dSigma_dCosT(eNu, cosT):
-Distribution of the angle at which the outgoing (detected) particle is emitted.
-Input:
-    eNu:  neutrino energy (MeV)
-    cosT: cosine of the angle between neutrino and outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def dSigma_dCosT(eNu, cosT):
-    # Plots in PRD 36,2283 show this behaves roughly similar to the analogous
-    # nu_e reaction, so we use the same approximation. (hep-ph/0307050, eq. B7)
-    x = ((eNu-11.23) / 25)**4
-    return 1 - cosT * (1+x)/(3+x)
-
-
-# minimum/maximum neutrino energy that can produce a given positron energy
-def _bounds_eNu(eE):
-    return (eE + fit_parameters[1][0] - epsilon, eE + fit_parameters[4][0] + epsilon)
-
-# set options for numerical integration with scipy.nquad
-def _opts(eNu, *args):
-    # values of eE where dSigma_dE(eNu, eE) has a discontinuity, to increase accuracy
-    p = []
-    for g in range(1,5):
-        if eNu > fit_parameters[g][0] + epsilon:
-            p.append(eNu - fit_parameters[g][0] - epsilon)
-            p.append(eNu - fit_parameters[g][0] + epsilon)
-
-    return {'points': p}
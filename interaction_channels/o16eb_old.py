@@ -13,114 +13,117 @@ Instead, below we implement an approximation to DiracDelta: a function that's
 2*epsilon wide and 1/(2*epsilon) high, so that the integral is 1.
 '''
 
+from interaction_channels import BaseChannel
+
 e_thr = 11.4 # energy threshold for this reaction
 epsilon = 0.001 # for approximating DiracDelta distribution below
 
 
-'''
-targets_per_molecule:
-number of interaction targets per water molecule
-(i.e. 2 free protons, 1 oxygen nucleus or 10 electrons)
-'''
-targets_per_molecule = 1
-
-
-'''
-pid:
-ID of the outgoing (detected) particle, using Particle Data Group conventions
-(e.g. electron = 11, positron = -11)
-'''
-pid = -11
-
-
-'''
-possible_flavors:
-which neutrino flavors ("e", "eb", "x", "xb") interact in this channel
-'''
-possible_flavors = ["eb"]
-
-
-'''
-bounds_eNu
-List with minimum & maximum energy of incoming neutrino. The minimum energy is
-typically given by the threshold energy for the interaction, while the maximum
-energy is given by the supernova neutrino flux.
-'''
-bounds_eNu = [e_thr + 0.8, 100] # 0.8 MeV = Cherenkov threshold of electron
-
-
-'''
-bounds_eE(eNu, *args):
-Kinematical bounds for integration over eE.
-Input:
-    eNu:  neutrino energy (MeV)
-    args: [ignore this]
-Output:
-    list with minimum & maximum allowed energy of outgoing (detected) particle
-'''
-def bounds_eE(eNu, *args):
-    return [get_eE(eNu) - epsilon, get_eE(eNu) + epsilon]
-
-
-'''
-get_eE(eNu, cosT):
-Energy of outgoing (detected particle).
-Input:
-    eNu:  neutrino energy (MeV)
-    cosT: cosine of the angle between neutrino and outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def get_eE(eNu, cosT=0):
-    return eNu - e_thr
-
-
-'''
-dSigma_dE(eNu, eE):
-Differential cross section.
-Input:
-    eNu: neutrino energy
-    eE:  energy of outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def dSigma_dE(eNu, eE):
-    if abs(get_eE(eNu) - eE) > epsilon:
-        # This should never be called since we set bounds_eE() accordingly above
-        # ... but just in case:
-        return 0
-
-    # parameters from my own fit to data in PRD 66,013007 (Table 1)
-    if eNu < 54:
-        sigma0 = 9.35E-44
-        a = 0.497
-        b = 4.753
-    else:
-        sigma0 = 7.91E-41
-        a = 0.2616
-        b = 5.18
-    # see http://www.wolframalpha.com/input/?i=cm%2F(hbar+*+c)+in+MeV%5E(-1)
-    cm2mev = 5.067731E10
-    sigma = sigma0 * (eNu**a - e_thr**a)**b * cm2mev**2
-    return sigma / (2*epsilon) # Ensure that integration over eE yields sigma
-
-
-'''
-dSigma_dCosT(eNu, cosT):
-Distribution of the angle at which the outgoing (detected) particle is emitted.
-Input:
-    eNu:  neutrino energy (MeV)
-    cosT: cosine of the angle between neutrino and outgoing (detected) particle
-Output:
-    one floating point number
-'''
-def dSigma_dCosT(eNu, cosT):
-    # Plots in PRD 36,2283 show this behaves roughly similar to the analogous
-    # nu_e reaction, so we use the same approximation. (hep-ph/0307050, eq. B7)
-    x = (get_eE(eNu, cosT) / 25)**4
-    return 1 - cosT * (1+x)/(3+x)
-
-
-# minimum/maximum neutrino energy that can produce a given positron energy
-def _bounds_eNu(eE):
-    return (eE + e_thr - epsilon, eE + e_thr + epsilon)
+class Channel(BaseChannel):
+    '''
+    targets_per_molecule:
+    number of interaction targets per water molecule
+    (i.e. 2 free protons, 1 oxygen nucleus or 10 electrons)
+    '''
+    targets_per_molecule = 1
+
+
+    '''
+    pid:
+    ID of the outgoing (detected) particle, using Particle Data Group conventions
+    (e.g. electron = 11, positron = -11)
+    '''
+    pid = -11
+
+
+    '''
+    possible_flavors:
+    which neutrino flavors ("e", "eb", "x", "xb") interact in this channel
+    '''
+    possible_flavors = ["eb"]
+
+
+    '''
+    bounds_eNu
+    List with minimum & maximum energy of incoming neutrino. The minimum energy is
+    typically given by the threshold energy for the interaction, while the maximum
+    energy is given by the supernova neutrino flux.
+    '''
+    bounds_eNu = [e_thr + 0.8, 100] # 0.8 MeV = Cherenkov threshold of electron
+
+
+    '''
+    bounds_eE(eNu, *args):
+    Kinematical bounds for integration over eE.
+    Input:
+        eNu:  neutrino energy (MeV)
+        args: [ignore this]
+    Output:
+        list with minimum & maximum allowed energy of outgoing (detected) particle
+    '''
+    def bounds_eE(self, eNu, *args):
+        return [self.get_eE(eNu) - epsilon, self.get_eE(eNu) + epsilon]
+
+
+    '''
+    get_eE(eNu, cosT, rng):
+    Energy of outgoing (detected particle).
+    Input:
+        eNu:  neutrino energy (MeV)
+        cosT: cosine of the angle between neutrino and outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def get_eE(self, eNu, cosT=0, rng=None):
+        return eNu - e_thr
+
+
+    '''
+    dSigma_dE(eNu, eE):
+    Differential cross section.
+    Input:
+        eNu: neutrino energy
+        eE:  energy of outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def dSigma_dE(self, eNu, eE):
+        if abs(self.get_eE(eNu) - eE) > epsilon:
+            # This should never be called since we set bounds_eE() accordingly above
+            # ... but just in case:
+            return 0
+
+        # parameters from my own fit to data in PRD 66,013007 (Table 1)
+        if eNu < 54:
+            sigma0 = 9.35E-44
+            a = 0.497
+            b = 4.753
+        else:
+            sigma0 = 7.91E-41
+            a = 0.2616
+            b = 5.18
+        # see http://www.wolframalpha.com/input/?i=cm%2F(hbar+*+c)+in+MeV%5E(-1)
+        cm2mev = 5.067731E10
+        sigma = sigma0 * (eNu**a - e_thr**a)**b * cm2mev**2
+        return sigma / (2*epsilon) # Ensure that integration over eE yields sigma
+
+
+    '''
+    dSigma_dCosT(eNu, cosT):
+    Distribution of the angle at which the outgoing (detected) particle is emitted.
+    Input:
+        eNu:  neutrino energy (MeV)
+        cosT: cosine of the angle between neutrino and outgoing (detected) particle
+    Output:
+        one floating point number
+    '''
+    def dSigma_dCosT(self, eNu, cosT):
+        # Plots in PRD 36,2283 show this behaves roughly similar to the analogous
+        # nu_e reaction, so we use the same approximation. (hep-ph/0307050, eq. B7)
+        x = (self.get_eE(eNu, cosT) / 25)**4
+        return 1 - cosT * (1+x)/(3+x)
+
+
+    # minimum/maximum neutrino energy that can produce a given positron energy
+    def _bounds_eNu(self, eE):
+        return (eE + e_thr - epsilon, eE + e_thr + epsilon)
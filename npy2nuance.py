@@ -0,0 +1,28 @@
+#!/usr/bin/python
+"""
+Convert events from the binary output format of `genevts.py` to NUANCE.
+
+Events saved in a '.npy' or '.npz' file (see `genevts.write_binary`) are
+written to a .kin file in the NUANCE format used by WCSim. See
+`python npy2nuance.py -h` for usage information.
+"""
+
+import argparse
+
+from genevts import read_binary, write_nuance
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file", help="Name of the '.npy' or '.npz' file written by genevts.py. Required.")
+
+    default = "outfile.kin"
+    parser.add_argument("-o", "--output", metavar="FILE", default=default,
+                        help="Name of the output file. Default: '%s'." % default)
+    args = parser.parse_args()
+
+    write_nuance(read_binary(args.input_file), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Wall & CPU time of the stages of event generation and counters for hot paths.
+
+Used for the `--profile` option of `genevts.py`. Each `Generator` (see
+`channel.py`) collects a `Profile` of its own work; these are combined into a
+report in `genevts.py`. Collecting a profile costs a few microseconds per stage
+or counter update, so it is always done, but only written out when requested.
+"""
+
+from contextlib import contextmanager
+import os
+import time
+
+
+def cpu_time():
+    """CPU time (user + system, in s) of this process and of all child processes that have finished."""
+    return sum(os.times()[:4])
+
+
+class Profile(object):
+    """Wall & CPU time spent in each stage and values of counters.
+
+    Profiles can be sent between processes (e.g. from a worker process that
+    generated a shard of events) and combined with add().
+    """
+    def __init__(self):
+        self.stages = {} # name -> [wall time, CPU time, number of calls]
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name, exclude=()):
+        """Measure the time spent in a `with` block as stage `name`.
+
+        Time spent in the stages listed in `exclude` while running the block
+        (e.g. in nested stages) is not counted.
+        """
+        excluded = [self.stages.get(other, [0, 0, 0])[:2] for other in exclude]
+        (wall, cpu) = (time.time(), cpu_time())
+        try:
+            yield
+        finally:
+            (wall, cpu) = (time.time() - wall, cpu_time() - cpu)
+            for (other, (other_wall, other_cpu)) in zip(exclude, excluded):
+                wall -= self.stages.get(other, [0, 0, 0])[0] - other_wall
+                cpu -= self.stages.get(other, [0, 0, 0])[1] - other_cpu
+            self._add_stage(name, wall, cpu, 1)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add(self, other):
+        """Add the stages & counters of another profile to this one."""
+        for (name, (wall, cpu, calls)) in other.stages.items():
+            self._add_stage(name, wall, cpu, calls)
+        for (name, n) in other.counters.items():
+            self.count(name, n)
+
+    def _add_stage(self, name, wall, cpu, calls):
+        if not self.stages.has_key(name):
+            self.stages[name] = [0, 0, 0]
+        for (i, value) in enumerate((wall, cpu, calls)):
+            self.stages[name][i] += value
+
+    def as_dict(self):
+        """Stages & counters as a dictionary (e.g. for saving as JSON).
+
+        Adds the acceptance rate of rejection sampling and the hit rate of the
+        flux cache, where the corresponding counters are available.
+        """
+        counters = dict(self.counters)
+        if counters.get('rejection_candidates'):
+            counters['rejection_acceptance_rate'] = float(counters.get('rejection_accepted', 0)) / counters['rejection_candidates']
+        lookups = counters.get('flux_cache_hits', 0) + counters.get('flux_cache_misses', 0)
+        if lookups:
+            counters['flux_cache_hit_rate'] = float(counters.get('flux_cache_hits', 0)) / lookups
+        stages = dict((name, {'wall_time': wall, 'cpu_time': cpu, 'calls': calls})
+                      for (name, (wall, cpu, calls)) in self.stages.items())
+        return {'stages': stages, 'counters': counters}
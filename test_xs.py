@@ -1,19 +1,28 @@
-from interaction_channels import ibd
+import channel as channel_module # `channel` is used for channel objects below
+from channel import adaptive_time_bins, Envelope, FluxStore, Generator
+from importlib import import_module
+from interaction_channels import es, ibd
+import numpy as np
+import random
 from scipy import integrate
+import shutil
+import tempfile
+from xs_tables import build
 
 mev2cm = 1 / 5.067731E10
+ibd_channel = ibd.Channel("eb")
 
 def sigma(eNu):
-    func = lambda _eE: ibd.dSigma_dE(eNu, _eE) * mev2cm**2
-    return integrate.quad(func, *ibd.bounds_eE(eNu))[0]
+    func = lambda _eE: ibd_channel.dSigma_dE(eNu, _eE) * mev2cm**2
+    return integrate.quad(func, *ibd_channel.bounds_eE(eNu))[0]
 
 def eE_avg(eNu):
-    func = lambda _eE: _eE * ibd.dSigma_dE(eNu, _eE) * mev2cm**2
-    numerator = integrate.quad(func, *ibd.bounds_eE(eNu))[0]
+    func = lambda _eE: _eE * ibd_channel.dSigma_dE(eNu, _eE) * mev2cm**2
+    numerator = integrate.quad(func, *ibd_channel.bounds_eE(eNu))[0]
     return numerator / sigma(eNu)
 
 def cosT_avg(eNu):
-    func = lambda _cosT: _cosT * ibd.dSigma_dCosT(eNu, _cosT) * mev2cm**2
+    func = lambda _cosT: _cosT * ibd_channel.dSigma_dCosT(eNu, _cosT) * mev2cm**2
     numerator = integrate.quad(func, -1, 1)[0]
     return numerator / sigma(eNu)
 
@@ -90,3 +99,197 @@ for eNu in sorted(sigma_th):
 if good_agreement:
     print "Integrated cross-section, mean eE & mean cosT are in excellent", \
           "agreement for eNu between 2 and 100 MeV."
+
+
+'''Vectorized cross sections must agree with the scalar versions.
+
+Evaluate dSigma_dE_vec and dSigma_dCosT_vec for each channel (and each flavor,
+for channels like `es` that depend on it) on a grid in one call each and compare
+with the scalar functions point by point.
+'''
+good_agreement = True
+for name in ['ibd', 'es', 'o16e', 'o16eb']:
+    Channel = import_module("interaction_channels." + name).Channel
+    for flv in Channel.possible_flavors:
+        channel = Channel(flv)
+        eNu = np.linspace(channel.bounds_eNu[0] + 0.1, channel.bounds_eNu[1], 25)
+        frac = np.linspace(-0.1, 1.1, 31) # include some points outside of kinematic bounds
+        eE = np.array([channel.bounds_eE(_eNu)[0] + frac * (channel.bounds_eE(_eNu)[1] - channel.bounds_eE(_eNu)[0]) for _eNu in eNu])
+        cosT = np.linspace(-0.99, 0.99, 31) # scalar version of es.py may fail at cosT = 1
+
+        grid_eE = channel.dSigma_dE_vec(eNu[:, None], eE)
+        grid_cosT = channel.dSigma_dCosT_vec(eNu[:, None], cosT[None, :])
+        scalar_eE = np.array([[channel.dSigma_dE(_eNu, _eE) for _eE in row] for (_eNu, row) in zip(eNu, eE)])
+        scalar_cosT = np.array([[channel.dSigma_dCosT(_eNu, _cosT) for _cosT in cosT] for _eNu in eNu])
+
+        if not (np.allclose(grid_eE, scalar_eE, rtol=1e-10, atol=0) and np.allclose(grid_cosT, scalar_cosT, rtol=1e-10, atol=0)):
+            print "%s (%s): vectorized cross section differs from scalar version" % (name, flv)
+            good_agreement = False
+
+if good_agreement:
+    print "Vectorized cross sections agree with scalar versions for all channels."
+
+
+'''Vectorized energies of outgoing particles must agree with the scalar versions.
+
+Where get_eE is random (in `o16e` and `o16eb`, it chooses an excitation energy
+of the final state), compare the mean of many values instead.
+'''
+good_agreement = True
+for name in ['ibd', 'es', 'o16e', 'o16eb']:
+    Channel = import_module("interaction_channels." + name).Channel
+    for flv in Channel.possible_flavors:
+        channel = Channel(flv)
+        eNu = np.repeat(np.linspace(channel.bounds_eNu[0] + 0.1, channel.bounds_eNu[1], 5), 20000)
+        cosT = np.tile(np.linspace(-0.99, 0.99, 20000), 5)
+        rng = random.Random(0)
+        scalar_eE = np.array([channel.get_eE(_eNu, _cosT, rng) for (_eNu, _cosT) in zip(eNu, cosT)])
+        vec_eE = channel.get_eE_vec(eNu, cosT, np.random.RandomState(0))
+
+        if name.startswith("o16"):
+            # standard error of the difference between both means is < 0.1 MeV
+            agree = np.allclose(scalar_eE.reshape(5, -1).mean(axis=1), vec_eE.reshape(5, -1).mean(axis=1), rtol=0, atol=0.5)
+        else:
+            agree = np.allclose(scalar_eE, vec_eE, rtol=1e-10, atol=0)
+        if not agree:
+            print "%s (%s): vectorized get_eE differs from scalar version" % (name, flv)
+            good_agreement = False
+
+if good_agreement:
+    print "Vectorized energies of outgoing particles agree with scalar versions for all channels."
+
+
+'''Directions sampled from the tabulated cosT distribution must have the right mean.
+
+For elastic scattering, the distribution has a narrow peak just below cosT = 1.
+Compare the mean of directions sampled by Generator.get_direction() with
+numerical integration over eE (where the distribution is smooth), using the
+kinematic relation between eE and cosT.
+'''
+good_agreement = True
+generator = Generator('es', 'e', 'sample-in.txt', 'garching', inflv='e')
+mE = es.mE
+for eNu in [10.4, 20.3, 50]:
+    cosT = lambda _eE: np.sqrt((_eE - mE) * (mE + eNu)**2 / (eNu**2 * (_eE + mE)))
+    (numerator, denominator) = [integrate.quad(lambda _eE: cosT(_eE)**k * generator.channel.dSigma_dE(eNu, _eE),
+                                               *generator.channel.bounds_eE(eNu))[0] for k in (1, 0)]
+    sampled = generator.get_direction(np.full(1000000, eNu), np_rng=np.random.RandomState(0))[2]
+    if abs(np.mean(sampled) - numerator / denominator) > 5 * np.std(sampled) / np.sqrt(len(sampled)):
+        print "es (eNu = %g MeV): mean cosT of sampled directions is %.5f instead of %.5f" \
+            % (eNu, np.mean(sampled), numerator / denominator)
+        good_agreement = False
+
+if good_agreement:
+    print "Directions sampled from the tabulated distribution have the right mean cosT."
+
+
+'''The dilogarithm used in es.py must agree with its definition as an integral.
+
+es.spence(n) is the integral of log(abs(1-t))/t from 0 to n. Compare it with
+numerical integration, both for scalars and arrays. (At the end points, where
+numerical integration fails, the integral is 0 and -pi**2/6, respectively.)
+'''
+n = np.linspace(0, 1, 101)
+spence_integral = np.array([0] + [integrate.quad(lambda t: np.log(abs(1-t))/t, 0, _n)[0] for _n in n[1:-1]] + [-np.pi**2/6])
+if np.allclose(es.spence(n), spence_integral, rtol=1e-10, atol=1e-14) \
+        and np.allclose([es.spence(_n) for _n in n], spence_integral, rtol=1e-10, atol=1e-14):
+    print "Dilogarithm in es.py agrees with numerical integration."
+else:
+    print "Dilogarithm in es.py differs from numerical integration by up to %.1e." % max(abs(es.spence(n) - spence_integral))
+
+
+'''Cross section tables (see xs_tables.py) must agree with the analytic functions.
+
+Build tables for IBD in a temporary directory and check their accuracy.
+'''
+table_dir = tempfile.mkdtemp()
+try:
+    errors = build(table_dir, 'ibd', 'eb')
+finally:
+    shutil.rmtree(table_dir)
+if max(errors) < 1e-3:
+    print "Cross section tables agree with analytic functions (relative error: %.1e)." % max(errors)
+else:
+    print "Cross section tables differ from analytic functions (relative errors: %.1e, %.1e)." % tuple(errors)
+
+
+'''Flux cubes (see flux_cube.py) must agree with the parsed input files.
+
+Convert `sample-in.txt` into a flux cube in a temporary directory and compare
+the spectra with those of the parser at all time steps in the input file.
+'''
+cube_dir = tempfile.mkdtemp()
+try:
+    deviations = []
+    for flv in ['e', 'eb', 'x']:
+        (cube, _, _, _) = FluxStore(cube_dir).get('sample-in.txt', 'garching', flv)
+        (model, _, _, times) = FluxStore().get('sample-in.txt', 'garching', flv)
+        (eNu, times) = (np.linspace(1, 100, 200), np.array(times)[:, None])
+        parsed = model.nu_emission_vec(eNu, times)
+        deviations.append(np.max(abs(cube.nu_emission_vec(eNu, times) - parsed) / parsed.max(axis=1)[:, None]))
+finally:
+    shutil.rmtree(cube_dir)
+if max(deviations) < 1e-3:
+    print "Flux cube agrees with parsed input (relative error: %.1e)." % max(deviations)
+else:
+    print "Flux cube differs from parsed input (relative error: %.1e)." % max(deviations)
+
+
+'''Rejection sampling (see `Envelope` in channel.py) must reproduce the distribution.
+
+Draw angles of electrons from elastic scattering, which are strongly peaked in
+the forward direction, and compare their mean with numerical integration. Since
+candidates are drawn from an adaptive envelope, most of them must be accepted.
+'''
+es_channel = es.Channel("e")
+dist = lambda _cosT: es_channel.dSigma_dCosT(20, _cosT)
+envelope = Envelope(dist, -1, 1)
+rng = random.Random(42)
+cosT = [envelope.sample(rng) for _ in range(20000)]
+expected = integrate.quad(lambda _cosT: _cosT * dist(_cosT), 0, 1, points=[0.99, 0.999])[0] \
+           / integrate.quad(dist, 0, 1, points=[0.99, 0.999])[0]
+if abs(np.mean(cosT) - expected) < 5 * np.std(cosT) / np.sqrt(len(cosT)) and envelope.acceptance_rate > 0.5:
+    print "Rejection sampling reproduces the distribution (acceptance rate: %.2f)." % envelope.acceptance_rate
+else:
+    print "Rejection sampling differs from distribution: mean %.5f instead of %.5f (acceptance rate: %.2f)." \
+        % (np.mean(cosT), expected, envelope.acceptance_rate)
+
+
+'''Adaptive time bins (see adaptive_time_bins() in channel.py) must fulfill the tolerance.
+
+Use a flux that decays quickly at first and slowly later. Bins must cover the
+whole time span, the flux must change by less than the tolerance within each
+bin and bins must get wider as the decay slows down.
+'''
+class DecayingFlux(object):
+    def nu_emission_vec(self, eNu, time):
+        return eNu**2 * np.exp(-eNu / 4.) * self.luminosity(time)
+    def luminosity(self, time):
+        return np.exp(-time / 1000.) * (1 + 9 * np.exp(-time / 20.))
+tolerance = 0.01
+edges = np.array(adaptive_time_bins(DecayingFlux(), np.arange(0., 5001.), 0, 5000, tolerance))
+(lum, widths) = (DecayingFlux().luminosity(edges), np.diff(edges))
+change = (lum[:-1] - lum[1:]) / lum[:-1]
+# bins can't be narrower than 1 ms, even where the flux changes faster
+if edges[0] == 0 and edges[-1] == 5000 and np.all((change <= tolerance) | (widths == 1)) and widths[0] < widths[-1]:
+    print "Adaptive time bins fulfill the tolerance (%d bins instead of 5000)." % (len(edges) - 1)
+else:
+    print "Adaptive time bins do not fulfill the tolerance."
+
+
+'''Generating events window by window (see Generator.iter_evts()) must give the same events.
+
+Events must be yielded in time order and be identical to those returned by
+gen_evts() with the same seed, independent of the window size. Use shards of 4
+time bins, so the 24 ms in `sample-in.txt` are split into several windows.
+'''
+(shard_size, channel_module.shard_size) = (channel_module.shard_size, 4)
+generator = Generator('ibd', 'eb', 'sample-in.txt', 'garching', inflv='eb')
+kwargs = {'scale': 1e33, 'starttime': 101, 'endtime': 125, 'seed': [42]}
+events = generator.gen_evts(**kwargs)
+windowed = [list(generator.iter_evts(window=window, **kwargs)) for window in (5, 10)]
+channel_module.shard_size = shard_size
+if all(w == events for w in windowed) and events == sorted(events):
+    print "Events generated window by window are identical to all events generated at once."
+else:
+    print "Events generated window by window differ from all events generated at once."
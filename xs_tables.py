@@ -0,0 +1,306 @@
+#!/usr/bin/python
+"""
+Tabulate the differential cross sections of interaction channels.
+
+dSigma_dE(eNu, eE) and dSigma_dCosT(eNu, cosT) only depend on the interaction
+channel (and, for `es`, on the neutrino flavor), so they can be computed once
+and saved to disk. For each channel and flavor, this writes two tables as
+'.npy' files, which `channel.py` memory-maps read-only (use the `--xs-tables`
+option of `genevts.py`), so that all processes on a machine share one copy.
+A third file ('.npz') contains the grids and the accuracy of each table.
+
+See `python xs_tables.py -h` for usage information.
+"""
+
+import argparse
+from bisect import bisect_right
+import hashlib
+from importlib import import_module
+from math import pi, sqrt
+import numpy as np
+import os
+import sys
+import time
+
+
+def table_name(name, flavor):
+    return "%s_%s" % (name, flavor)
+
+# tables must be rebuilt when the channel (or the layout of the tables) changes
+def source_hash(channel):
+    key = hashlib.sha1()
+    for filename in (sys.modules[type(channel).__module__].__file__, __file__):
+        with open(os.path.splitext(filename)[0] + ".py", 'rb') as f:
+            key.update(f.read())
+    return key.hexdigest()
+
+# Columns of the tables are spaced like Chebyshev nodes, i.e. finer close to
+# the kinematic bounds, where cross sections may change very quickly (e.g. due
+# to radiative corrections in `es`). These convert between x in [0, 1] and the
+# (fractional) column index, which is linear in x between grid points.
+def column_grid(n):
+    return (1 - np.cos(np.linspace(0, pi, n + 1))) / 2
+
+def column(x, n):
+    j = np.clip(np.floor(np.arccos(np.clip(1 - 2 * x, -1, 1)) / pi * n), 0, n - 1)
+    (x0, x1) = ((1 - np.cos(pi * j / n)) / 2, (1 - np.cos(pi * (j + 1) / n)) / 2)
+    return j + (x - x0) / (x1 - x0)
+
+
+def build(directory, name, flavor, n_eNu=1000, n_eE=1000, n_cosT=2000):
+    """Tabulate the cross sections of channel `name` for the given flavor.
+
+    dSigma_dE is tabulated as a function of eNu and of the relative position
+    x = (eE - eE_min) / (eE_max - eE_min) within the kinematic bounds, so that
+    the table does not waste space on kinematically forbidden values of eE.
+    The grid in eNu is regular in sqrt(eNu - eNu_min) and thus finer close to
+    the threshold, where cross sections typically change most quickly; see
+    column_grid() for the grid in x and cosT.
+    Returns the accuracy of the tables, see XSTable.check(). Their speed (see
+    XSTable.measure_speed()) is saved, too, but only for information.
+    """
+    channel = import_module("interaction_channels." + name).Channel(flavor)
+
+    grid_eNu = channel.bounds_eNu[0] + (channel.bounds_eNu[1] - channel.bounds_eNu[0]) * np.linspace(0, 1, n_eNu + 1)**2
+    grid_x = column_grid(n_eE)
+    grid_cosT = 2 * column_grid(n_cosT) - 1
+    (lo, hi) = np.array([channel.bounds_eE(_eNu) for _eNu in grid_eNu]).T
+    hi = np.maximum(lo, hi)
+
+    # Evaluate the cross sections slightly inside of the kinematic bounds, where
+    # rounding errors may make them (incorrectly) drop to zero.
+    inner_x = np.clip(grid_x, 1e-9, 1 - 1e-9)
+    inner_cosT = np.clip(grid_cosT, -1 + 1e-9, 1 - 1e-9)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dE = channel.dSigma_dE_vec(grid_eNu[:, None], lo[:, None] + inner_x * (hi - lo)[:, None])
+        dCosT = channel.dSigma_dCosT_vec(grid_eNu[:, None], inner_cosT[None, :])
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    table = table_name(name, flavor)
+    np.save(os.path.join(directory, table + "_dSigma_dE.npy"), np.nan_to_num(dE))
+    np.save(os.path.join(directory, table + "_dSigma_dCosT.npy"), np.nan_to_num(dCosT))
+    meta = {'eNu': grid_eNu, 'lo': lo, 'hi': hi, 'x': grid_x, 'cosT': grid_cosT, 'source_hash': source_hash(channel)}
+    np.savez(os.path.join(directory, table + ".npz"), errors=[np.nan, np.nan], speedups=[np.nan] * 4, **meta)
+
+    # Finally, check the accuracy & speed of the tables and save them, too.
+    xs = XSTable(directory, name, flavor, tolerance=None)
+    errors = xs.check()
+    np.savez(os.path.join(directory, table + ".npz"), errors=errors, speedups=xs.measure_speed(), **meta)
+    return errors
+
+
+class XSTable(object):
+    """Interpolate the tabulated cross sections of one channel and flavor.
+
+    Provides dSigma_dE, dSigma_dCosT and their vectorized versions with the
+    same interface as the channels in `interaction_channels/`. Tables whose
+    accuracy (see check()) is worse than `tolerance` are not used; the analytic
+    functions of the channel are used instead. This only depends on the tables,
+    so generated events are reproducible.
+    """
+    def __init__(self, directory, name, flavor, tolerance=1e-2):
+        table = table_name(name, flavor)
+        self.name = "%s (table: %s)" % (name, os.path.join(os.path.abspath(directory), table))
+        self.channel = import_module("interaction_channels." + name).Channel(flavor)
+
+        if not os.path.isfile(os.path.join(directory, table + ".npz")):
+            print("Error: Cross section table '%s' not found in '%s'; create it with `python xs_tables.py %s`. Aborting ..." % (table, directory, directory))
+            exit()
+        with np.load(os.path.join(directory, table + ".npz")) as meta:
+            if str(meta['source_hash']) != source_hash(self.channel):
+                print("Error: Cross section table '%s' in '%s' is outdated; rebuild it with `python xs_tables.py %s`. Aborting ..." % (table, directory, directory))
+                exit()
+            (self.eNu, self.lo, self.hi, self.x, self.cosT) = (meta[k] for k in ('eNu', 'lo', 'hi', 'x', 'cosT'))
+            self.errors = list(meta['errors'])
+            self.speedups = list(meta['speedups'])
+        self.files = [os.path.join(directory, table + suffix) for suffix in (".npz", "_dSigma_dE.npy", "_dSigma_dCosT.npy")]
+        self.dE = np.load(self.files[1], mmap_mode='r')
+        self.dCosT = np.load(self.files[2], mmap_mode='r')
+        self._content_hash = None
+        # grids as lists, for looking up single values without numpy overhead
+        (self._eNu, self._lo, self._hi) = (self.eNu.tolist(), self.lo.tolist(), self.hi.tolist())
+        (self._x, self._cosT) = (self.x.tolist(), ((self.cosT + 1) / 2).tolist())
+
+        if tolerance is not None:
+            for (k, func) in enumerate(("dSigma_dE", "dSigma_dCosT")):
+                if not self.errors[k] <= tolerance:
+                    print "Cross section table %s: %s is not accurate enough (%.1e), using analytic function" \
+                        % (table, func, self.errors[k])
+                    for name in (func, func + "_vec"):
+                        setattr(self, name, getattr(self.channel, name))
+
+    def content_hash(self):
+        """Hash of the tables and of the functions that use them (e.g. for caching event rates)."""
+        if self._content_hash is None:
+            key = hashlib.sha1()
+            for filename in self.files:
+                with open(filename, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        key.update(block)
+            funcs = ("dSigma_dE", "dSigma_dE_vec", "dSigma_dCosT", "dSigma_dCosT_vec")
+            key.update(repr([func for func in funcs if getattr(self, func) != getattr(self.channel, func)]))
+            self._content_hash = key.hexdigest()
+        return self._content_hash
+
+    # Scalar versions are called many times (e.g. by scipy.integrate.quad), so
+    # they use plain Python floats instead of the vectorized versions below.
+    def dSigma_dE(self, eNu, eE):
+        if not self._eNu[0] <= eNu <= self._eNu[-1]:
+            return 0.
+        (i, fa) = self._scalar_row(eNu)
+        w = (eNu - self._eNu[i]) / (self._eNu[i+1] - self._eNu[i])
+        lo = self._lo[i] + (self._lo[i+1] - self._lo[i]) * w
+        hi = self._hi[i] + (self._hi[i+1] - self._hi[i]) * w
+        if not lo <= eE <= hi or hi <= lo:
+            return 0.
+        return self._scalar_interp(self.dE, self._x, i, fa, (eE - lo) / (hi - lo))
+
+    def dSigma_dCosT(self, eNu, cosT):
+        if not (self._eNu[0] <= eNu <= self._eNu[-1] and -1 <= cosT <= 1):
+            return 0.
+        (i, fa) = self._scalar_row(eNu)
+        return self._scalar_interp(self.dCosT, self._cosT, i, fa, (cosT + 1) / 2)
+
+    def dSigma_dE_vec(self, eNu, eE):
+        (eNu, eE) = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(eE, dtype=float))
+        (lo, hi) = (np.interp(eNu, self.eNu, self.lo), np.interp(eNu, self.eNu, self.hi))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = (eE - lo) / (hi - lo)
+        inside = (eNu >= self.eNu[0]) & (eNu <= self.eNu[-1]) & (x >= 0) & (x <= 1)
+        return np.where(inside, self._interp(self.dE, self._row(eNu), column(np.where(inside, x, 0), len(self.x) - 1)), 0.)
+
+    def dSigma_dCosT_vec(self, eNu, cosT):
+        (eNu, cosT) = np.broadcast_arrays(np.asarray(eNu, dtype=float), np.asarray(cosT, dtype=float))
+        inside = (eNu >= self.eNu[0]) & (eNu <= self.eNu[-1]) & (abs(cosT) <= 1)
+        return np.where(inside, self._interp(self.dCosT, self._row(eNu), column((cosT + 1) / 2, len(self.cosT) - 1)), 0.)
+
+    # (fractional) row of the tables that corresponds to eNu, see build()
+    def _row(self, eNu):
+        u = np.sqrt(np.clip((eNu - self.eNu[0]) / (self.eNu[-1] - self.eNu[0]), 0, 1))
+        return u * (len(self.eNu) - 1)
+
+    # scalar version of _row(): row i and fractional part fa
+    def _scalar_row(self, eNu):
+        n = len(self._eNu) - 1
+        u = sqrt(min(max((eNu - self._eNu[0]) / (self._eNu[-1] - self._eNu[0]), 0.), 1.)) * n
+        i = min(int(u), n - 1)
+        return (i, u - i)
+
+    # scalar version of _interp(table, row, column(x)), for row i + fa and the
+    # columns at positions `grid` (see column_grid())
+    @staticmethod
+    def _scalar_interp(table, grid, i, fa, x):
+        j = min(max(bisect_right(grid, x) - 1, 0), len(grid) - 2)
+        fb = min(max((x - grid[j]) / (grid[j+1] - grid[j]), 0.), 1.)
+        item = table.item
+        return ((1-fa) * ((1-fb) * item(i, j) + fb * item(i, j+1))
+                + fa * ((1-fb) * item(i+1, j) + fb * item(i+1, j+1)))
+
+    # bilinear interpolation in a table at fractional row & column indices fa, fb
+    @staticmethod
+    def _interp(table, fa, fb):
+        fa = np.clip(fa, 0, table.shape[0] - 1)
+        fb = np.clip(fb, 0, table.shape[1] - 1)
+        i = np.minimum(fa.astype(int), table.shape[0] - 2)
+        j = np.minimum(fb.astype(int), table.shape[1] - 2)
+        (fa, fb) = (fa - i, fb - j)
+        return ((1-fa) * ((1-fb) * table[i, j] + fb * table[i, j+1])
+                + fa * ((1-fb) * table[i+1, j] + fb * table[i+1, j+1]))
+
+    def check(self, n=100000, seed=0):
+        """Compare the tables with the analytic cross sections at random points.
+
+        Points are distributed uniformly in eNu and like the grid points in eE
+        and cosT, so each column of the tables is checked about equally often,
+        including the narrow ones close to the kinematic bounds, where cross
+        sections may change very quickly.
+        Returns the 99.9th percentile of the absolute deviation of dSigma_dE and
+        dSigma_dCosT, relative to the maximum of the cross section at that eNu.
+        A maximum deviation would not be useful here, since no table can
+        reproduce steps (e.g. at the Cherenkov threshold in `es`) exactly; these
+        only affect single cells.
+        """
+        rs = np.random.RandomState(seed)
+        like_grid = lambda grid: np.interp(rs.uniform(0, len(grid) - 1, n), np.arange(len(grid)), grid)
+        eNu = self.eNu[0] + (self.eNu[-1] - self.eNu[0]) * rs.random_sample(n)
+        row = self._row(eNu).round().astype(int)
+        # evaluate slightly inside of the kinematic bounds, like build()
+        (x, cosT) = (np.clip(like_grid(self.x), 1e-9, 1 - 1e-9), np.clip(like_grid(self.cosT), -1 + 1e-9, 1 - 1e-9))
+
+        errors = []
+        for (table, interp, analytic, values) in (
+                (self.dE, XSTable.dSigma_dE_vec, self.channel.dSigma_dE_vec,
+                 np.interp(eNu, self.eNu, self.lo) + x * np.interp(eNu, self.eNu, self.hi - self.lo)),
+                (self.dCosT, XSTable.dSigma_dCosT_vec, self.channel.dSigma_dCosT_vec, cosT)):
+            scale = np.asarray(table).max(axis=1)[row]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                exact = np.nan_to_num(analytic(eNu, values))
+            deviation = abs(interp(self, eNu, values) - exact)
+            # only compare values of eNu where the cross section is not zero
+            (deviation, scale) = (deviation[scale > 0], scale[scale > 0])
+            errors.append(np.percentile(deviation / scale, 99.9) if len(scale) else 0.)
+        return errors
+
+    def measure_speed(self, n=10000, seed=0):
+        """Measure how much faster the tables are than the analytic cross sections.
+
+        Returns the ratio of the time taken by the analytic function and by the
+        table for dSigma_dE, dSigma_dE_vec, dSigma_dCosT and dSigma_dCosT_vec
+        (in this order), for n random values (n/10 for the scalar functions).
+        Values below 1 mean that the table is slower. This is only reported by
+        main(); whether a table is used does not depend on it (see XSTable).
+        """
+        rs = np.random.RandomState(seed)
+        eNu = self.eNu[0] + (self.eNu[-1] - self.eNu[0]) * rs.random_sample(n)
+        eE = np.interp(eNu, self.eNu, self.lo) + rs.random_sample(n) * np.interp(eNu, self.eNu, self.hi - self.lo)
+        cosT = rs.uniform(-1, 1, n)
+
+        def duration(func, x, y, scalar):
+            durations = []
+            for _ in range(3):
+                start = time.time()
+                if scalar:
+                    for (_x, _y) in zip(x[:n//10].tolist(), y[:n//10].tolist()):
+                        func(_x, _y)
+                else:
+                    func(x, y)
+                durations.append(time.time() - start)
+            return min(durations)
+
+        speedups = []
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            for (func, values) in (("dSigma_dE", eE), ("dSigma_dCosT", cosT)):
+                for (suffix, scalar) in (("", True), ("_vec", False)):
+                    table = getattr(XSTable, func + suffix).__get__(self) # ignore fallbacks set in __init__
+                    analytic = getattr(self.channel, func + suffix)
+                    speedups.append(duration(analytic, eNu, values, scalar) / max(duration(table, eNu, values, scalar), 1e-9))
+        return speedups
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Directory to save the tables in. Required.")
+
+    choices = ["ibd", "es", "o16e", "o16eb"]
+    parser.add_argument("-c", "--channel", metavar="CHANNEL", choices=choices, nargs="+", default=choices,
+                        help="Interaction channel(s) to tabulate. Choices: %s. Default: all channels." % choices)
+    parser.add_argument("--check", action="store_true",
+                        help="Only check the accuracy of existing tables instead of building new ones.")
+    args = parser.parse_args()
+
+    for name in args.channel:
+        for flavor in import_module("interaction_channels." + name).Channel.possible_flavors:
+            if args.check:
+                (error_dE, error_dCosT) = XSTable(args.directory, name, flavor, tolerance=None).check()
+            else:
+                (error_dE, error_dCosT) = build(args.directory, name, flavor)
+            print "%s: relative error of dSigma_dE: %.1e, dSigma_dCosT: %.1e" \
+                % (table_name(name, flavor), error_dE, error_dCosT)
+            speedups = XSTable(args.directory, name, flavor, tolerance=None).speedups
+            print "    speedup of dSigma_dE: %.1fx (scalar), %.1fx (vectorized); dSigma_dCosT: %.1fx, %.1fx" \
+                % tuple(speedups)
+
+
+if __name__ == "__main__":
+    main()